@@ -1,24 +1,42 @@
 #!/usr/bin/env python3
 import os
 import sys
+import csv
+import io
 import json
+import contextlib
 import time
 import base64
-import requests
-import pandas as pd
+import binascii
+import hashlib
+import hmac
 import re
 import argparse
-from urllib.parse import urlparse
-from tqdm import tqdm
+import queue
+import random
+import signal
+import sqlite3
+import tempfile
+import threading
+from urllib.parse import urlparse, parse_qs
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from playwright.sync_api import sync_playwright
-from Crypto.Cipher import AES
-from Crypto.Util.Padding import unpad
+
+# requests, tqdm, Playwright, pycryptodome and asyncio are imported by the functions that
+# use them, so runs that never touch the network, a browser or an encrypted file skip them
 
 DRAMA_DETAILS_CSV = "drama_details.csv"
 DRAMA_SUBTITLES_CSV = "drama_subtitles.csv"
+CACHE_DB = "kisskh_cache.db"
+MANIFEST_DB = "kisskh_manifest.db"
+STORE_DIR = "kisskh_store"
+WATCH_DB = "kisskh_watch.db"
+INDEX_DB = "kisskh_index.db"
+QUEUE_DB = "kisskh_queue.db"
 OUTPUT_DIR = "dramas"
+BASE_URL = "https://kisskh.ovh"
+KKEY_TIMEOUT = 30000
+KKEY_HTTP_MAX_MISSES = 10
 
 KEY1 = b'AmSmZVcH93UQUezi'
 IV1 = b'ReBKWW8cqdjPEnF6'
@@ -26,6 +44,7 @@ KEY2 = b'8056483646328763'
 IV2 = b'6852612370185273'
 KEY3 = b'sWODXX04QRTkHdlZ'
 IV3 = b'8pwhapJeC4hrS9hO'
+AES_BLOCK = 16
 
 def current_time():
     return datetime.now().strftime("%H:%M:%S")
@@ -33,18 +52,24 @@ def current_time():
 def sanitize_filename(name):
     return re.sub(r'[\\/*?:"<>|]', '-', name)
 
+B64_LINE = re.compile(r"[A-Za-z0-9+/=]*")
+B64_LINE_BYTES = re.compile(rb"[A-Za-z0-9+/=]*")
+KEYS_BY_EXT = {
+    ".txt": (KEY2, IV2),
+    ".txt1": (KEY1, IV1),
+    ".txt2": (KEY3, IV3),
+    ".txt3": (KEY3, IV3),
+}
+
 def is_encrypted(line):
-    return len(line) > 10 and all(c in "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/=" for c in line.strip())
+    return len(line) > 10 and B64_LINE.fullmatch(line.strip()) is not None
 
 def decrypt_line(encrypted_line, file_ext):
+    from Crypto.Cipher import AES
+    from Crypto.Util.Padding import unpad
     try:
         encrypted_data = base64.b64decode(encrypted_line.strip())
-        key_iv = {
-            ".txt": (KEY2, IV2),
-            ".txt1": (KEY1, IV1),
-            ".txt2": (KEY3, IV3),
-            ".txt3": (KEY3, IV3),
-        }.get(file_ext, (KEY3, IV3))
+        key_iv = KEYS_BY_EXT.get(file_ext, (KEY3, IV3))
         cipher = AES.new(*key_iv, AES.MODE_CBC)
         return unpad(cipher.decrypt(encrypted_data), AES.block_size).decode("utf-8")
     except:
@@ -56,147 +81,3473 @@ def decrypt_line(encrypted_line, file_ext):
                 continue
     return encrypted_line
 
-def fetch_drama_data(start_id, end_id):
-    all_data = []
-    for drama_id in tqdm(range(start_id, end_id + 1), desc="Step 1: Drama metadata"):
-        try:
-            res = requests.get(f"https://kisskh.ovh/api/DramaList/Drama/{drama_id}", timeout=30)
-            if res.status_code != 200:
+class SubtitleDecryptor:
+    # Whole-file decryption. Every cue line is AES-CBC encrypted on its own with the same
+    # key/IV, so CBC is rebuilt on top of one reusable ECB cipher: all blocks of the file
+    # are decrypted in a single call and XORed with their chaining block (the IV for the
+    # first block of a line, the previous ciphertext block otherwise). The key is detected
+    # once per file from a sample; lines it cannot decrypt fall back to decrypt_line.
+
+    SAMPLE = 8
+
+    def __init__(self):
+        self._ciphers = {}
+
+    def _ecb(self, key):
+        cipher = self._ciphers.get(key)
+        if cipher is None:
+            from Crypto.Cipher import AES
+            cipher = self._ciphers[key] = AES.new(key, AES.MODE_ECB)
+        return cipher
+
+    @staticmethod
+    def candidates(ext):
+        preferred = KEYS_BY_EXT.get(ext, (KEY3, IV3))
+        return [preferred] + [pair for pair in ((KEY1, IV1), (KEY2, IV2), (KEY3, IV3)) if pair != preferred]
+
+    def decrypt_blobs(self, key, iv, blobs):
+        # Returns the decoded plaintext for each blob, or None where padding/UTF-8 is invalid
+        results = [None] * len(blobs)
+        index = [i for i, blob in enumerate(blobs) if blob and len(blob) % AES_BLOCK == 0]
+        if not index:
+            return results
+        joined = b"".join(blobs[i] for i in index)
+        chain = b"".join(iv + blobs[i][:-AES_BLOCK] for i in index)
+        plain = (int.from_bytes(self._ecb(key).decrypt(joined), "big") ^ int.from_bytes(chain, "big")).to_bytes(len(joined), "big")
+        offset = 0
+        for i in index:
+            chunk = plain[offset:offset + len(blobs[i])]
+            offset += len(blobs[i])
+            pad = chunk[-1]
+            if not 1 <= pad <= AES_BLOCK or chunk[-pad:] != bytes((pad,)) * pad:
+                continue
+            try:
+                results[i] = chunk[:-pad].decode("utf-8")
+            except UnicodeDecodeError:
                 continue
-            data = res.json()
-            episodes = data.get("episodes", [])
-            episode_details = "; ".join(f"Episode {ep.get('number')} (ID: {ep.get('id')}, Subtitles: {ep.get('sub')})" for ep in episodes)
-            all_data.append({
-                "Show ID": data.get("id"),
-                "Title": data.get("title"),
-                "Episode Details": episode_details.strip()
-            })
-        except Exception:
+        return results
+
+    def detect_key(self, blobs, ext):
+        sample = [blob for blob in blobs if blob][:self.SAMPLE]
+        for key, iv in self.candidates(ext):
+            if sample and all(text is not None for text in self.decrypt_blobs(key, iv, sample)):
+                return key, iv
+        return None
+
+    def decrypt(self, data, ext):
+        # bytes in, bytes out; newlines are normalised the way text-mode reading did
+        lines = data.replace(b"\r\n", b"\n").replace(b"\r", b"\n").splitlines(keepends=True)
+        encrypted = [i for i, line in enumerate(lines) if len(line) > 10 and B64_LINE_BYTES.fullmatch(line.strip())]
+        if not encrypted:
+            return b"".join(lines)
+        blobs = []
+        for i in encrypted:
+            try:
+                blobs.append(binascii.a2b_base64(lines[i].strip()))
+            except binascii.Error:
+                blobs.append(b"")
+        key_iv = self.detect_key(blobs, ext)
+        texts = self.decrypt_blobs(*key_iv, blobs) if key_iv else [None] * len(blobs)
+        for i, text in zip(encrypted, texts):
+            if text is None:
+                text = decrypt_line(lines[i].decode("utf-8", "replace"), ext)
+            lines[i] = text.encode("utf-8") + b"\n"
+        return b"".join(lines)
+
+def decrypt_subtitle(data, ext):
+    return SubtitleDecryptor().decrypt(data, ext)
+
+SRT_TIMING = re.compile(r"(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})\s*-->\s*(\d+):(\d{1,2}):(\d{1,2})[,.](\d{1,3})")
+
+class Cue:
+    # One subtitle cue: start/end in milliseconds and its text lines joined by "\n"
+    __slots__ = ("start", "end", "text")
+
+    def __init__(self, start, end, text):
+        self.start = start
+        self.end = end
+        self.text = text
+
+def timing_ms(h, m, s, ms):
+    return ((int(h) * 60 + int(m)) * 60 + int(s)) * 1000 + int(ms.ljust(3, "0"))
+
+def iter_cues(lines):
+    # Streaming SRT parser over decrypted text lines: cues are yielded as soon as they end.
+    # BOMs and CR are dropped, index lines are ignored (also when the blank line before them
+    # is missing) and cues without text are skipped.
+    start = end = None
+    text = []
+    for line in lines:
+        line = line.strip().lstrip("\ufeff")
+        timing = SRT_TIMING.match(line)
+        if timing:
+            if text and text[-1].isdigit():
+                text.pop()
+            if start is not None and text:
+                yield Cue(start, end, "\n".join(text))
+            start, end = timing_ms(*timing.groups()[:4]), timing_ms(*timing.groups()[4:])
+            text = []
+        elif not line:
+            if start is not None and text:
+                yield Cue(start, end, "\n".join(text))
+            start, text = None, []
+        elif start is not None:
+            text.append(line)
+    if start is not None and text:
+        yield Cue(start, end, "\n".join(text))
+
+def clean_cues(cues, merge_gap=0):
+    # Collapses runs of spaces, drops cues with no text or no duration, and folds a cue
+    # that repeats the previous cue's text into it when it starts within merge_gap ms of its end
+    previous = None
+    for cue in cues:
+        cue.text = "\n".join(" ".join(line.split()) for line in cue.text.split("\n") if line.strip())
+        if not cue.text or cue.end <= cue.start:
             continue
-    pd.DataFrame(all_data).to_csv(DRAMA_DETAILS_CSV, index=False, encoding="utf-8-sig")
+        if previous is not None and cue.text == previous.text and cue.start <= previous.end + merge_gap:
+            previous.end = max(previous.end, cue.end)
+            continue
+        if previous is not None:
+            yield previous
+        previous = cue
+    if previous is not None:
+        yield previous
+
+def merge_dual(primary, secondary):
+    # One track with each primary cue's text above the text of the secondary cues it overlaps;
+    # secondary cues that overlap no primary cue are kept on their own
+    merged = []
+    used = set()
+    first = 0
+    for cue in primary:
+        while first < len(secondary) and secondary[first].end <= cue.start:
+            first += 1
+        lines = [cue.text]
+        for index in range(first, len(secondary)):
+            other = secondary[index]
+            if other.start >= cue.end:
+                break
+            if other.end > cue.start:
+                lines.append(other.text)
+                used.add(index)
+        merged.append(Cue(cue.start, cue.end, "\n".join(lines)))
+    merged += [cue for index, cue in enumerate(secondary) if index not in used]
+    merged.sort(key=lambda cue: cue.start)
+    return merged
+
+class CueWriter:
+    # Renders cues of one format into memory, numbering them as they are written
+    ext = None
+    header = ""
+
+    def __init__(self):
+        self.out = io.StringIO()
+        self.out.write(self.header)
+        self.count = 0
+
+    def write(self, cue):
+        self.count += 1
+        self.out.write(self.format(cue))
+
+    def getvalue(self):
+        return self.out.getvalue().encode("utf-8")
+
+class SrtWriter(CueWriter):
+    ext = ".srt"
+
+    @staticmethod
+    def timestamp(ms):
+        return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+    def format(self, cue):
+        return f"{self.count}\n{self.timestamp(cue.start)} --> {self.timestamp(cue.end)}\n{cue.text}\n\n"
+
+class VttWriter(CueWriter):
+    ext = ".vtt"
+    header = "WEBVTT\n\n"
+
+    @staticmethod
+    def timestamp(ms):
+        return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000:03d}"
+
+    def format(self, cue):
+        return f"{self.timestamp(cue.start)} --> {self.timestamp(cue.end)}\n{cue.text.replace('-->', '->')}\n\n"
+
+class AssWriter(CueWriter):
+    ext = ".ass"
+    header = ("[Script Info]\nScriptType: v4.00+\nPlayResX: 384\nPlayResY: 288\nWrapStyle: 0\nScaledBorderAndShadow: yes\n\n"
+              "[V4+ Styles]\nFormat: Name, Fontname, Fontsize, PrimaryColour, SecondaryColour, OutlineColour, BackColour, Bold, "
+              "Italic, Underline, StrikeOut, ScaleX, ScaleY, Spacing, Angle, BorderStyle, Outline, Shadow, Alignment, MarginL, "
+              "MarginR, MarginV, Encoding\nStyle: Default,Arial,16,&H00FFFFFF,&H000000FF,&H00000000,&H80000000,0,0,0,0,100,100,"
+              "0,0,1,1,1,2,10,10,10,1\n\n"
+              "[Events]\nFormat: Layer, Start, End, Style, Name, MarginL, MarginR, MarginV, Effect, Text\n")
+    TAGS = {"<i>": r"{\i1}", "</i>": r"{\i0}", "<b>": r"{\b1}", "</b>": r"{\b0}", "<u>": r"{\u1}", "</u>": r"{\u0}"}
+    TAG = re.compile(r"</?[a-zA-Z][^>]*>")
+
+    @staticmethod
+    def timestamp(ms):
+        return f"{ms // 3600000}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d}.{ms % 1000 // 10:02d}"
+
+    def format(self, cue):
+        text = self.TAG.sub(lambda tag: self.TAGS.get(tag.group(0).lower(), ""), cue.text).replace("\n", r"\N")
+        return f"Dialogue: 0,{self.timestamp(cue.start)},{self.timestamp(cue.end)},Default,,0,0,0,,{text}\n"
+
+CUE_WRITERS = {"srt": SrtWriter, "vtt": VttWriter, "ass": AssWriter}
+
+class SubtitlePostProcessor:
+    # Step 3 post-processing in the same pass as decryption: the decrypted text is parsed
+    # into cues once, optionally cleaned, and rendered in every requested format. The .srt
+    # is returned to the caller (store, manifest and skip-unchanged handle it as before),
+    # other formats are written next to it. With `dual`, the cues of those two languages
+    # are kept per episode and merged into one "<label1>+<label2>" track once both are saved.
+
+    def __init__(self, formats=("srt",), clean=False, merge_gap=0, dual=None):
+        self.formats = list(dict.fromkeys(formats))
+        self.clean = clean
+        self.merge_gap = merge_gap
+        self.dual = tuple(dual) if dual else None
+        # Store key suffix of the .srt this produces: only --clean changes the .srt itself
+        self.variant = f"clean,gap={merge_gap}" if clean else ""
+        self.stats = {"cues": 0, "files": 0, "dual": 0, "seconds": 0.0}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def sidecars(self, final_file):
+        stem = os.path.splitext(final_file)[0]
+        return {fmt: stem + CUE_WRITERS[fmt].ext for fmt in self.formats if fmt != "srt"}
+
+    def render(self, data, final_file, ep_id=None, entry=None, srt=True):
+        # Returns the .srt content to save: `data` itself unless cues are cleaned
+        start = time.perf_counter()
+        cues = iter_cues(io.StringIO(data.decode("utf-8-sig", "replace")))
+        if self.clean:
+            cues = clean_cues(cues, self.merge_gap)
+        writers = {fmt: CUE_WRITERS[fmt]() for fmt in self.sidecars(final_file)}
+        if srt and self.clean:
+            writers["srt"] = SrtWriter()
+        kept = [] if self.dual and entry and entry.get("land") in self.dual else None
+        count = 0
+        for cue in cues:
+            count += 1
+            for writer in writers.values():
+                writer.write(cue)
+            if kept is not None:
+                kept.append(cue)
+        for fmt, path in self.sidecars(final_file).items():
+            write_atomic(path, writers[fmt].getvalue())
+        if kept is not None:
+            with self._lock:
+                self._pending.setdefault(ep_id, {})[entry["land"]] = (entry["label"], kept)
+        with self._lock:
+            self.stats["cues"] += count
+            self.stats["files"] += 1
+            self.stats["seconds"] += time.perf_counter() - start
+        return writers["srt"].getvalue() if "srt" in writers else data
+
+    def reuse(self, final_file, ep_id=None, entry=None):
+        # A track whose .srt was not rewritten (store hit, 304): only missing sidecars and
+        # dual-track cues need it, and then the .srt on disk is their only source
+        needed = any(not os.path.exists(path) for path in self.sidecars(final_file).values())
+        if needed or (self.dual and entry and entry.get("land") in self.dual):
+            with open(final_file, "rb") as f:
+                self.render(f.read(), final_file, ep_id, entry, srt=False)
+
+    def finish_episode(self, ep_id, folder):
+        with self._lock:
+            tracks = self._pending.pop(ep_id, {})
+        if not self.dual or any(lang not in tracks for lang in self.dual):
+            return
+        (top_label, top), (bottom_label, bottom) = tracks[self.dual[0]], tracks[self.dual[1]]
+        merged = merge_dual(top, bottom)
+        for fmt in dict.fromkeys(["srt"] + self.formats):
+            writer = CUE_WRITERS[fmt]()
+            for cue in merged:
+                writer.write(cue)
+            write_atomic(os.path.join(folder, f"{top_label}+{bottom_label}{writer.ext}"), writer.getvalue())
+        with self._lock:
+            self.stats["dual"] += 1
+
+    def summary(self):
+        rate = self.stats["cues"] / self.stats["seconds"] if self.stats["seconds"] else 0
+        line = (f"[INFO] Post-processing: {self.stats['cues']} cue(s) in {self.stats['files']} file(s), {rate:,.0f} cues/s; "
+                f"formats {','.join(self.formats)}{', cleaned' if self.clean else ''}")
+        if self.dual:
+            line += f"; {self.stats['dual']} dual track(s) {'+'.join(self.dual)}"
+        return line
+
+def add_capture_arguments(parser, threads_help="Number of browsers in the kkey capture pool"):
+    # Step 2 options shared by the main command, watch and worker
+    parser.add_argument("-t", "--threads", type=int, default=6, help=threads_help)
+    parser.add_argument("-r", "--recycle", type=int, default=25, help="Replace a browser page after this many navigations")
+    parser.add_argument("-k", "--kkey", choices=["auto", "http", "browser"], default="auto", help="kkey providers: browsers, with plain HTTP first when --kkey-endpoint is set, or only one of them")
+    parser.add_argument("--kkey-endpoint", type=str, help="URL template of a kkey token service, e.g. http://host/token?ep={ep_id}")
+    parser.add_argument("--base-url", type=str, default=BASE_URL, help="Site root, e.g. a local stub server")
+
+def add_download_arguments(parser):
+    # Step 3 options shared by the main command, watch and worker
+    parser.add_argument("-l", "--langs", type=str, help="Comma-separated language codes to keep (en,hi,etc)")
+    parser.add_argument("--dl-workers", type=int, default=8, help="Concurrent subtitle downloads in Step 3")
+    parser.add_argument("--dl-rate", type=float, default=5, help="Max subtitle requests per second per host (0 = unlimited)")
+    parser.add_argument("--dl-inflight", type=int, default=4, help="Max concurrent subtitle requests per host")
+    parser.add_argument("--skip-unchanged", action="store_true", help="Leave an existing .srt untouched when the new content is identical")
+    parser.add_argument("--index", nargs="?", const=INDEX_DB, help=f"Add every saved track to the subtitle search index (default file: {INDEX_DB})")
+    parser.add_argument("--store", nargs="?", const=STORE_DIR, help=f"Content-addressed subtitle store; episode files become hardlinks (default dir: {STORE_DIR})")
+    parser.add_argument("--manifest", type=str, default=MANIFEST_DB, help="Run manifest recording per-episode and per-track progress")
+
+def parse_langs(value):
+    # Normalize and sanitize language codes (en.hi → en,hi → {"en", "hi"})
+    return {lang for lang in re.split(r"[,.\s]+", value.strip()) if lang} if value else None
+
+def add_post_arguments(parser, dual=True):
+    parser.add_argument("--formats", type=str, default="srt", help="Comma-separated outputs written per track: srt, vtt, ass (default: srt)")
+    parser.add_argument("--clean", action="store_true", help="Renumber cues, normalise BOM/CRLF/whitespace, drop empty cues and merge repeated ones")
+    parser.add_argument("--merge-gap", type=int, default=0, help="With --clean, merge a repeated cue starting within this many ms of the previous one")
+    if dual:
+        parser.add_argument("--dual", type=str, help="Two language codes (e.g. en,id) merged into one <Label1>+<Label2> track per episode")
+
+def post_processor(args, parser):
+    # SubtitlePostProcessor for --formats/--clean/--dual, or None when .srt files are saved verbatim
+    formats = [fmt for fmt in re.split(r"[,.\s]+", args.formats.strip().lower()) if fmt]
+    unknown = [fmt for fmt in formats if fmt not in CUE_WRITERS]
+    if unknown:
+        parser.error(f"unknown subtitle format(s): {', '.join(unknown)} (choose from {', '.join(CUE_WRITERS)})")
+    dual = [lang for lang in re.split(r"[,.\s]+", args.dual.strip()) if lang] if getattr(args, "dual", None) else None
+    if dual and len(dual) != 2:
+        parser.error("--dual takes exactly two language codes, e.g. en,id")
+    if formats == ["srt"] and not args.clean and not dual:
+        return None
+    return SubtitlePostProcessor(formats or ["srt"], args.clean, args.merge_gap, dual)
+
+EPISODE_FIELDS = ["Show ID", "Title", "Episode Number", "Episode ID", "Subtitles"]
+TRACK_FIELDS = ["Show ID", "Title", "Episode Number", "Episode ID", "Language", "Label", "Default", "URL"]
+
+def episode_number(value):
+    # 8.0 -> "8", 12.5 -> "12.5": half episodes keep their own number and folder
+    number = float(value)
+    return str(int(number)) if number.is_integer() else str(number)
+
+def drama_record(data):
+    return {
+        "Show ID": data.get("id"),
+        "Title": data.get("title"),
+        "Episodes": [{"number": episode_number(ep.get("number")), "id": ep.get("id"), "sub": ep.get("sub") or 0}
+                     for ep in data.get("episodes", []) if ep.get("number") is not None],
+    }
+
+def episode_rows(drama):
+    return [{"Show ID": drama["Show ID"], "Title": drama["Title"], "Episode Number": ep["number"],
+             "Episode ID": ep["id"], "Subtitles": ep["sub"]} for ep in drama["Episodes"]]
+
+def track_rows(show_id, title, ep_num, ep_id, subs):
+    return [{"Show ID": show_id, "Title": title, "Episode Number": ep_num, "Episode ID": ep_id,
+             "Language": entry.get("land"), "Label": entry.get("label"), "Default": bool(entry.get("default")),
+             "URL": entry.get("src")} for entry in subs]
+
+def track_entry(row):
+    return {"src": row["URL"], "label": row["Label"], "land": row["Language"], "default": row["Default"] == "True"}
+
+class RecordWriter:
+    # Streams rows to a CSV file as they are produced; each batch is flushed so an
+    # interrupted run still leaves every completed row on disk.
+    def __init__(self, path, fields, append=False):
+        self.path = path
+        header = not (append and os.path.isfile(path) and os.path.getsize(path))
+        self._file = open(path, "a" if append else "w", newline="", encoding="utf-8-sig")
+        self._writer = csv.DictWriter(self._file, fieldnames=fields, lineterminator="\n")
+        if header:
+            self._writer.writeheader()
+        self._lock = threading.Lock()
+        self.rows = 0
+
+    def write_rows(self, rows):
+        with self._lock:
+            self._writer.writerows(rows)
+            self._file.flush()
+            self.rows += len(rows)
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def read_rows(path, filters=None):
+    # filters maps a column to the set of accepted values; empty sets accept everything
+    filters = {column: {str(value) for value in accepted} for column, accepted in (filters or {}).items() if accepted}
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in csv.DictReader(f):
+            if all(row.get(column) in accepted for column, accepted in filters.items()):
+                yield row
+
+def load_dramas(path=DRAMA_DETAILS_CSV, shows=None, eps=None):
+    dramas = {}
+    for row in read_rows(path, {"Show ID": shows}):
+        drama = dramas.setdefault(row["Show ID"], {"Show ID": int(row["Show ID"]), "Title": row["Title"], "Episodes": []})
+        if "Episode Details" in row:
+            # Files written before one-row-per-episode storage
+            drama["Episodes"].extend(parse_episode_details(row["Episode Details"]))
+        else:
+            drama["Episodes"].append({"number": episode_number(row["Episode Number"]), "id": int(row["Episode ID"]), "sub": int(row["Subtitles"] or 0)})
+    if eps:
+        for drama in dramas.values():
+            drama["Episodes"] = [ep for ep in drama["Episodes"] if ep["number"] in eps]
+    return list(dramas.values())
+
+def load_tracks(path=DRAMA_SUBTITLES_CSV, shows=None, eps=None, langs=None):
+    return read_rows(path, {"Show ID": shows, "Episode Number": eps, "Language": langs})
+
+def read_header(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return next(csv.reader(f), [])
+
+def load_known_tracks(path, dramas, shows=None, eps=None):
+    # {episode ID: subtitle list} from drama_subtitles.csv for --meta-skip. Files written
+    # before one-row-per-track storage (Title, Episode Number, Subtitle Data as JSON) carry
+    # no IDs, so their rows are matched to the episodes of `dramas` by title and number.
+    header = set(read_header(path))
+    known = {}
+    if header >= set(TRACK_FIELDS):
+        for row in load_tracks(path, shows, eps):
+            known.setdefault(int(row["Episode ID"]), []).append(track_entry(row))
+    elif header >= {"Title", "Episode Number", "Subtitle Data"}:
+        ids = {(drama["Title"], ep["number"]): ep["id"] for drama in dramas for ep in drama["Episodes"]}
+        for row in read_rows(path):
+            try:
+                ep_id = ids.get((row["Title"], episode_number(row["Episode Number"])))
+                if ep_id is not None:
+                    known[ep_id] = json.loads(row["Subtitle Data"])
+            except (TypeError, ValueError):
+                # Refetched like an episode that is not in the file
+                continue
+        print(f"[INFO] {path} uses the old one-row-per-episode layout; reusing {len(known)} episode(s) from it")
+    else:
+        raise ValueError(f"{path} is not a subtitle metadata file (columns: {', '.join(sorted(header)) or 'none'}); "
+                         f"move it away or run without --meta-skip")
+    return known
+
+class TokenBucket:
+    # Thread-safe token bucket: acquire() blocks until a token is available
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1.0, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+
+    def _take(self):
+        # Takes a token and returns 0, or returns the seconds until one is available
+        if self._closed.is_set():
+            raise InterruptedError("rate limiter closed")
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            self._closed.wait(wait)
+
+    async def acquire_async(self):
+        # acquire() for the async engine: sleeps on the event loop instead of blocking it
+        import asyncio
+        if self.rate <= 0:
+            return
+        while True:
+            wait = self._take()
+            if not wait:
+                return
+            await asyncio.sleep(wait)
+
+    def close(self):
+        # Wakes every waiter; acquire raises InterruptedError from now on
+        self._closed.set()
+
+class PooledSession:
+    # requests.Session with a connection pool of pool_size per host, created on the first
+    # request so that a run served entirely from the cache never imports requests
+    def __init__(self, pool_size=10):
+        self.pool_size = pool_size
+        self._session = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        import requests
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def get(self, url, **kwargs):
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    self._session = self._open()
+        return self._session.get(url, **kwargs)
+
+def make_session(pool_size=10):
+    return PooledSession(pool_size)
+
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+def get_with_retry(session, url, retries=4, backoff=1.0, limiter=None, **kwargs):
+    # Retries 429/5xx and connection errors with exponential backoff (honouring Retry-After)
+    import requests
+    kwargs.setdefault("timeout", 30)
+    for attempt in range(retries + 1):
+        if limiter:
+            limiter.acquire()
+        try:
+            res = session.get(url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as e:
+            if attempt == retries:
+                raise
+            METRICS.retry(failure_cause(e))
+            delay = backoff * 2 ** attempt
+        else:
+            if res.status_code not in RETRY_STATUS or attempt == retries:
+                return res
+            METRICS.retry(f"http_{res.status_code}")
+            retry_after = res.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        time.sleep(delay)
+
+async def get_with_retry_async(session, url, retries=4, backoff=1.0, limiter=None, headers=None):
+    # get_with_retry on an aiohttp session; returns (status, headers, body)
+    import asyncio
+    import aiohttp
+    for attempt in range(retries + 1):
+        if limiter:
+            await limiter.acquire_async()
+        try:
+            async with session.get(url, headers=headers or {}) as res:
+                status, res_headers, body = res.status, res.headers, await res.read()
+        except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+            if attempt == retries:
+                raise
+            METRICS.retry(failure_cause(e))
+            delay = backoff * 2 ** attempt
+        else:
+            if status not in RETRY_STATUS or attempt == retries:
+                return status, res_headers, body
+            METRICS.retry(f"http_{status}")
+            retry_after = res_headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        await asyncio.sleep(delay)
+
+class ResponseCounter:
+    # 200 / 304 / 404 / error tallies per kind of request, for the end-of-run summary
+
+    KEYS = ("200", "304", "404", "error")
+
+    def __init__(self):
+        self.counts = {}
+        self._lock = threading.Lock()
+
+    def count(self, kind, status):
+        key = str(status) if str(status) in self.KEYS else "error"
+        with self._lock:
+            self.counts.setdefault(kind, dict.fromkeys(self.KEYS, 0))[key] += 1
+
+    def summary(self):
+        parts = [f"{kind} " + ", ".join(f"{key} {value}" for key, value in counts.items() if value or key != "404")
+                 for kind, counts in sorted(self.counts.items())]
+        return "[INFO] HTTP responses: " + ("; ".join(parts) if parts else "none")
+
+RESPONSES = ResponseCounter()
+
+def failure_cause(error):
+    # Only libraries that are already loaded can have raised `error`, so none is imported here
+    requests = sys.modules.get("requests")
+    playwright = sys.modules.get("playwright.sync_api") or sys.modules.get("playwright.async_api")
+    asyncio = sys.modules.get("asyncio")
+    if (isinstance(error, TimeoutError) or (requests and isinstance(error, requests.Timeout))
+            or (playwright and isinstance(error, playwright.TimeoutError)) or (asyncio and isinstance(error, asyncio.TimeoutError))):
+        return "timeout"
+    aiohttp = sys.modules.get("aiohttp")
+    if (requests and isinstance(error, requests.ConnectionError)) or (aiohttp and isinstance(error, aiohttp.ClientConnectionError)):
+        return "connection"
+    if isinstance(error, ValueError):
+        return "invalid_response"
+    return type(error).__name__
+
+class DurationStats:
+    # Count, sum and max of a stream of durations, plus a uniform reservoir sample of at
+    # most `size` of them for p50/p95, so a stage costs the same memory on any run length.
+
+    def __init__(self, size=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.size = size
+        self.sample = []
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.sample) < self.size:
+            self.sample.append(seconds)
+        else:
+            slot = random.randrange(self.count)
+            if slot < self.size:
+                self.sample[slot] = seconds
+
+    def stats(self):
+        return {"count": self.count, "total_s": round(self.total, 3), "avg_s": round(self.total / self.count, 4),
+                "p50_s": round(percentile(self.sample, 50), 4), "p95_s": round(percentile(self.sample, 95), 4),
+                "max_s": round(self.max, 4)}
+
+class Metrics:
+    # Run-wide instrumentation: durations per stage, failures by stage and cause, retries
+    # by cause, bytes per kind and in-flight gauges with their peaks. Durations per episode
+    # are only kept when per_episode is set (--metrics-json). Exported as a JSON run report
+    # and as a Prometheus text file.
+
+    def __init__(self):
+        self.started = time.time()
+        self.samples = {}
+        self.per_episode = False
+        self.episodes = {}
+        self.failures = {}
+        self.retries = {}
+        self.bytes = {}
+        self.gauges = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds, ep_id=None):
+        with self._lock:
+            self.samples.setdefault(stage, DurationStats()).add(seconds)
+            if ep_id is not None and self.per_episode:
+                episode = self.episodes.setdefault(str(ep_id), {})
+                episode[stage] = episode.get(stage, 0.0) + seconds
+
+    @contextlib.contextmanager
+    def timer(self, stage, ep_id=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start, ep_id)
+
+    def fail(self, stage, cause):
+        with self._lock:
+            self.failures[(stage, cause)] = self.failures.get((stage, cause), 0) + 1
+
+    def retry(self, cause):
+        with self._lock:
+            self.retries[cause] = self.retries.get(cause, 0) + 1
+
+    def add_bytes(self, kind, size):
+        with self._lock:
+            self.bytes[kind] = self.bytes.get(kind, 0) + size
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            gauge = self.gauges.setdefault(name, [0, 0])
+            gauge[0] = value
+            gauge[1] = max(gauge[1], value)
+
+    @contextlib.contextmanager
+    def inflight(self, name):
+        with self._lock:
+            gauge = self.gauges.setdefault(name, [0, 0])
+            gauge[0] += 1
+            gauge[1] = max(gauge[1], gauge[0])
+        try:
+            yield
+        finally:
+            with self._lock:
+                gauge[0] -= 1
+
+    def stage_stats(self):
+        with self._lock:
+            return {stage: stats.stats() for stage, stats in sorted(self.samples.items())}
+
+    def report(self):
+        with self._lock:
+            failures = {f"{stage}:{cause}": count for (stage, cause), count in sorted(self.failures.items())}
+            report = {
+                "started": datetime.fromtimestamp(self.started).isoformat(timespec="seconds"),
+                "duration_s": round(time.time() - self.started, 3),
+                "failures": failures,
+                "retries": dict(sorted(self.retries.items())),
+                "bytes": dict(sorted(self.bytes.items())),
+                "peak_inflight": {name: gauge[1] for name, gauge in sorted(self.gauges.items())},
+                "http_responses": {kind: dict(counts) for kind, counts in RESPONSES.counts.items()},
+            }
+            if self.per_episode:
+                report["episodes"] = {ep_id: {stage: round(value, 4) for stage, value in stages.items()}
+                                      for ep_id, stages in self.episodes.items()}
+        report["stages"] = self.stage_stats()
+        return report
+
+    def write_json(self, path):
+        write_atomic(path, json.dumps(self.report(), indent=2).encode("utf-8"))
+
+    def write_prometheus(self, path):
+        report = self.report()
+        lines = ["# HELP kisskh_stage_seconds Time spent per stage.", "# TYPE kisskh_stage_seconds summary"]
+        for stage, stats in report["stages"].items():
+            lines.append(f'kisskh_stage_seconds{{stage="{stage}",quantile="0.5"}} {stats["p50_s"]}')
+            lines.append(f'kisskh_stage_seconds{{stage="{stage}",quantile="0.95"}} {stats["p95_s"]}')
+            lines.append(f'kisskh_stage_seconds_sum{{stage="{stage}"}} {stats["total_s"]}')
+            lines.append(f'kisskh_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines += ["# HELP kisskh_failures_total Failures by stage and cause.", "# TYPE kisskh_failures_total counter"]
+        for key, count in report["failures"].items():
+            stage, cause = key.split(":", 1)
+            lines.append(f'kisskh_failures_total{{stage="{stage}",cause="{cause}"}} {count}')
+        lines += ["# HELP kisskh_retries_total Retried requests by cause.", "# TYPE kisskh_retries_total counter"]
+        lines += [f'kisskh_retries_total{{cause="{cause}"}} {count}' for cause, count in report["retries"].items()]
+        lines += ["# HELP kisskh_bytes_total Bytes received by kind.", "# TYPE kisskh_bytes_total counter"]
+        lines += [f'kisskh_bytes_total{{kind="{kind}"}} {size}' for kind, size in report["bytes"].items()]
+        lines += ["# HELP kisskh_inflight_peak Highest number of concurrent operations.", "# TYPE kisskh_inflight_peak gauge"]
+        lines += [f'kisskh_inflight_peak{{name="{name}"}} {peak}' for name, peak in report["peak_inflight"].items()]
+        lines += ["# HELP kisskh_http_responses_total Responses by request kind and status.", "# TYPE kisskh_http_responses_total counter"]
+        lines += [f'kisskh_http_responses_total{{kind="{kind}",status="{status}"}} {count}'
+                  for kind, counts in report["http_responses"].items() for status, count in counts.items()]
+        lines += ["# HELP kisskh_run_duration_seconds Wall time of the run.", "# TYPE kisskh_run_duration_seconds gauge",
+                  f"kisskh_run_duration_seconds {report['duration_s']}"]
+        write_atomic(path, ("\n".join(lines) + "\n").encode("utf-8"))
+
+    def summary(self):
+        lines = ["[INFO] Stage timings:"]
+        for stage, stats in self.stage_stats().items():
+            lines.append(f"  {stage:<15} {stats['count']:>6}x  avg {stats['avg_s'] * 1000:>8.1f}ms  p50 {stats['p50_s'] * 1000:>8.1f}ms  "
+                         f"p95 {stats['p95_s'] * 1000:>8.1f}ms  total {stats['total_s']:>8.1f}s")
+        with self._lock:
+            if self.failures:
+                lines.append("  failures: " + ", ".join(f"{stage} {cause} {count}" for (stage, cause), count in sorted(self.failures.items())))
+            if self.retries:
+                lines.append("  retries: " + ", ".join(f"{cause} {count}" for cause, count in sorted(self.retries.items())))
+            if self.gauges:
+                lines.append("  peak in flight: " + ", ".join(f"{name} {gauge[1]}" for name, gauge in sorted(self.gauges.items())))
+        return "\n".join(lines)
+
+METRICS = Metrics()
+
+class EventStream:
+    # JSON-lines channel for front-ends (--events): one object per line on stdout, next to
+    # the plain [INFO]/[WARN] lines. Progress bars report here instead of drawing.
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.null = open(os.devnull, "w")
+        self._lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        line = json.dumps({"event": event, "time": round(time.time(), 3), **fields}, ensure_ascii=False)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+EVENTS = None
+
+_stage_bar_class = None
+
+def stage_bar(stage, **kwargs):
+    # tqdm bar of one pipeline stage; with --events every redraw (throttled by tqdm's
+    # mininterval) becomes a "progress" event and nothing is drawn. tqdm is imported
+    # with the first bar.
+    global _stage_bar_class
+    if _stage_bar_class is None:
+        from tqdm import tqdm
+
+        class StageBar(tqdm):
+            def __init__(self, *args, stage=None, **kwargs):
+                self.stage = stage
+                if EVENTS is not None:
+                    kwargs["file"] = EVENTS.null
+                    kwargs.setdefault("mininterval", 0.25)
+                super().__init__(*args, **kwargs)
+
+            def display(self, msg=None, pos=None):
+                if EVENTS is None:
+                    return super().display(msg, pos)
+                stats = self.format_dict
+                EVENTS.emit("progress", stage=self.stage, done=stats["n"], total=stats["total"] or 0,
+                            elapsed=round(stats["elapsed"], 2), postfix=stats.get("postfix") or "")
+                return True
+
+        _stage_bar_class = StageBar
+    return _stage_bar_class(stage=stage, **kwargs)
+
+class MetaCache:
+    # SQLite cache of drama JSON (by Show ID) and /api/Sub lists (by episode ID).
+    # Airing dramas get a short TTL, finished ones a long one; subtitle lists inherit
+    # their drama's TTL and are also refetched when the episode's `sub` count changes.
+    # Entries are evicted least-recently-used once the cache grows past max_bytes.
+    # ETag/Last-Modified of drama and subtitle URLs are kept so that refetches are
+    # conditional and a 304 reuses what is already on disk.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS dramas (
+            show_id INTEGER PRIMARY KEY, body TEXT NOT NULL, airing INTEGER NOT NULL,
+            fetched_at REAL NOT NULL, ttl REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL);
+        CREATE TABLE IF NOT EXISTS subs (
+            ep_id INTEGER PRIMARY KEY, show_id INTEGER NOT NULL, sub_count INTEGER, body TEXT NOT NULL,
+            fetched_at REAL NOT NULL, ttl REAL NOT NULL, accessed_at REAL NOT NULL, size INTEGER NOT NULL);
+        CREATE INDEX IF NOT EXISTS subs_show ON subs (show_id);
+        CREATE TABLE IF NOT EXISTS validators (
+            url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, sha256 TEXT, updated_at REAL NOT NULL);
+    """
+
+    def __init__(self, path=CACHE_DB, max_bytes=256 * 1024 * 1024, airing_ttl=6 * 3600, finished_ttl=30 * 86400):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.airing_ttl = airing_ttl
+        self.finished_ttl = finished_ttl
+        self.stats = {"drama_hits": 0, "drama_misses": 0, "subs_hits": 0, "subs_misses": 0, "evicted": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    @staticmethod
+    def is_airing(data):
+        return data.get("status") != "Completed" or any(not ep.get("sub") for ep in data.get("episodes", []))
+
+    def _count(self, key):
+        self.stats[key] += 1
+
+    def get_drama(self, show_id):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, fetched_at, ttl FROM dramas WHERE show_id = ?", (int(show_id),)).fetchone()
+            if row is None or row[1] + row[2] < now:
+                self._count("drama_misses")
+                return None
+            self._db.execute("UPDATE dramas SET accessed_at = ? WHERE show_id = ?", (now, int(show_id)))
+            self._db.commit()
+            self._count("drama_hits")
+        return json.loads(row[0])
+
+    def put_drama(self, data):
+        body = json.dumps(data, ensure_ascii=False)
+        airing = self.is_airing(data)
+        now = time.time()
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO dramas VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (int(data["id"]), body, int(airing), now, self.airing_ttl if airing else self.finished_ttl, now, len(body)))
+            self._db.commit()
+            self._evict()
+
+    def revalidated_drama(self, show_id):
+        # Cached body of a drama the server answered 304 for; its TTL starts over
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body FROM dramas WHERE show_id = ?", (int(show_id),)).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE dramas SET fetched_at = ?, accessed_at = ? WHERE show_id = ?", (now, now, int(show_id)))
+            self._db.commit()
+        return json.loads(row[0])
+
+    def conditional_headers(self, url, sha256=None):
+        # If-None-Match/If-Modified-Since for url; with sha256, only if it matches what was saved
+        with self._lock:
+            row = self._db.execute("SELECT etag, last_modified, sha256 FROM validators WHERE url = ?", (url,)).fetchone()
+        if row is None or (sha256 is not None and row[2] != sha256):
+            return {}
+        headers = {}
+        if row[0]:
+            headers["If-None-Match"] = row[0]
+        if row[1]:
+            headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def put_validators(self, url, headers, sha256=None):
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        with self._lock:
+            if etag or last_modified:
+                self._db.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)", (url, etag, last_modified, sha256, time.time()))
+            else:
+                self._db.execute("DELETE FROM validators WHERE url = ?", (url,))
+            self._db.commit()
+
+    def get_subs(self, ep_id, sub_count=None):
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, sub_count, fetched_at, ttl FROM subs WHERE ep_id = ?", (int(ep_id),)).fetchone()
+            if row is None or row[2] + row[3] < now or (sub_count is not None and row[1] != int(sub_count)):
+                self._count("subs_misses")
+                return None
+            self._db.execute("UPDATE subs SET accessed_at = ? WHERE ep_id = ?", (now, int(ep_id)))
+            self._db.commit()
+            self._count("subs_hits")
+        return json.loads(row[0])
+
+    def put_subs(self, show_id, ep_id, sub_count, subs):
+        body = json.dumps(subs, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT airing FROM dramas WHERE show_id = ?", (int(show_id),)).fetchone()
+            ttl = self.finished_ttl if row is not None and not row[0] else self.airing_ttl
+            self._db.execute("INSERT OR REPLACE INTO subs VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (int(ep_id), int(show_id), None if sub_count is None else int(sub_count), body, now, ttl, now, len(body)))
+            self._db.commit()
+            self._evict()
+
+    def _evict(self):
+        total = self._db.execute("SELECT (SELECT COALESCE(SUM(size), 0) FROM dramas) + (SELECT COALESCE(SUM(size), 0) FROM subs)").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        rows = self._db.execute("""
+            SELECT 'dramas', show_id, size, accessed_at FROM dramas
+            UNION ALL SELECT 'subs', ep_id, size, accessed_at FROM subs
+            ORDER BY accessed_at""").fetchall()
+        for table, key, size, _ in rows:
+            if total <= self.max_bytes:
+                break
+            column = "show_id" if table == "dramas" else "ep_id"
+            self._db.execute(f"DELETE FROM {table} WHERE {column} = ?", (key,))
+            total -= size
+            self._count("evicted")
+        self._db.commit()
+
+    def report(self):
+        now = time.time()
+        lines = [f"[INFO] Cache {self.path}:"]
+        with self._lock:
+            for table in ("dramas", "subs"):
+                count, size, stale = self._db.execute(
+                    f"SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(fetched_at + ttl < ?), 0) FROM {table}", (now,)).fetchone()
+                lines.append(f"  {table:<7} {count} entries, {size / 1024:.1f} KiB, {stale} stale")
+            validators = self._db.execute("SELECT COUNT(*) FROM validators").fetchone()[0]
+        lines.append(f"  validators {validators} URL(s)")
+        lines.append(f"  size cap {self.max_bytes / 1024 / 1024:.0f} MiB, file {os.path.getsize(self.path) / 1024:.1f} KiB")
+        lines.append("  this run: " + ", ".join(f"{key.replace('_', ' ')} {value}" for key, value in self.stats.items()))
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class RunManifest:
+    # SQLite record of per-episode and per-track progress, kept on every run so that
+    # --resume can skip finished work: episodes go pending -> kkey-captured -> done/failed,
+    # tracks pending -> downloaded -> decrypted/failed (with size and sha256 of the output).
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS episodes (
+            ep_id INTEGER PRIMARY KEY, show_id INTEGER, title TEXT, ep_num TEXT, sub_count INTEGER,
+            state TEXT NOT NULL, subs TEXT, updated_at REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS tracks (
+            ep_id INTEGER NOT NULL, label TEXT NOT NULL, url TEXT, path TEXT, state TEXT NOT NULL,
+            size INTEGER, sha256 TEXT, updated_at REAL NOT NULL, PRIMARY KEY (ep_id, label));
+    """
+
+    def __init__(self, path=MANIFEST_DB, resume=False):
+        self.path = path
+        self.resume = resume
+        self.skipped_episodes = 0
+        self.skipped_tracks = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    def record_episode(self, job, state, subs=None, sub_count=None):
+        show_id, title, ep_num, ep_id = job
+        with self._lock:
+            self._db.execute("""INSERT INTO episodes VALUES (?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (ep_id) DO UPDATE SET
+                                state = excluded.state, subs = COALESCE(excluded.subs, subs),
+                                sub_count = COALESCE(excluded.sub_count, sub_count), updated_at = excluded.updated_at""",
+                             (int(ep_id), int(show_id), title, str(ep_num), sub_count, state,
+                              None if subs is None else json.dumps(subs, ensure_ascii=False), time.time()))
+            self._db.commit()
+
+    def set_episode_state(self, ep_id, state):
+        with self._lock:
+            self._db.execute("UPDATE episodes SET state = ?, updated_at = ? WHERE ep_id = ?", (state, time.time(), int(ep_id)))
+            self._db.commit()
+
+    def get_subs(self, ep_id, sub_count=None):
+        # Subtitle list of an episode captured by an earlier run (only when resuming)
+        if not self.resume:
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT state, subs, sub_count FROM episodes WHERE ep_id = ?", (int(ep_id),)).fetchone()
+        if row is None or row[0] not in ("kkey-captured", "done") or row[1] is None:
+            return None
+        if sub_count is not None and row[2] is not None and row[2] != int(sub_count):
+            return None
+        return json.loads(row[1])
+
+    def record_track(self, ep_id, entry, path, state, size=None, sha256=None):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             (int(ep_id), entry["label"], entry["src"], path, state, size, sha256, time.time()))
+            self._db.commit()
+
+    def episode_state(self, ep_id):
+        with self._lock:
+            row = self._db.execute("SELECT state FROM episodes WHERE ep_id = ?", (int(ep_id),)).fetchone()
+        return row[0] if row else None
+
+    def track_done(self, ep_id, entry, path):
+        # A track is complete when it was decrypted and the file on disk still matches
+        if not self.resume:
+            return False
+        with self._lock:
+            row = self._db.execute("SELECT state, path, size, sha256 FROM tracks WHERE ep_id = ? AND label = ?",
+                                   (int(ep_id), entry["label"])).fetchone()
+        if row is None or row[0] != "decrypted" or row[1] != path or not os.path.exists(path):
+            return False
+        if os.path.getsize(path) != row[2] or file_digest(path) != row[3]:
+            return False
+        with self._lock:
+            self.skipped_tracks += 1
+        return True
+
+    def report(self):
+        with self._lock:
+            episodes = dict(self._db.execute("SELECT state, COUNT(*) FROM episodes GROUP BY state").fetchall())
+            tracks = dict(self._db.execute("SELECT state, COUNT(*) FROM tracks GROUP BY state").fetchall())
+        line = (f"[INFO] Manifest {self.path}: episodes {json.dumps(episodes)}, tracks {json.dumps(tracks)}")
+        if self.resume:
+            line += f"; skipped {self.skipped_episodes} episode capture(s) and {self.skipped_tracks} finished track(s)"
+        return line
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class WatchList:
+    # SQLite list of watched dramas: the episode list seen at the last poll, as
+    # {ep_id: [number, sub count]}, and when each drama is next due to be polled
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS shows (
+            show_id INTEGER PRIMARY KEY, title TEXT, episodes TEXT NOT NULL, next_poll REAL NOT NULL,
+            last_poll REAL, last_change REAL, polls INTEGER NOT NULL DEFAULT 0);
+    """
+
+    def __init__(self, path=WATCH_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    def add(self, show_ids):
+        with self._lock:
+            self._db.executemany("INSERT OR IGNORE INTO shows (show_id, episodes, next_poll) VALUES (?, '{}', 0)",
+                                 [(int(show_id),) for show_id in show_ids])
+            self._db.commit()
+
+    def remove(self, show_ids):
+        with self._lock:
+            self._db.executemany("DELETE FROM shows WHERE show_id = ?", [(int(show_id),) for show_id in show_ids])
+            self._db.commit()
+
+    def due(self, now):
+        with self._lock:
+            rows = self._db.execute("SELECT show_id, episodes FROM shows WHERE next_poll <= ? ORDER BY next_poll", (now,)).fetchall()
+        return [(show_id, json.loads(episodes)) for show_id, episodes in rows]
+
+    def next_due(self):
+        with self._lock:
+            return self._db.execute("SELECT MIN(next_poll) FROM shows").fetchone()[0]
+
+    def save(self, show_id, title, episodes, next_poll, changed):
+        now = time.time()
+        with self._lock:
+            self._db.execute("""UPDATE shows SET title = COALESCE(?, title), episodes = ?, next_poll = ?, last_poll = ?,
+                                last_change = CASE WHEN ? THEN ? ELSE last_change END, polls = polls + 1 WHERE show_id = ?""",
+                             (title, json.dumps(episodes), next_poll, now, int(changed), now, int(show_id)))
+            self._db.commit()
+
+    def report(self):
+        with self._lock:
+            rows = self._db.execute("SELECT show_id, title, episodes, next_poll, last_change FROM shows ORDER BY show_id").fetchall()
+        lines = [f"[INFO] Watch list {self.path}: {len(rows)} drama(s)"]
+        for show_id, title, episodes, next_poll, last_change in rows:
+            episodes = json.loads(episodes)
+            pending = sum(1 for _, sub in episodes.values() if not sub)
+            lines.append(f"  {show_id:>6} {title or '?'}: {len(episodes)} episode(s), {pending} without subtitles, "
+                         f"next poll {datetime.fromtimestamp(next_poll).strftime('%Y-%m-%d %H:%M') if next_poll else 'now'}, "
+                         f"last change {datetime.fromtimestamp(last_change).strftime('%Y-%m-%d %H:%M') if last_change else 'never'}")
+        return "\n".join(lines)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 16), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class SubtitleStore:
+    # Content-addressed store of decrypted subtitles. objects/<aa>/<sha256>.srt holds each
+    # distinct content once, and index.db maps each track URL (the CDN file name plus its
+    # ?v= version) to its object. Episode files are hardlinks to the objects, so an indexed
+    # URL is served without touching the network.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS urls (
+            url_key TEXT PRIMARY KEY, sha256 TEXT NOT NULL, size INTEGER NOT NULL, stored_at REAL NOT NULL);
+    """
+    URL_HASH = re.compile(r"[0-9a-f]{32}\..+", re.I)
+
+    def __init__(self, root=STORE_DIR):
+        self.root = root
+        self.stats = {"hits": 0, "misses": 0, "objects_written": 0, "deduplicated": 0, "copied": 0}
+        os.makedirs(os.path.join(root, "objects"), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(os.path.join(root, "index.db"), check_same_thread=False)
+        self._db.executescript(self.SCHEMA)
+
+    def url_key(self, url, variant=""):
+        # The hash in the file name is shared by every language of an episode upload and stays
+        # the same when one track is corrected; only ?v= changes then, so it is part of the key.
+        # URLs without a hash in their name are keyed by host, path and version.
+        parsed = urlparse(url)
+        name = os.path.basename(parsed.path)
+        version = parse_qs(parsed.query).get("v", [""])[0]
+        suffix = f"#{variant}" if variant else ""
+        if self.URL_HASH.fullmatch(name):
+            return (f"{name.lower()}?v={version}" if version else name.lower()) + suffix
+        return hashlib.sha256(f"{parsed.netloc}{parsed.path}?v={version}".encode()).hexdigest() + suffix
+
+    def object_path(self, digest):
+        return os.path.join(self.root, "objects", digest[:2], f"{digest}.srt")
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def lookup(self, url, variant=""):
+        # (sha256, size, object path) of an indexed URL whose object is still present.
+        # `variant` names how the decrypted text was rewritten before it was stored (e.g.
+        # --clean), so each rendering of a track has its own entry.
+        with self._lock:
+            row = self._db.execute("SELECT sha256, size FROM urls WHERE url_key = ?", (self.url_key(url, variant),)).fetchone()
+        if row is None or not os.path.isfile(self.object_path(row[0])):
+            self._count("misses")
+            return None
+        self._count("hits")
+        return row[0], row[1], self.object_path(row[0])
+
+    def put(self, url, data, digest=None, variant=""):
+        digest = digest or hashlib.sha256(data).hexdigest()
+        path = self.object_path(digest)
+        if os.path.isfile(path):
+            self._count("deduplicated")
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            write_atomic(path, data)
+            self._count("objects_written")
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO urls VALUES (?, ?, ?, ?)", (self.url_key(url, variant), digest, len(data), time.time()))
+            self._db.commit()
+        return path
+
+    def link(self, path, dest):
+        # Points dest at the object; returns False when it already is the object.
+        # Falls back to a copy where hardlinks are not possible (other filesystem, FAT).
+        if os.path.exists(dest) and os.path.samefile(path, dest):
+            return False
+        tmp = f"{dest}.{os.getpid()}.{threading.get_ident()}.part"
+        try:
+            os.link(path, tmp)
+            os.replace(tmp, dest)
+        except OSError:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+            with open(path, "rb") as f:
+                write_atomic(dest, f.read())
+            self._count("copied")
+        return True
+
+    def report(self):
+        with self._lock:
+            urls, objects, size = self._db.execute(
+                "SELECT COUNT(*), COUNT(DISTINCT sha256), COALESCE(SUM(size), 0) FROM urls").fetchone()
+            stored = self._db.execute("SELECT COALESCE(SUM(size), 0) FROM (SELECT DISTINCT sha256, size FROM urls)").fetchone()[0]
+        return (f"[INFO] Store {self.root}: {urls} URL(s) -> {objects} object(s), {stored / 1024:.1f} KiB stored "
+                f"for {size / 1024:.1f} KiB of tracks; this run: "
+                + ", ".join(f"{key.replace('_', ' ')} {value}" for key, value in self.stats.items()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+class SubtitleIndex:
+    # SQLite FTS5 index of the cues under dramas/, keyed by show, episode, language and
+    # start/end in ms. `files` remembers the mtime, size and sha256 each track was indexed
+    # at, so a re-index only reads files whose stat changed and only re-parses those whose
+    # content did; Step 3 adds tracks from the decrypted bytes it already holds. Paths are
+    # stored absolute, so the same file reached from another cwd or spelling is one row.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            file_id INTEGER PRIMARY KEY, path TEXT UNIQUE NOT NULL, show TEXT NOT NULL, episode TEXT NOT NULL,
+            language TEXT NOT NULL, mtime REAL NOT NULL, size INTEGER NOT NULL, sha256 TEXT NOT NULL,
+            cues INTEGER NOT NULL, indexed_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS files_show ON files (show, episode);
+        CREATE TABLE IF NOT EXISTS cues (
+            cue_id INTEGER PRIMARY KEY, file_id INTEGER NOT NULL, start_ms INTEGER NOT NULL, end_ms INTEGER NOT NULL,
+            text TEXT NOT NULL);
+        CREATE INDEX IF NOT EXISTS cues_file ON cues (file_id);
+        CREATE VIRTUAL TABLE IF NOT EXISTS cue_text USING fts5(
+            text, content='cues', content_rowid='cue_id', tokenize='unicode61 remove_diacritics 2');
+    """
+    TAG = re.compile(r"</?[a-zA-Z][^>]*>|\{\\[^}]*\}")
+
+    def __init__(self, path=INDEX_DB):
+        self.path = path
+        self.stats = {"indexed": 0, "cues": 0, "unchanged": 0, "touched": 0, "removed": 0}
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(self.SCHEMA)
+        self._absolutize()
+
+    @staticmethod
+    def canonical(path):
+        return os.path.abspath(path)
+
+    def _absolutize(self):
+        # Indexes written before paths were stored absolute hold them relative to the
+        # cwd of that run, which is taken to be this one
+        rows = [(file_id, path) for file_id, path in self._db.execute("SELECT file_id, path FROM files") if not os.path.isabs(path)]
+        for file_id, path in rows:
+            if self._db.execute("SELECT 1 FROM files WHERE path = ?", (self.canonical(path),)).fetchone():
+                self._delete(file_id)
+            else:
+                self._db.execute("UPDATE files SET path = ? WHERE file_id = ?", (self.canonical(path), file_id))
+        if rows:
+            self._db.commit()
+
+    @staticmethod
+    def key(path):
+        # dramas/<Title>/Episode_<n>/<Language>.srt -> (show, episode, language)
+        folder, name = os.path.split(os.path.normpath(path))
+        show_folder, episode = os.path.split(folder)
+        episode = episode[len("Episode_"):] if episode.startswith("Episode_") else episode
+        return os.path.basename(show_folder), episode, os.path.splitext(name)[0]
+
+    @staticmethod
+    def indexable(path):
+        # Language tracks only: --dual "<A>+<B>.srt" tracks repeat cues already indexed
+        return path.lower().endswith(".srt") and "+" not in os.path.basename(path)
+
+    def known(self, root=None):
+        # {path: (mtime, size, sha256)} of the indexed files, optionally only those under root
+        query, params = "SELECT path, mtime, size, sha256 FROM files", ()
+        if root:
+            prefix = os.path.join(self.canonical(root), "")
+            query, params = query + " WHERE substr(path, 1, ?) = ?", (len(prefix), prefix)
+        with self._lock:
+            return {path: (mtime, size, sha256) for path, mtime, size, sha256 in self._db.execute(query, params)}
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self.stats[key] += n
+
+    def add(self, path, data, digest=None, commit=True):
+        # Indexes `data` as the content of path; only the stat is updated when the same
+        # content is already indexed
+        path = self.canonical(path)
+        if not self.indexable(path):
+            return
+        digest = digest or hashlib.sha256(data).hexdigest()
+        stat = os.stat(path)
+        with self._lock:
+            row = self._db.execute("SELECT file_id, sha256 FROM files WHERE path = ?", (path,)).fetchone()
+        if row and row[1] == digest:
+            with self._lock:
+                self._db.execute("UPDATE files SET mtime = ?, size = ? WHERE file_id = ?", (stat.st_mtime, stat.st_size, row[0]))
+                if commit:
+                    self._db.commit()
+            self._count("touched")
+            return
+        cues = [(cue.start, cue.end, self.TAG.sub("", cue.text))
+                for cue in iter_cues(io.StringIO(data.decode("utf-8-sig", "replace")))]
+        show, episode, language = self.key(path)
+        with self._lock:
+            if row:
+                self._delete(row[0])
+            file_id = self._db.execute(
+                "INSERT INTO files (path, show, episode, language, mtime, size, sha256, cues, indexed_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (path, show, episode, language, stat.st_mtime, stat.st_size, digest, len(cues), time.time())).lastrowid
+            self._db.executemany("INSERT INTO cues (file_id, start_ms, end_ms, text) VALUES (?, ?, ?, ?)",
+                                 [(file_id, start, end, text) for start, end, text in cues])
+            self._db.execute("INSERT INTO cue_text (rowid, text) SELECT cue_id, text FROM cues WHERE file_id = ?", (file_id,))
+            if commit:
+                self._db.commit()
+            self.stats["indexed"] += 1
+            self.stats["cues"] += len(cues)
+
+    def refresh(self, path, known=None, commit=True):
+        # Re-indexes path when its mtime or size differs from the indexed ones
+        path = self.canonical(path)
+        if not self.indexable(path):
+            return
+        if known is None:
+            with self._lock:
+                row = self._db.execute("SELECT mtime, size, sha256 FROM files WHERE path = ?", (path,)).fetchone()
+        else:
+            row = known.get(path)
+        stat = os.stat(path)
+        if row and row[0] == stat.st_mtime and row[1] == stat.st_size:
+            self._count("unchanged")
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        self.add(path, data, commit=commit)
+
+    def _delete(self, file_id):
+        self._db.execute("INSERT INTO cue_text (cue_text, rowid, text) SELECT 'delete', cue_id, text FROM cues WHERE file_id = ?", (file_id,))
+        self._db.execute("DELETE FROM cues WHERE file_id = ?", (file_id,))
+        self._db.execute("DELETE FROM files WHERE file_id = ?", (file_id,))
+
+    def remove(self, paths):
+        with self._lock:
+            for path in paths:
+                row = self._db.execute("SELECT file_id FROM files WHERE path = ?", (self.canonical(path),)).fetchone()
+                if row:
+                    self._delete(row[0])
+                    self.stats["removed"] += 1
+            self._db.commit()
+
+    def commit(self):
+        with self._lock:
+            self._db.commit()
+
+    def search(self, query, show=None, language=None, limit=20):
+        # [(show, episode, language, start ms, end ms, text with [matches] marked)], best match first.
+        # `query` is FTS5 syntax (words, "phrases", OR, NOT, prefix*); when it does not
+        # parse it is searched as one phrase.
+        sql = """SELECT f.show, f.episode, f.language, c.start_ms, c.end_ms, highlight(cue_text, 0, '[', ']')
+                 FROM cue_text JOIN cues c ON c.cue_id = cue_text.rowid JOIN files f ON f.file_id = c.file_id
+                 WHERE cue_text MATCH ?"""
+        params = []
+        if show:
+            sql += " AND f.show LIKE ?"
+            params.append(f"%{show}%")
+        if language:
+            sql += " AND f.language = ? COLLATE NOCASE"
+            params.append(language)
+        sql += " ORDER BY rank LIMIT ?"
+        params.append(limit)
+        with self._lock:
+            try:
+                return self._db.execute(sql, [query] + params).fetchall()
+            except sqlite3.OperationalError:
+                return self._db.execute(sql, ['"' + query.replace('"', '""') + '"'] + params).fetchall()
+
+    def report(self):
+        with self._lock:
+            files, cues, shows = self._db.execute("SELECT COUNT(*), COALESCE(SUM(cues), 0), COUNT(DISTINCT show) FROM files").fetchone()
+        return (f"[INFO] Index {self.path}: {files} track(s), {cues} cue(s) in {shows} show(s); this run: "
+                + ", ".join(f"{key} {value}" for key, value in self.stats.items()))
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def fetch_drama(session, drama_id, limiter=None, cache=None, revalidate=False):
+    # With revalidate, a fresh cache entry is not trusted but still used for a conditional request
+    cached = cache.get_drama(drama_id) if cache and not revalidate else None
+    if cached is not None:
+        return "ok", drama_record(cached)
+    import requests
+    url = f"{BASE_URL}/api/DramaList/Drama/{drama_id}"
+    try:
+        with METRICS.timer("drama_json"):
+            res = get_with_retry(session, url, limiter=limiter, headers=cache.conditional_headers(url) if cache else {})
+            RESPONSES.count("drama", res.status_code)
+            # Only a cached drama sends validators; a 304 without one is an error below
+            if res.status_code == 304 and cache is not None:
+                data = cache.revalidated_drama(drama_id)
+                if data is not None:
+                    return "ok", drama_record(data)
+                # Evicted since the validators were saved
+                res = get_with_retry(session, url, limiter=limiter)
+                RESPONSES.count("drama", res.status_code)
+    except requests.RequestException as e:
+        RESPONSES.count("drama", "error")
+        METRICS.fail("drama_json", failure_cause(e))
+        return "error", None
+    METRICS.add_bytes("metadata", len(res.content))
+    if res.status_code == 404:
+        return "missing", None
+    if res.status_code != 200:
+        METRICS.fail("drama_json", f"http_{res.status_code}")
+        return "error", None
+    try:
+        data = res.json()
+        # Treat an empty payload as a missing ID
+        if not data or not data.get("id"):
+            return "missing", None
+        record = drama_record(data)
+    except (ValueError, TypeError, AttributeError):
+        # Not JSON, not an object, or an episode number that is not a number
+        METRICS.fail("drama_json", "invalid_response")
+        return "error", None
+    if cache:
+        cache.put_drama(data)
+        cache.put_validators(url, res.headers)
+    return "ok", record
+
+async def fetch_drama_async(session, drama_id, limiter=None, cache=None):
+    # fetch_drama for the async engine, over an aiohttp session: ("ok" | "missing" | "error", record)
+    import asyncio
+    import aiohttp
+    cached = cache.get_drama(drama_id) if cache else None
+    if cached is not None:
+        return "ok", drama_record(cached)
+    url = f"{BASE_URL}/api/DramaList/Drama/{drama_id}"
+    try:
+        with METRICS.timer("drama_json"):
+            status, headers, body = await get_with_retry_async(session, url, limiter=limiter,
+                                                               headers=cache.conditional_headers(url) if cache else {})
+            RESPONSES.count("drama", status)
+            # Only a cached drama sends validators; a 304 without one is an error below
+            if status == 304 and cache is not None:
+                data = cache.revalidated_drama(drama_id)
+                if data is not None:
+                    return "ok", drama_record(data)
+                # Evicted since the validators were saved
+                status, headers, body = await get_with_retry_async(session, url, limiter=limiter)
+                RESPONSES.count("drama", status)
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        RESPONSES.count("drama", "error")
+        METRICS.fail("drama_json", failure_cause(e))
+        return "error", None
+    METRICS.add_bytes("metadata", len(body))
+    if status == 404:
+        return "missing", None
+    if status != 200:
+        METRICS.fail("drama_json", f"http_{status}")
+        return "error", None
+    try:
+        data = json.loads(body)
+        if not data or not data.get("id"):
+            return "missing", None
+        record = drama_record(data)
+    except (ValueError, TypeError, AttributeError):
+        METRICS.fail("drama_json", "invalid_response")
+        return "error", None
+    if cache:
+        cache.put_drama(data)
+        cache.put_validators(url, headers)
+    return "ok", record
+
+class MetaScan:
+    # Step 1 bookkeeping shared by both engines: IDs are handed out in order, results come
+    # back in any order and are released in ID order, and a run of `max_missing` consecutive
+    # missing IDs stops handing out new ones
+    def __init__(self, start_id, end_id, max_missing=100):
+        self.ids = iter(range(start_id, end_id + 1))
+        self.max_missing = max_missing
+        self.done = {}
+        self.next_id = start_id
+        self.missing_run = 0
+        self.counts = {"ok": 0, "missing": 0, "error": 0}
+        self.stopped = False
+
+    def take(self):
+        # Next ID to fetch, or None once the range is exhausted or probing stopped
+        return None if self.stopped else next(self.ids, None)
+
+    def finish(self, drama_id, status, record):
+        # Records that are now next in ID order
+        self.done[drama_id] = (status, record)
+        ready = []
+        while self.next_id in self.done:
+            status, record = self.done.pop(self.next_id)
+            self.counts[status] += 1
+            if status == "ok":
+                ready.append(record)
+            self.missing_run = self.missing_run + 1 if status == "missing" else 0
+            self.next_id += 1
+        if self.max_missing and self.missing_run >= self.max_missing and not self.stopped:
+            self.stopped = True
+            print(f"\n[INFO] Stopping Step 1 after {self.missing_run} consecutive missing IDs (last ID {self.next_id - 1})")
+        return ready
+
+    def drain(self):
+        # IDs that finished past the stop point still count
+        ready = []
+        for drama_id in sorted(self.done):
+            status, record = self.done.pop(drama_id)
+            self.counts[status] += 1
+            if status == "ok":
+                ready.append(record)
+        return ready
+
+    def summary(self, elapsed):
+        elapsed = elapsed or 1e-9
+        total = sum(self.counts.values())
+        return (f"[INFO] Step 1: {self.counts['ok']} dramas, {self.counts['missing']} missing ID(s), {self.counts['error']} error(s) "
+                f"in {elapsed:.1f}s ({total / elapsed:.1f} IDs/s)")
+
+def iter_drama_data(start_id, end_id, workers=8, rate=10, max_missing=100, cache=None):
+    # IDs are fetched concurrently over one keep-alive session but results are yielded in
+    # ID order, so a run of `max_missing` consecutive missing IDs stops further probing.
+    session = make_session(workers)
+    limiter = TokenBucket(rate) if rate else None
+    scan = MetaScan(start_id, end_id, max_missing)
+    with ThreadPoolExecutor(max_workers=workers) as executor, RecordWriter(DRAMA_DETAILS_CSV, EPISODE_FIELDS) as writer, \
+            stage_bar("metadata", total=end_id - start_id + 1, desc="Step 1: Drama metadata", unit="id", position=0) as bar:
+        pending = {}
+
+        def submit_more():
+            while len(pending) < workers * 2:
+                drama_id = scan.take()
+                if drama_id is None:
+                    return
+                pending[executor.submit(fetch_drama, session, drama_id, limiter, cache)] = drama_id
+
+        submit_more()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                drama_id = pending.pop(future)
+                bar.update(1)
+                for record in scan.finish(drama_id, *future.result()):
+                    writer.write_rows(episode_rows(record))
+                    yield record
+            bar.set_postfix(missing=scan.counts["missing"], errors=scan.counts["error"])
+            submit_more()
+        for record in scan.drain():
+            writer.write_rows(episode_rows(record))
+            yield record
+        elapsed = bar.format_dict["elapsed"]
+    print(scan.summary(elapsed))
     print(f"[INFO] Saved drama metadata to {DRAMA_DETAILS_CSV} [Time : {current_time()}]")
-    return all_data
+
+def fetch_drama_data(start_id, end_id, workers=8, rate=10, max_missing=100, cache=None):
+    return list(iter_drama_data(start_id, end_id, workers, rate, max_missing, cache))
 
 def parse_episode_details(details):
     pattern = r"Episode\s+(\d+(?:\.\d+)?)\s+\(ID:\s*(\d+),\s*Subtitles:\s*(\d+)\)"
-    return [{"number": int(float(m.group(1))), "id": m.group(2)} for m in re.finditer(pattern, details)]
-
-def fetch_kkey_and_subs_task(show_id, title, ep_num, ep_id):
-    drama_link = f"https://kisskh.ovh/Drama/a/Episode-{ep_num}?id={show_id}&ep={ep_id}"
-    kkey = None
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=True)
-        context = browser.new_context()
-        page = context.new_page()
-        def handle_response(response):
-            nonlocal kkey
-            if f"/api/Sub/{ep_id}?kkey=" in response.url:
-                match = re.search(r"kkey=([^&]+)", response.url)
-                if match:
-                    kkey = match.group(1)
-        page.on("response", handle_response)
-        page.goto(drama_link, timeout=30000, wait_until="networkidle")
-        for _ in range(10):
-            if kkey:
+    return [{"number": episode_number(m.group(1)), "id": int(m.group(2)), "sub": int(m.group(3))} for m in re.finditer(pattern, details)]
+
+def episode_link(show_id, ep_num, ep_id):
+    return f"{BASE_URL}/Drama/a/Episode-{ep_num}?id={show_id}&ep={ep_id}"
+
+def capture_kkey(page, show_id, ep_num, ep_id, timeout=KKEY_TIMEOUT):
+    marker = f"/api/Sub/{ep_id}?kkey="
+    # Wait for the page's own /api/Sub request instead of polling after networkidle
+    start = time.perf_counter()
+    with page.expect_response(lambda response: marker in response.url, timeout=timeout) as info:
+        page.goto(episode_link(show_id, ep_num, ep_id), timeout=timeout, wait_until="commit")
+        loaded = time.perf_counter()
+        METRICS.observe("page_load", loaded - start, ep_id)
+    METRICS.observe("kkey_wait", time.perf_counter() - loaded, ep_id)
+    match = re.search(r"kkey=([^&]+)", info.value.url)
+    return match.group(1) if match else None
+
+async def capture_kkey_async(page, show_id, ep_num, ep_id, timeout=KKEY_TIMEOUT):
+    marker = f"/api/Sub/{ep_id}?kkey="
+    start = time.perf_counter()
+    async with page.expect_response(lambda response: marker in response.url, timeout=timeout) as info:
+        await page.goto(episode_link(show_id, ep_num, ep_id), timeout=timeout, wait_until="commit")
+        loaded = time.perf_counter()
+        METRICS.observe("page_load", loaded - start, ep_id)
+    response = await info.value
+    METRICS.observe("kkey_wait", time.perf_counter() - loaded, ep_id)
+    match = re.search(r"kkey=([^&]+)", response.url)
+    return match.group(1) if match else None
+
+def subs_link(ep_id, kkey):
+    return f"{BASE_URL}/api/Sub/{ep_id}?kkey={kkey}"
+
+def fetch_subs(show_id, ep_num, ep_id, kkey):
+    with METRICS.timer("subtitle_json", ep_id):
+        import requests
+        resp = requests.get(subs_link(ep_id, kkey), headers={'Referer': episode_link(show_id, ep_num, ep_id)}, timeout=30)
+    METRICS.add_bytes("metadata", len(resp.content))
+    if resp.status_code != 200:
+        METRICS.fail("subtitle_json", f"http_{resp.status_code}")
+        return None
+    return resp.json()
+
+class KkeyProvider:
+    # A source of kkeys. get_kkey runs on capture pool threads, get_kkey_async on the
+    # async engine's loop; both return None on a miss. release/aclose free per-worker state.
+    # A provider with max_misses set gives up after that many misses in a row, so a
+    # source that never answers stops costing a request per episode.
+    name = "provider"
+
+    def __init__(self, max_misses=0):
+        self.hits = 0
+        self.misses = 0
+        self.streak = 0
+        self.max_misses = max_misses
+        self.active = True
+        self._lock = threading.Lock()
+
+    def record(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.streak = 0
+                return
+            self.misses += 1
+            self.streak += 1
+            if self.active and self.max_misses and self.streak >= self.max_misses:
+                self.active = False
+                print(f"\n[WARN] kkey provider {self.name}: {self.streak} misses in a row, not trying it for the rest of the run")
+
+    def get_kkey(self, show_id, ep_num, ep_id):
+        raise NotImplementedError
+
+    async def get_kkey_async(self, session, show_id, ep_num, ep_id):
+        raise NotImplementedError
+
+    def release(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+class HttpKkeyProvider(KkeyProvider):
+    # Plain-HTTP provider: reads the kkey from an optional token endpoint, then from
+    # the episode page itself, without starting a browser. The page fallback only finds
+    # a kkey written into the HTML as a string literal; a kkey computed by the player's
+    # script is left to the browser provider.
+    name = "http"
+    PATTERNS = (r"/api/Sub/{ep_id}\?kkey=([^&\"'\s]+)", r"[\"']?kkey[\"']?\s*[:=]\s*[\"']([^\"']+)[\"']")
+
+    def __init__(self, endpoint=None, max_misses=0):
+        super().__init__(max_misses)
+        self.endpoint = endpoint
+        self.session = make_session()
+
+    def urls(self, show_id, ep_num, ep_id):
+        if self.endpoint:
+            yield self.endpoint.format(base=BASE_URL, show_id=show_id, ep_num=ep_num, ep_id=ep_id)
+        yield episode_link(show_id, ep_num, ep_id)
+
+    def extract(self, text, ep_id):
+        text = text.strip()
+        if re.fullmatch(r"[A-Za-z0-9_\-]{16,}", text):
+            return text
+        for pattern in self.PATTERNS:
+            match = re.search(pattern.format(ep_id=ep_id), text)
+            if match:
+                return match.group(1)
+        return None
+
+    def get_kkey(self, show_id, ep_num, ep_id):
+        import requests
+        cause = None
+        with METRICS.timer("kkey_http", ep_id):
+            for url in self.urls(show_id, ep_num, ep_id):
+                try:
+                    res = self.session.get(url, timeout=15)
+                except requests.RequestException as e:
+                    cause = failure_cause(e)
+                    continue
+                METRICS.add_bytes("pages", len(res.content))
+                kkey = self.extract(res.text, ep_id) if res.ok else None
+                if kkey:
+                    return kkey
+                cause = "no_kkey" if res.ok else f"http_{res.status_code}"
+        METRICS.fail("kkey_http", cause)
+        return None
+
+    async def get_kkey_async(self, session, show_id, ep_num, ep_id):
+        cause = None
+        with METRICS.timer("kkey_http", ep_id):
+            for url in self.urls(show_id, ep_num, ep_id):
+                try:
+                    async with session.get(url) as res:
+                        text = await res.text()
+                        status = res.status
+                except Exception as e:
+                    cause = failure_cause(e)
+                    continue
+                METRICS.add_bytes("pages", len(text))
+                kkey = self.extract(text, ep_id) if status == 200 else None
+                if kkey:
+                    return kkey
+                cause = "no_kkey" if status == 200 else f"http_{status}"
+        METRICS.fail("kkey_http", cause)
+        return None
+
+class BrowserKkeyProvider(KkeyProvider):
+    # Headless Chromium sniffer. Browsers are started lazily, so a run where the cheap
+    # provider always hits never launches one. Sync Playwright objects are bound to
+    # their thread, so each capture thread keeps its own browser, context and page;
+    # the async engine shares one browser across a fixed set of pages.
+    name = "browser"
+
+    def __init__(self, pages=6, recycle_after=25, headless=True):
+        super().__init__()
+        self.pages = max(1, pages)
+        self.recycle_after = max(1, recycle_after)
+        self.headless = headless
+        self._local = threading.local()
+        self._async_playwright = None
+        self._async_browser = None
+        self._async_pages = None
+        self._async_lock = None
+        self._async_failed = False
+
+    def _page(self):
+        local = self._local
+        if getattr(local, "browser", None) is None:
+            from playwright.sync_api import sync_playwright
+            with METRICS.timer("browser_launch"):
+                local.playwright = sync_playwright().start()
+                local.browser = local.playwright.chromium.launch(headless=self.headless)
+                local.context = local.browser.new_context()
+            local.page, local.navigations = None, 0
+        if local.page is None or local.navigations >= self.recycle_after:
+            if local.page is not None:
+                local.page.close()
+            local.page, local.navigations = local.context.new_page(), 0
+        local.navigations += 1
+        return local.page
+
+    def get_kkey(self, show_id, ep_num, ep_id):
+        if getattr(self._local, "failed", False):
+            return None
+        try:
+            from playwright.sync_api import TimeoutError as PlaywrightTimeoutError
+            page = self._page()
+        except Exception as e:
+            print(f"[WARN] Browser could not be started: {e}")
+            METRICS.fail("browser_launch", failure_cause(e))
+            self._local.failed = True
+            self.release()
+            return None
+        try:
+            return capture_kkey(page, show_id, ep_num, ep_id)
+        except PlaywrightTimeoutError:
+            METRICS.fail("kkey_browser", "timeout")
+            return None
+        except Exception as e:
+            METRICS.fail("kkey_browser", failure_cause(e))
+            # Drop the page so the next episode starts from a clean one
+            self._local.page = None
+            page.close()
+            return None
+
+    def release(self):
+        local = self._local
+        if getattr(local, "browser", None) is not None:
+            local.browser.close()
+        if getattr(local, "playwright", None) is not None:
+            local.playwright.stop()
+        local.browser = local.playwright = None
+
+    async def _async_slot(self):
+        import asyncio
+        if self._async_lock is None:
+            self._async_lock = asyncio.Lock()
+        async with self._async_lock:
+            if self._async_failed:
+                return None
+            if self._async_pages is None:
+                from playwright.async_api import async_playwright
+                with METRICS.timer("browser_launch"):
+                    self._async_playwright = await async_playwright().start()
+                    self._async_browser = await self._async_playwright.chromium.launch(headless=self.headless)
+                    self._async_context = await self._async_browser.new_context()
+                # Each slot is [page, navigations]; holding a slot is the capture-stage limit
+                self._async_pages = asyncio.Queue()
+                for _ in range(self.pages):
+                    self._async_pages.put_nowait([await self._async_context.new_page(), 0])
+        return await self._async_pages.get()
+
+    async def get_kkey_async(self, session, show_id, ep_num, ep_id):
+        if self._async_failed:
+            return None
+        try:
+            from playwright.async_api import TimeoutError as AsyncPlaywrightTimeoutError
+            slot = await self._async_slot()
+        except Exception as e:
+            print(f"[WARN] Browser could not be started: {e}")
+            METRICS.fail("browser_launch", failure_cause(e))
+            self._async_failed = True
+            await self.aclose()
+            return None
+        if slot is None:
+            return None
+        try:
+            if slot[1] >= self.recycle_after:
+                await slot[0].close()
+                slot[:] = [await self._async_context.new_page(), 0]
+            slot[1] += 1
+            return await capture_kkey_async(slot[0], show_id, ep_num, ep_id)
+        except AsyncPlaywrightTimeoutError:
+            METRICS.fail("kkey_browser", "timeout")
+            return None
+        except Exception as e:
+            METRICS.fail("kkey_browser", failure_cause(e))
+            await slot[0].close()
+            slot[:] = [await self._async_context.new_page(), 0]
+            return None
+        finally:
+            self._async_pages.put_nowait(slot)
+
+    async def aclose(self):
+        # Also cleans up after a launch that failed half way
+        if self._async_browser is not None:
+            with contextlib.suppress(Exception):
+                await self._async_browser.close()
+        if self._async_playwright is not None:
+            with contextlib.suppress(Exception):
+                await self._async_playwright.stop()
+        self._async_playwright = self._async_browser = self._async_pages = None
+
+def build_kkey_providers(mode, threads=6, recycle_after=25, endpoint=None):
+    # auto only puts HTTP in front of the browsers when there is a token endpoint to ask;
+    # otherwise the page GET would be an extra request for a kkey the browser has to find anyway.
+    providers = []
+    if mode == "http":
+        providers.append(HttpKkeyProvider(endpoint))
+    elif mode == "auto" and endpoint:
+        providers.append(HttpKkeyProvider(endpoint, max_misses=KKEY_HTTP_MAX_MISSES))
+    if mode in ("auto", "browser"):
+        providers.append(BrowserKkeyProvider(threads, recycle_after))
+    return providers
+
+def fetch_kkey_and_subs_task(providers, show_id, title, ep_num, ep_id):
+    # Cheapest provider first; a kkey only counts as a hit if /api/Sub accepts it
+    import requests
+    with METRICS.inflight("capture"):
+        for provider in providers:
+            if not provider.active:
+                continue
+            kkey = provider.get_kkey(show_id, ep_num, ep_id)
+            try:
+                result = fetch_subs(show_id, ep_num, ep_id, kkey) if kkey else None
+            except (requests.RequestException, ValueError) as e:
+                METRICS.fail("subtitle_json", failure_cause(e))
+                result = None
+            provider.record(result is not None)
+            if result is not None:
+                return result
+    METRICS.fail("capture", "no_provider_succeeded")
+    return None
+
+def available_memory_mb():
+    try:
+        import psutil
+        return psutil.virtual_memory().available / 2 ** 20
+    except ImportError:
+        pass
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def cpu_load():
+    # 1-minute load per core, or None where it cannot be read
+    try:
+        return os.getloadavg()[0] / (os.cpu_count() or 1)
+    except (AttributeError, OSError):
+        pass
+    try:
+        import psutil
+        return psutil.cpu_percent(interval=None) / 100
+    except ImportError:
+        return None
+
+class ConcurrencyController:
+    # AIMD limit on concurrent kkey captures, between hard caps `low` and `high`. After every
+    # `window` finished episodes the window's median latency is compared with the best seen:
+    # a slot is added while latency holds and there is memory and CPU to spare for another
+    # browser; the limit is cut by a third on 429s or timeouts, failures above 20%, latency
+    # at 2.5x the best, or free memory below min_free_mb. Worker threads at or above the
+    # limit close their browser and wait for a slot.
+
+    BROWSER_MB = 250
+
+    def __init__(self, low=1, high=6, start=None, window=8, min_free_mb=512):
+        self.low = max(1, low)
+        self.high = max(self.low, high)
+        self.limit = min(self.high, max(self.low, start or 2))
+        self.window = max(1, window)
+        self.min_free_mb = min_free_mb
+        self.best = None
+        self.samples = []
+        self.failures = 0
+        self.changes = []
+        self.closed = False
+        self._pressure = self.pressure_count()
+        self._cond = threading.Condition()
+        METRICS.set_gauge("capture_limit", self.limit)
+
+    @staticmethod
+    def pressure_count():
+        # 429s and timeouts seen so far by Step 2 (kkey and /api/Sub requests are not retried)
+        with METRICS._lock:
+            return sum(count for (stage, cause), count in METRICS.failures.items()
+                       if cause in ("http_429", "timeout") and stage not in ("download", "drama_json"))
+
+    def admit(self, index):
+        return self.closed or index < self.limit
+
+    def wait(self, index):
+        with self._cond:
+            while not self.closed and index >= self.limit:
+                self._cond.wait()
+
+    def close(self):
+        with self._cond:
+            self.closed = True
+            self._cond.notify_all()
+
+    def record(self, latency, ok):
+        with self._cond:
+            self.samples.append(latency)
+            self.failures += not ok
+            if len(self.samples) >= self.window:
+                self._adjust()
+
+    def _adjust(self):
+        p50 = percentile(self.samples, 50)
+        fail_rate = self.failures / len(self.samples)
+        self.samples, self.failures = [], 0
+        self.best = p50 if self.best is None else min(self.best, p50)
+        pressure = self.pressure_count()
+        new_pressure, self._pressure = pressure - self._pressure, pressure
+        memory, load = available_memory_mb(), cpu_load()
+
+        if new_pressure:
+            limit, reason = self.limit * 2 // 3, f"{new_pressure} 429/timeout(s)"
+        elif fail_rate > 0.2:
+            limit, reason = self.limit * 2 // 3, f"{fail_rate:.0%} failed"
+        elif memory is not None and memory < self.min_free_mb:
+            limit, reason = self.limit * 2 // 3, f"{memory:.0f} MiB free"
+        elif p50 > 2.5 * self.best:
+            limit, reason = self.limit * 2 // 3, f"latency {p50:.2f}s vs best {self.best:.2f}s"
+        elif (p50 <= 1.5 * self.best and (memory is None or memory > self.min_free_mb + self.BROWSER_MB)
+              and (load is None or load < 0.9)):
+            limit, reason = self.limit + 1, f"latency {p50:.2f}s"
+        else:
+            return
+        limit = min(self.high, max(self.low, limit))
+        if limit != self.limit:
+            self.changes.append((round(time.time(), 3), self.limit, limit, reason))
+            self.limit = limit
+            METRICS.set_gauge("capture_limit", limit)
+            self._cond.notify_all()
+
+    def summary(self):
+        ups = sum(1 for _, old, new, _ in self.changes if new > old)
+        line = (f"[INFO] Adaptive capture concurrency: limit {self.limit} (caps {self.low}-{self.high}), "
+                f"{ups} increase(s), {len(self.changes) - ups} decrease(s)")
+        cuts = [reason for _, old, new, reason in self.changes if new < old]
+        if cuts:
+            line += "; cut for: " + ", ".join(cuts[-5:])
+        return line
+
+class CapturePool:
+    # Worker threads that run fetch_kkey_and_subs_task over a queue of episodes and keep
+    # their provider state (e.g. a browser) alive for the whole run. With a controller,
+    # only the first `controller.limit` workers take episodes at any time.
+
+    _DONE = object()
+
+    def __init__(self, size, providers, controller=None):
+        self.controller = controller
+        self.size = max(1, controller.high if controller else size)
+        self.providers = providers
+        self._stop = threading.Event()
+
+    def _release(self):
+        for provider in self.providers:
+            try:
+                provider.release()
+            except Exception:
+                pass
+
+    def _worker(self, index, jobs, results):
+        controller = self.controller
+        try:
+            while True:
+                if controller and not controller.admit(index):
+                    # Over the current limit: free this worker's browser until a slot opens
+                    self._release()
+                    controller.wait(index)
+                job = jobs.get()
+                if job is None or self._stop.is_set():
+                    break
+                start = time.perf_counter()
+                try:
+                    result = fetch_kkey_and_subs_task(self.providers, *job)
+                except Exception as e:
+                    METRICS.fail("capture", failure_cause(e))
+                    result = None
+                latency = time.perf_counter() - start
+                METRICS.observe("episode_capture", latency, job[3])
+                if controller:
+                    controller.record(latency, result is not None)
+                results.put((job, result, latency))
+        finally:
+            if controller:
+                # Every job has been handed out: wake idle workers so they take their None
+                controller.close()
+            self._release()
+            results.put(self._DONE)
+
+    def _feed(self, jobs, job_queue):
+        try:
+            for job in jobs:
+                job_queue.put(job)
+        finally:
+            for _ in range(self.size):
+                job_queue.put(None)
+
+    def map(self, jobs):
+        # Yields (job, result, latency) as each job completes. jobs may be lazy: a feeder
+        # thread drains it into a bounded queue, so capture starts with the first episode.
+        job_queue, results = queue.Queue(maxsize=self.size * 2), queue.Queue()
+        threading.Thread(target=self._feed, args=(jobs, job_queue), daemon=True).start()
+        workers = [threading.Thread(target=self._worker, args=(index, job_queue, results), daemon=True) for index in range(self.size)]
+        for worker in workers:
+            worker.start()
+        alive = len(workers)
+        try:
+            while alive:
+                item = results.get()
+                if item is self._DONE:
+                    alive -= 1
+                    continue
+                yield item
+        finally:
+            # Closed early (cancelled): workers stop after their current episode and free their browsers
+            self._stop.set()
+            if self.controller:
+                self.controller.close()
+
+def episode_work(drama, selected_eps, cache=None, known_tracks=None, manifest=None):
+    # Yields (job, sub_count, subs) per selected episode; subs is the subtitle list when it is
+    # already known (resumed manifest, reused drama_subtitles.csv or fresh cache entry), None
+    # when the episode needs kkey capture
+    for ep in drama["Episodes"]:
+        if selected_eps and ep["number"] not in selected_eps:
+            continue
+        job = (drama["Show ID"], drama["Title"], ep["number"], ep["id"])
+        subs = manifest.get_subs(ep["id"], ep["sub"]) if manifest else None
+        if subs is not None:
+            manifest.skipped_episodes += 1
+        if subs is None and known_tracks:
+            subs = known_tracks.get(ep["id"])
+        if subs is None and cache:
+            subs = cache.get_subs(ep["id"], ep["sub"])
+        if manifest:
+            manifest.record_episode(job, "pending" if subs is None else "kkey-captured", subs, ep["sub"])
+        yield job, ep["sub"], subs
+
+class Downloader:
+    # Step 3 consumer: tracks are queued as soon as their episode's subtitle list is known
+    # and downloaded/decrypted concurrently by worker threads over one pooled session,
+    # while earlier stages keep running. The queue is bounded, so a slow CDN throttles
+    # capture instead of growing memory, and HostLimiter paces each subtitle host.
+
+    def __init__(self, langs, workers=8, rate=5, inflight=4, maxsize=256, manifest=None, skip_unchanged=False, store=None, cache=None, post=None, index=None, on_episode=None):
+        self.langs = langs
+        self.manifest = manifest
+        self.skip_unchanged = skip_unchanged
+        self.store = store
+        self.cache = cache
+        self.post = post
+        self.index = index
+        # Called with (ep_id, failed, bytes) once every selected track of an episode is done
+        self.on_episode = on_episode
+        self.session = make_session(max(1, workers))
+        self.limiter = HostLimiter(rate, inflight)
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.bar = stage_bar("download", total=0, desc="Step 3: Download + Decrypt", unit="track", position=2)
+        self.stats = {"tracks": 0, "failed": 0, "skipped": 0, "unchanged": 0, "from_store": 0, "not_modified": 0, "bytes": 0}
+        self.started = time.perf_counter()
+        # ep_id -> [tracks still outstanding, any failed, bytes]
+        self.outstanding = {}
+        self.cancelled = threading.Event()
+        self._lock = threading.Lock()
+        self.workers = [threading.Thread(target=self._worker, daemon=True) for _ in range(max(1, workers))]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, job, subs):
+        if self.cancelled.is_set():
+            return
+        show_id, title, ep_num, ep_id = job
+        folder = episode_folder(title, ep_num)
+        tracks = [entry for entry in selected_tracks(subs, self.langs)
+                  if not (self.manifest and self.manifest.track_done(ep_id, entry, os.path.join(folder, f"{entry['label']}.srt")))]
+        with self._lock:
+            self.stats["skipped"] += len(selected_tracks(subs, self.langs)) - len(tracks)
+        if not tracks:
+            if self.manifest:
+                self.manifest.set_episode_state(ep_id, "done")
+            if self.on_episode:
+                self.on_episode(ep_id, False, 0)
+            return
+        with self._lock:
+            self.outstanding[ep_id] = [len(tracks), False, 0]
+            self.bar.total += len(tracks)
+            self.bar.refresh()
+        for entry in tracks:
+            self.queue.put((ep_id, folder, entry))
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
                 break
-            time.sleep(1)
-        browser.close()
-    if not kkey:
+            if self.cancelled.is_set():
+                continue
+            ep_id, folder, entry = item
+            result = download_track(self.session, folder, entry, self.limiter, self.manifest, ep_id, self.skip_unchanged, self.store, self.cache, self.post, self.index)
+            with self._lock:
+                if result is None:
+                    self.stats["failed"] += 1
+                else:
+                    size, outcome = result
+                    self.stats[outcome] += 1
+                    self.stats["bytes"] += size
+                self.bar.update(1)
+                state = self.outstanding[ep_id]
+                state[0] -= 1
+                state[1] = state[1] or result is None
+                state[2] += result[0] if result else 0
+                finished = state[0] == 0
+                if finished:
+                    del self.outstanding[ep_id]
+            if finished and self.post:
+                self.post.finish_episode(ep_id, folder)
+            if finished and self.manifest:
+                self.manifest.set_episode_state(ep_id, "failed" if state[1] else "done")
+            if finished and self.on_episode:
+                self.on_episode(ep_id, state[1], state[2])
+
+    def summary(self):
+        elapsed = max(time.perf_counter() - self.started, 1e-9)
+        return (f"[INFO] Step 3: {self.stats['tracks']} track(s) saved, {self.stats['unchanged']} unchanged, {self.stats['from_store']} from store, {self.stats['not_modified']} not modified, {self.stats['failed']} failed, {self.stats['skipped']} already complete, "
+                f"{self.stats['bytes'] / 1024:.1f} KiB in {elapsed:.1f}s "
+                f"({(self.stats['tracks'] + self.stats['unchanged'] + self.stats['from_store'] + self.stats['not_modified']) / elapsed:.2f} tracks/s, {self.stats['bytes'] / 1024 / elapsed:.1f} KiB/s)")
+
+    def cancel(self):
+        # Queued tracks are dropped (their episodes stay kkey-captured for --resume), requests
+        # waiting for their host's rate limit fail at once and the ones already sent finish
+        # within their timeout
+        self.cancelled.set()
+        self.limiter.close()
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+
+    def close(self):
+        for _ in self.workers:
+            self.queue.put(None)
+        try:
+            for worker in self.workers:
+                worker.join()
+        except KeyboardInterrupt:
+            # Cancelled while the last tracks were downloading
+            self.cancel()
+            for _ in self.workers:
+                self.queue.put(None)
+            for worker in self.workers:
+                worker.join()
+        self.bar.close()
+        print(self.summary())
+        if self.post:
+            print(self.post.summary())
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def run_pipeline(dramas, selected_eps, threads, providers, writer, downloader, cache=None, known_tracks=None, manifest=None, controller=None):
+    # Steps 1-3 as one stream: `dramas` may be the lazy Step 1 generator, each episode goes
+    # to kkey capture as soon as its drama is known and to Step 3 as soon as it resolves.
+    sub_counts = {}
+    reused = 0
+    bar = stage_bar("capture", total=0, desc="Step 2: Subtitle Metadata", position=1)
+
+    def jobs():
+        nonlocal reused
+        for drama in dramas:
+            for job, sub_count, subs in episode_work(drama, selected_eps, cache, known_tracks, manifest):
+                if subs is None:
+                    sub_counts[job[3]] = sub_count
+                    bar.total += 1
+                    bar.refresh()
+                    yield job
+                else:
+                    reused += 1
+                    writer.write_rows(track_rows(*job, subs))
+                    downloader.submit(job, subs)
+
+    captured = CapturePool(threads, providers, controller).map(jobs())
+    with bar, contextlib.closing(captured):
+        for (show_id, title, ep_num, ep_id), result, latency in captured:
+            sub_count = sub_counts.pop(ep_id)
+            if controller:
+                bar.set_postfix(kkey=f"{latency:.2f}s", threads=controller.limit)
+            else:
+                bar.set_postfix(kkey=f"{latency:.2f}s")
+            bar.update(1)
+            job = (show_id, title, ep_num, ep_id)
+            if result is not None and cache:
+                cache.put_subs(show_id, ep_id, sub_count, result)
+            if manifest:
+                manifest.record_episode(job, "failed" if result is None else "kkey-captured", result)
+            if result is not None:
+                writer.write_rows(track_rows(*job, result))
+                downloader.submit(job, result)
+    if reused:
+        print(f"[INFO] {reused} episode(s) reused without kkey capture")
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+async def run_async_engine(start_id, end_id, selected_eps, providers, writer, downloader, drama_data=None, cache=None,
+                           known_tracks=None, manifest=None, meta_limit=8, capture_limit=64, sub_limit=16, rate=10, max_missing=100):
+    # Steps 1 and 2 on one event loop as a stream of worker coroutines joined by bounded
+    # queues: meta workers feed episodes to capture workers, which hand finished subtitle
+    # lists to the Step 3 downloader threads. Browser pages and the per-stage semaphores
+    # bound how much work is in flight. Step 1 retries, rate-limits (`rate` per second) and
+    # stops on missing IDs exactly like iter_drama_data.
+    import asyncio
+    import aiohttp
+
+    sub_sem = asyncio.Semaphore(sub_limit)
+    episode_queue = asyncio.Queue(maxsize=capture_limit * 2)
+    sub_counts = {}
+    reused = 0
+    meta_bar = stage_bar("metadata", total=(end_id - start_id + 1) if drama_data is None else 0, desc="Step 1: Drama metadata", unit="id", position=0)
+    capture_bar = stage_bar("capture", total=0, desc="Step 2: Subtitle Metadata", position=1)
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+        async def fetch_subs_async(show_id, ep_num, ep_id, kkey):
+            async with sub_sem:
+                try:
+                    with METRICS.timer("subtitle_json", ep_id):
+                        async with session.get(subs_link(ep_id, kkey), headers={'Referer': episode_link(show_id, ep_num, ep_id)}) as resp:
+                            body = await resp.read()
+                            status = resp.status
+                except Exception as e:
+                    METRICS.fail("subtitle_json", failure_cause(e))
+                    return None
+                METRICS.add_bytes("metadata", len(body))
+                if status != 200:
+                    METRICS.fail("subtitle_json", f"http_{status}")
+                    return None
+                try:
+                    return json.loads(body)
+                except ValueError:
+                    METRICS.fail("subtitle_json", "invalid_response")
+                    return None
+
+        async def enqueue_episodes(drama):
+            nonlocal reused
+            for job, sub_count, subs in episode_work(drama, selected_eps, cache, known_tracks, manifest):
+                if subs is None:
+                    sub_counts[job[3]] = sub_count
+                    capture_bar.total += 1
+                    capture_bar.refresh()
+                    await episode_queue.put(job)
+                else:
+                    reused += 1
+                    writer.write_rows(track_rows(*job, subs))
+                    await asyncio.to_thread(downloader.submit, job, subs)
+
+        async def meta_worker(scan, limiter):
+            # Records are written in ID order, like the threaded engine
+            while True:
+                drama_id = scan.take()
+                if drama_id is None:
+                    return
+                status, record = await fetch_drama_async(session, drama_id, limiter, cache)
+                meta_bar.update(1)
+                ready = scan.finish(drama_id, status, record)
+                for record in ready:
+                    writer_details.write_rows(episode_rows(record))
+                meta_bar.set_postfix(missing=scan.counts["missing"], errors=scan.counts["error"])
+                for record in ready:
+                    await enqueue_episodes(record)
+
+        async def capture_worker():
+            # An error in one episode is recorded as its failure; a worker that died instead
+            # would leave the meta workers blocked on the full episode queue
+            while True:
+                job = await episode_queue.get()
+                if job is None:
+                    return
+                try:
+                    await capture_episode(job)
+                except Exception as e:
+                    print(f"\n[WARN] kkey capture of episode {job[3]} failed: {e}")
+                    METRICS.fail("capture", failure_cause(e))
+                    if manifest:
+                        manifest.record_episode(job, "failed")
+                finally:
+                    sub_counts.pop(job[3], None)
+
+        async def capture_episode(job):
+            show_id, title, ep_num, ep_id = job
+            start = time.perf_counter()
+            result = None
+            with METRICS.inflight("capture"):
+                for provider in providers:
+                    if not provider.active:
+                        continue
+                    kkey = await provider.get_kkey_async(session, show_id, ep_num, ep_id)
+                    result = await fetch_subs_async(show_id, ep_num, ep_id, kkey) if kkey else None
+                    provider.record(result is not None)
+                    if result is not None:
+                        break
+            latency = time.perf_counter() - start
+            METRICS.observe("episode_capture", latency, ep_id)
+            if result is None:
+                METRICS.fail("capture", "no_provider_succeeded")
+            sub_count = sub_counts.get(ep_id)
+            capture_bar.set_postfix(kkey=f"{latency:.2f}s")
+            capture_bar.update(1)
+            if result is not None and cache:
+                cache.put_subs(show_id, ep_id, sub_count, result)
+            if manifest:
+                manifest.record_episode(job, "failed" if result is None else "kkey-captured", result)
+            if result is not None:
+                writer.write_rows(track_rows(*job, result))
+                await asyncio.to_thread(downloader.submit, job, result)
+
+        capture_workers = [asyncio.create_task(capture_worker()) for _ in range(max(1, capture_limit))]
+        try:
+            if drama_data is None:
+                scan = MetaScan(start_id, end_id, max_missing)
+                limiter = TokenBucket(rate) if rate else None
+                with RecordWriter(DRAMA_DETAILS_CSV, EPISODE_FIELDS) as writer_details:
+                    await asyncio.gather(*(meta_worker(scan, limiter) for _ in range(max(1, meta_limit))))
+                    remaining = scan.drain()
+                    for record in remaining:
+                        writer_details.write_rows(episode_rows(record))
+                for record in remaining:
+                    await enqueue_episodes(record)
+                print(f"\n{scan.summary(meta_bar.format_dict['elapsed'])}")
+                print(f"[INFO] Saved drama metadata to {DRAMA_DETAILS_CSV} [Time : {current_time()}]")
+            else:
+                for drama in drama_data:
+                    await enqueue_episodes(drama)
+            for _ in capture_workers:
+                await episode_queue.put(None)
+            await asyncio.gather(*capture_workers)
+        finally:
+            for worker in capture_workers:
+                worker.cancel()
+            for provider in providers:
+                await provider.aclose()
+            meta_bar.close()
+            capture_bar.close()
+    if reused:
+        print(f"[INFO] {reused} episode(s) reused without kkey capture")
+
+class HostLimiter:
+    # Per-host request rate (token bucket) and in-flight cap for subtitle downloads
+    def __init__(self, rate=5, inflight=4):
+        self.rate = rate
+        self.inflight_cap = max(1, inflight)
+        self._hosts = {}
+        self._lock = threading.Lock()
+
+    def _state(self, url):
+        host = urlparse(url).netloc
+        with self._lock:
+            if host not in self._hosts:
+                self._hosts[host] = (TokenBucket(self.rate) if self.rate else None, threading.BoundedSemaphore(self.inflight_cap))
+            return self._hosts[host]
+
+    def bucket(self, url):
+        return self._state(url)[0]
+
+    def inflight(self, url):
+        return self._state(url)[1]
+
+    def close(self):
+        with self._lock:
+            for bucket, _ in self._hosts.values():
+                if bucket:
+                    bucket.close()
+
+def episode_folder(title, ep_num):
+    return os.path.join(OUTPUT_DIR, sanitize_filename(title), f"Episode_{ep_num}")
+
+def selected_tracks(sub_entries, langs):
+    return [entry for entry in sub_entries if not langs or entry.get("land") in langs]
+
+# The process umask, read once at import (reading it means setting it, which is not thread-safe)
+UMASK = os.umask(0o022)
+os.umask(UMASK)
+
+def write_atomic(path, data):
+    # Written to a temp file in the same folder and renamed over the target, so a crash
+    # never leaves a half-written subtitle behind. mkstemp creates the file 0600; it gets
+    # the target's mode, or what open() would have given a new file, before the rename.
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".", suffix=".part")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        try:
+            mode = os.stat(path).st_mode & 0o7777
+        except FileNotFoundError:
+            mode = 0o666 & ~UMASK
+        os.chmod(tmp, mode)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+def download_track(session, folder, entry, limiter=None, manifest=None, ep_id=None, skip_unchanged=False, store=None, cache=None, post=None, index=None):
+    # Returns (bytes downloaded, outcome), or None when the track failed. The outcome is
+    # "tracks" (written), "unchanged", "from_store" (linked from the store, no request) or
+    # "not_modified" (304 for the .srt already on disk).
+    # The body is decrypted in memory and the .srt written once; with skip_unchanged an
+    # existing file with identical content is left untouched. `post` renders the cues of
+    # the decrypted text into the other formats in the same pass, and `index` adds them to
+    # the search index.
+    url = entry["src"]
+    label = entry["label"]
+    ext = os.path.splitext(urlparse(url).path)[-1].lower()
+    final_file = os.path.join(folder, f"{label}.srt")
+    stage = "download"
+    try:
+        variant = post.variant if post else ""
+        found = store.lookup(url, variant) if store else None
+        if found:
+            digest, size, path = found
+            os.makedirs(folder, exist_ok=True)
+            linked = store.link(path, final_file)
+            if post:
+                stage = "postprocess"
+                post.reuse(final_file, ep_id, entry)
+            if index:
+                stage = "index"
+                with METRICS.timer("index", ep_id):
+                    index.refresh(final_file)
+            if manifest:
+                manifest.record_track(ep_id, entry, final_file, "decrypted", size, digest)
+            return 0, "from_store" if linked else "unchanged"
+        import requests
+        current = file_digest(final_file) if cache and os.path.isfile(final_file) else None
+        headers = cache.conditional_headers(url, current) if current else {}
+        try:
+            with METRICS.timer("download", ep_id), METRICS.inflight("download"):
+                if limiter:
+                    with limiter.inflight(url):
+                        r = get_with_retry(session, url, retries=3, backoff=2, limiter=limiter.bucket(url), timeout=10, headers=headers)
+                else:
+                    r = get_with_retry(session, url, retries=3, backoff=2, timeout=10, headers=headers)
+        except requests.RequestException:
+            RESPONSES.count("subtitle", "error")
+            raise
+        RESPONSES.count("subtitle", r.status_code)
+        METRICS.add_bytes("subtitles", len(r.content))
+        if r.status_code == 304 and headers:
+            if post:
+                stage = "postprocess"
+                post.reuse(final_file, ep_id, entry)
+            if index:
+                stage = "index"
+                with METRICS.timer("index", ep_id):
+                    index.refresh(final_file)
+            if manifest:
+                manifest.record_track(ep_id, entry, final_file, "decrypted", os.path.getsize(final_file), current)
+            return 0, "not_modified"
+        if not r.ok:
+            print(f"[WARN] Failed to download {label} (HTTP {r.status_code}): {url}")
+            METRICS.fail("download", f"http_{r.status_code}")
+            if manifest:
+                manifest.record_track(ep_id, entry, final_file, "failed")
+            return None
+        if manifest:
+            manifest.record_track(ep_id, entry, final_file, "downloaded")
+        # .srt is already decrypted
+        stage = "decrypt"
+        with METRICS.timer("decrypt", ep_id):
+            data = r.content if ext == ".srt" else decrypt_subtitle(r.content, ext)
+        os.makedirs(folder, exist_ok=True)
+        if post:
+            stage = "postprocess"
+            with METRICS.timer("postprocess", ep_id):
+                data = post.render(data, final_file, ep_id, entry)
+        digest = hashlib.sha256(data).hexdigest()
+        stage = "write"
+        if store:
+            written = store.link(store.put(url, data, digest, variant), final_file)
+        else:
+            written = not (skip_unchanged and os.path.isfile(final_file) and file_digest(final_file) == digest)
+            if written:
+                write_atomic(final_file, data)
+        if cache:
+            cache.put_validators(url, r.headers, digest)
+        if index:
+            stage = "index"
+            with METRICS.timer("index", ep_id):
+                index.add(final_file, data, digest)
+        if manifest:
+            manifest.record_track(ep_id, entry, final_file, "decrypted", len(data), digest)
+        return len(r.content), "tracks" if written else "unchanged"
+    except Exception as e:
+        print(f"[WARN] Failed to process {label}: {url}")
+        METRICS.fail(stage, failure_cause(e))
+        if manifest:
+            manifest.record_track(ep_id, entry, final_file, "failed")
         return None
-    sub_link = f"https://kisskh.ovh/api/Sub/{ep_id}?kkey={kkey}"
-    resp = requests.get(sub_link, headers={'Referer': drama_link})
-    return resp.json() if resp.status_code == 200 else None
 
-def download_and_decrypt_subs(title, ep_num, sub_entries, langs):
-    folder = os.path.join(OUTPUT_DIR, sanitize_filename(title), f"Episode_{ep_num}")
+def download_and_decrypt_subs(title, ep_num, sub_entries, langs, session=None, limiter=None, skip_unchanged=False, store=None, cache=None, post=None, index=None):
+    session = session or make_session()
+    folder = episode_folder(title, ep_num)
     os.makedirs(folder, exist_ok=True)
-    for entry in sub_entries:
-        if langs and entry.get("land") not in langs:
+    for entry in selected_tracks(sub_entries, langs):
+        download_track(session, folder, entry, limiter, skip_unchanged=skip_unchanged, store=store, cache=cache, post=post, index=index)
+
+# Every extension there is a key for, so reprocess picks up whatever Step 3 can decrypt
+RAW_EXTS = tuple(KEYS_BY_EXT)
+
+def iter_raw_subtitles(root):
+    # Lazy walk, so a tree with hundreds of thousands of files is never listed up front
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if os.path.splitext(name)[1].lower() in RAW_EXTS:
+                yield os.path.join(folder, name)
+
+def iter_chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+_decryptor = None
+_post = None
+
+def reprocess_chunk(paths, remove_raw=False, skip_unchanged=False, post_options=None):
+    # Runs in a worker process: decrypts every raw file of the chunk next to itself as .srt,
+    # rendered by a SubtitlePostProcessor(*post_options) when given.
+    # Returns (pid, files, unchanged, failed, bytes read, busy seconds).
+    global _decryptor, _post
+    if _decryptor is None:
+        _decryptor = SubtitleDecryptor()
+    if post_options and _post is None:
+        _post = SubtitlePostProcessor(*post_options)
+    started = time.perf_counter()
+    files = unchanged = failed = size = 0
+    for path in paths:
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            stem, ext = os.path.splitext(path)
+            out = _decryptor.decrypt(data, ext.lower())
+            final_file = stem + ".srt"
+            if post_options:
+                out = _post.render(out, final_file)
+            if skip_unchanged and os.path.isfile(final_file) and file_digest(final_file) == hashlib.sha256(out).hexdigest():
+                unchanged += 1
+            else:
+                write_atomic(final_file, out)
+                files += 1
+            if remove_raw:
+                os.remove(path)
+            size += len(data)
+        except Exception as e:
+            print(f"[WARN] Failed to reprocess {path}: {e}")
+            failed += 1
+    return os.getpid(), files, unchanged, failed, size, time.perf_counter() - started
+
+def reprocess(root, workers=None, chunk_size=256, remove_raw=False, skip_unchanged=False, post_options=None):
+    # Paths are submitted in chunks so IPC is paid per chunk rather than per file, and at
+    # most a few chunks per worker are queued so the walk stays ahead without piling up
+    from concurrent.futures import ProcessPoolExecutor
+    workers = workers or os.cpu_count() or 1
+    per_worker = {}
+    totals = [0, 0, 0, 0]
+    started = time.perf_counter()
+    bar = stage_bar("reprocess", desc="Reprocess", unit="file")
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+
+        def collect(done):
+            for future in done:
+                pid, files, unchanged, failed, size, busy = future.result()
+                stats = per_worker.setdefault(pid, [0, 0, 0.0])
+                stats[0] += files + unchanged + failed
+                stats[1] += size
+                stats[2] += busy
+                for i, value in enumerate((files, unchanged, failed, size)):
+                    totals[i] += value
+                bar.update(files + unchanged + failed)
+
+        for chunk in iter_chunks(iter_raw_subtitles(root), chunk_size):
+            if len(pending) >= workers * 4:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+            pending.add(executor.submit(reprocess_chunk, chunk, remove_raw, skip_unchanged, post_options))
+        collect(pending)
+    bar.close()
+
+    elapsed = max(time.perf_counter() - started, 1e-9)
+    count = totals[0] + totals[1] + totals[2]
+    print(f"[INFO] Reprocessed {count} file(s) in {elapsed:.1f}s with {workers} worker(s): {totals[0]} written, "
+          f"{totals[1]} unchanged, {totals[2]} failed ({count / elapsed:.1f} files/s, {totals[3] / 1024 / 1024 / elapsed:.1f} MiB/s)")
+    for pid, (files, size, busy) in sorted(per_worker.items()):
+        print(f"  worker {pid}: {files} file(s), {size / 1024 / 1024:.1f} MiB, busy {busy:.1f}s "
+              f"({files / max(busy, 1e-9):.1f} files/s)")
+    return totals
+
+def reprocess_main(argv):
+    parser = argparse.ArgumentParser(prog="cli_v8.py reprocess", description=f"Decrypt a tree of raw {'/'.join(RAW_EXTS)} subtitles to .srt")
+    parser.add_argument("root", nargs="?", default=OUTPUT_DIR, help="Directory to walk (default: dramas)")
+    parser.add_argument("-j", "--jobs", type=int, help="Worker processes (default: CPU count)")
+    parser.add_argument("--chunk", type=int, default=256, help="Files per task sent to a worker")
+    parser.add_argument("--remove-raw", action="store_true", help="Delete each raw file once its .srt is written")
+    parser.add_argument("--skip-unchanged", action="store_true", help="Leave an existing .srt untouched when the new content is identical")
+    add_post_arguments(parser, dual=False)
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        print(f"[WARN] Not a directory: {args.root}")
+        sys.exit(1)
+    post = post_processor(args, parser)
+    reprocess(args.root, args.jobs, max(1, args.chunk), args.remove_raw, args.skip_unchanged,
+              (post.formats, post.clean, post.merge_gap) if post else None)
+
+def changed_episodes(drama, seen):
+    # Episodes with subtitles that are new since the last poll or whose subtitle count changed;
+    # episodes still at `sub` 0 are only remembered, so they are picked up once subtitles appear
+    return [ep for ep in drama["Episodes"] if ep["sub"] and seen.get(str(ep["id"])) != [ep["number"], ep["sub"]]]
+
+def watch_cycle(watchlist, due, args, langs, providers, cache, manifest, store, post=None, index=None):
+    # Polls every due drama (at most args.max_concurrent at once), then runs kkey capture and
+    # Step 3 for the changed episodes of all of them together
+    session = make_session(args.max_concurrent)
+    limiter = TokenBucket(args.rate) if args.rate else None
+    with ThreadPoolExecutor(max_workers=args.max_concurrent) as executor:
+        polled = list(executor.map(lambda item: fetch_drama(session, item[0], limiter, cache, revalidate=True), due))
+
+    work = []
+    for (show_id, seen), (status, drama) in zip(due, polled):
+        if status != "ok":
+            print(f"[WARN] Watch: drama {show_id} {'not found' if status == 'missing' else 'could not be fetched'}")
+            continue
+        changed = changed_episodes(drama, seen)
+        if changed and not args.baseline:
+            work.append(dict(drama, Episodes=changed))
+
+    if work:
+        print(f"[INFO] Watch: {sum(len(drama['Episodes']) for drama in work)} new or changed episode(s) in {len(work)} drama(s)")
+        with RecordWriter(DRAMA_SUBTITLES_CSV, TRACK_FIELDS, append=True) as writer, \
+                Downloader(langs, args.dl_workers, args.dl_rate, args.dl_inflight, manifest=manifest,
+                           skip_unchanged=args.skip_unchanged, store=store, cache=cache, post=post, index=index) as downloader:
+            run_pipeline(work, None, args.threads, providers, writer, downloader, cache, None, manifest)
+
+    now = time.time()
+    scheduled = {drama["Show ID"]: {ep["id"] for ep in drama["Episodes"]} for drama in work}
+    for (show_id, seen), (status, drama) in zip(due, polled):
+        next_poll = now + args.interval * 3600 * random.uniform(1 - args.jitter, 1 + args.jitter)
+        if status != "ok":
+            watchlist.save(show_id, None, seen, next_poll, False)
             continue
-        url = entry["src"]
-        label = entry["label"]
-        ext = os.path.splitext(urlparse(url).path)[-1].lower()
-        raw_file = os.path.join(folder, f"{label}{ext}")
-        final_file = os.path.join(folder, f"{label}.srt")
-        time.sleep(1)
-        try:
-            r = requests.get(url, timeout=10)
-            if not r.ok:
+        episodes = {}
+        for ep in drama["Episodes"]:
+            key = str(ep["id"])
+            if ep["id"] in scheduled.get(show_id, ()) and manifest.episode_state(ep["id"]) != "done":
+                # Failed this time: keep the old entry so the episode is retried next poll
+                if key in seen:
+                    episodes[key] = seen[key]
                 continue
-            with open(raw_file, "wb") as f:
-                f.write(r.content)
-            if ext == ".srt":
-                # Already decrypted
-                os.rename(raw_file, final_file)
+            episodes[key] = [ep["number"], ep["sub"]]
+        watchlist.save(show_id, drama["Title"], episodes, next_poll, episodes != seen)
+    return len(work)
+
+def watch_main(argv):
+    global BASE_URL
+    parser = argparse.ArgumentParser(prog="cli_v8.py watch", description="Poll airing dramas and download only new or changed episodes")
+    parser.add_argument("ids", nargs="*", type=int, help="Drama IDs to add to the watch list")
+    parser.add_argument("--remove", nargs="+", type=int, default=[], help="Drama IDs to drop from the watch list")
+    parser.add_argument("--list", action="store_true", help="Print the watch list and exit")
+    parser.add_argument("--once", action="store_true", help="Poll the dramas that are due once and exit (for cron)")
+    parser.add_argument("--baseline", action="store_true", help="Record the current episodes as seen without downloading them")
+    parser.add_argument("--interval", type=float, default=6, help="Hours between polls of a drama")
+    parser.add_argument("--jitter", type=float, default=0.2, help="Randomise each interval by up to this fraction")
+    parser.add_argument("--max-concurrent", type=int, default=8, help="Max dramas polled at the same time")
+    parser.add_argument("--rate", type=float, default=10, help="Max poll requests per second (0 = unlimited)")
+    parser.add_argument("--watch-db", type=str, default=WATCH_DB, help="Watch list file")
+    parser.add_argument("--cache", type=str, default=CACHE_DB, help="Metadata cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the metadata cache")
+    add_capture_arguments(parser)
+    add_download_arguments(parser)
+    add_post_arguments(parser)
+    args = parser.parse_args(argv)
+    BASE_URL = args.base_url.rstrip("/")
+    args.max_concurrent = max(1, args.max_concurrent)
+    args.jitter = min(max(args.jitter, 0), 1)
+    langs = parse_langs(args.langs)
+
+    watchlist = WatchList(args.watch_db)
+    watchlist.add(args.ids)
+    watchlist.remove(args.remove)
+    if args.list:
+        print(watchlist.report())
+        watchlist.close()
+        return
+
+    cache = None if args.no_cache else MetaCache(args.cache)
+    manifest = RunManifest(args.manifest)
+    store = SubtitleStore(args.store) if args.store else None
+    post = post_processor(args, parser)
+    index = SubtitleIndex(args.index) if args.index else None
+    providers = build_kkey_providers(args.kkey, args.threads, args.recycle, args.kkey_endpoint)
+    try:
+        while True:
+            due = watchlist.due(time.time())
+            if due:
+                print(f"[INFO] Watch: polling {len(due)} drama(s) [Time : {current_time()}]")
+                watch_cycle(watchlist, due, args, langs, providers, cache, manifest, store, post, index)
+            if args.once:
+                break
+            next_poll = watchlist.next_due()
+            if next_poll is None:
+                print("[INFO] Watch list is empty")
+                break
+            time.sleep(min(max(next_poll - time.time(), 1), 60))
+    except KeyboardInterrupt:
+        print("[INFO] Watch stopped by user")
+    finally:
+        print(RESPONSES.summary())
+        print(watchlist.report())
+        if index:
+            print(index.report())
+        for closeable in (watchlist, manifest, store, cache, index):
+            if closeable:
+                closeable.close()
+
+def iter_srt_files(root):
+    for folder, _, files in os.walk(root):
+        for name in files:
+            if name.lower().endswith(".srt"):
+                yield os.path.abspath(os.path.join(folder, name))
+
+def build_index(root, path=INDEX_DB, batch=200):
+    # Incremental: files whose mtime and size match the index are not opened, changed ones
+    # are hashed and only re-parsed when their content differs, vanished ones are dropped
+    start = time.perf_counter()
+    index = SubtitleIndex(path)
+    known = index.known(root)
+    seen = set()
+    with stage_bar("index", desc="Index", unit="file") as bar:
+        for count, srt in enumerate(iter_srt_files(root), 1):
+            seen.add(srt)
+            try:
+                index.refresh(srt, known, commit=False)
+            except (OSError, sqlite3.Error) as e:
+                print(f"[WARN] Could not index {srt}: {e}")
+            if count % batch == 0:
+                index.commit()
+            bar.update(1)
+    index.commit()
+    index.remove([srt for srt in known if srt not in seen])
+    print(f"[INFO] Indexed {root} in {time.perf_counter() - start:.1f}s")
+    print(index.report())
+    index.close()
+
+def index_main(argv):
+    parser = argparse.ArgumentParser(prog="cli_v8.py index", description="Build or update the subtitle search index")
+    parser.add_argument("root", nargs="?", default=OUTPUT_DIR, help=f"Folder of decrypted subtitles (default: {OUTPUT_DIR})")
+    parser.add_argument("--index", type=str, default=INDEX_DB, help="Index file")
+    args = parser.parse_args(argv)
+    if not os.path.isdir(args.root):
+        print(f"[WARN] Not a directory: {args.root}")
+        sys.exit(1)
+    build_index(args.root, args.index)
+
+def search_main(argv):
+    parser = argparse.ArgumentParser(prog="cli_v8.py search", description="Search the subtitle index for lines of dialogue")
+    parser.add_argument("query", nargs="+", help='FTS5 query: words, "a phrase", prefix*, OR, NOT')
+    parser.add_argument("--show", type=str, help="Only shows whose title contains this")
+    parser.add_argument("--lang", type=str, help="Only this language label, e.g. English")
+    parser.add_argument("-n", "--limit", type=int, default=20)
+    parser.add_argument("--json", action="store_true", help="One JSON object per match")
+    parser.add_argument("--index", type=str, default=INDEX_DB, help="Index file")
+    args = parser.parse_args(argv)
+    if not os.path.isfile(args.index):
+        print(f"[WARN] No index at {args.index}; run: python cli_v8.py index")
+        sys.exit(1)
+    index = SubtitleIndex(args.index)
+    try:
+        matches = index.search(" ".join(args.query), args.show, args.lang, max(1, args.limit))
+    finally:
+        index.close()
+    for show, episode, language, start_ms, end_ms, text in matches:
+        if args.json:
+            print(json.dumps({"show": show, "episode": episode, "language": language, "start_ms": start_ms,
+                              "end_ms": end_ms, "text": text}, ensure_ascii=False))
+        else:
+            print(f"{show} | Episode {episode} | {language} | {SrtWriter.timestamp(start_ms)} ({start_ms} ms)  {text.replace(chr(10), ' / ')}")
+    if not args.json:
+        print(f"[INFO] {len(matches)} match(es)")
+
+class JobQueue:
+    # SQLite queue of episode jobs shared by a coordinator and its workers. A worker leases
+    # jobs for `lease_seconds` and renews the lease while it works on them; a lease that runs
+    # out (crashed or partitioned worker) puts the job back in the queue on the next lease
+    # call, until it has been tried `max_attempts` times. Jobs go queued -> leased -> done/failed.
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            ep_id INTEGER PRIMARY KEY, show_id INTEGER NOT NULL, title TEXT NOT NULL, ep_num TEXT NOT NULL,
+            sub_count INTEGER, state TEXT NOT NULL, worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+            bytes INTEGER, error TEXT, queued_at REAL NOT NULL, updated_at REAL NOT NULL);
+        CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_until);
+        CREATE TABLE IF NOT EXISTS workers (
+            worker TEXT PRIMARY KEY, first_seen REAL NOT NULL, last_seen REAL NOT NULL,
+            done INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, bytes INTEGER NOT NULL DEFAULT 0);
+        CREATE TABLE IF NOT EXISTS settings (key TEXT PRIMARY KEY, value REAL NOT NULL);
+    """
+
+    def __init__(self, path=QUEUE_DB, lease_seconds=None, max_attempts=None):
+        self.path = path
+        self._lock = threading.Lock()
+        # Autocommit, with explicit BEGIN IMMEDIATE around read-modify-write, so that workers
+        # on this machine can share the file with the coordinator
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode = WAL")
+        self._db.executescript(self.SCHEMA)
+        for key, value in (("lease_seconds", lease_seconds), ("max_attempts", max_attempts)):
+            if value is not None:
+                self._db.execute("INSERT OR REPLACE INTO settings VALUES (?, ?)", (key, value))
+        settings = dict(self._db.execute("SELECT key, value FROM settings"))
+        self.lease_seconds = settings.get("lease_seconds", 300)
+        self.max_attempts = int(settings.get("max_attempts", 3))
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._db
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self._db.execute("COMMIT")
+
+    def enqueue(self, jobs):
+        # jobs: (show_id, title, ep_num, ep_id, sub_count). New episodes are queued; failed ones
+        # and ones whose subtitle count changed are queued again; the rest keep their state.
+        # Returns the number of jobs queued.
+        now = time.time()
+        with self._transaction() as db:
+            before = db.total_changes
+            db.executemany("""INSERT INTO jobs (ep_id, show_id, title, ep_num, sub_count, state, queued_at, updated_at)
+                              VALUES (?, ?, ?, ?, ?, 'queued', ?, ?) ON CONFLICT (ep_id) DO UPDATE SET
+                              state = 'queued', sub_count = excluded.sub_count, worker = NULL, lease_until = NULL,
+                              attempts = 0, error = NULL, queued_at = excluded.queued_at, updated_at = excluded.updated_at
+                              WHERE jobs.state = 'failed' OR jobs.sub_count IS NOT excluded.sub_count""",
+                           [(int(ep_id), int(show_id), title, str(ep_num), sub_count, now, now)
+                            for show_id, title, ep_num, ep_id, sub_count in jobs])
+            return db.total_changes - before
+
+    def _expire(self, db, now):
+        db.execute("""UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                      error = 'lease expired on ' || worker, worker = NULL, lease_until = NULL, updated_at = ?
+                      WHERE state = 'leased' AND lease_until < ?""", (self.max_attempts, now, now))
+
+    def _seen(self, db, worker, now, done=0, failed=0, size=0):
+        db.execute("""INSERT INTO workers (worker, first_seen, last_seen, done, failed, bytes) VALUES (?, ?, ?, ?, ?, ?)
+                      ON CONFLICT (worker) DO UPDATE SET last_seen = excluded.last_seen, done = done + excluded.done,
+                      failed = failed + excluded.failed, bytes = bytes + excluded.bytes""", (worker, now, now, done, failed, size))
+
+    def lease(self, worker, count):
+        # Up to `count` jobs as [show_id, title, ep_num, ep_id], least-tried first, and the
+        # number of jobs still queued or leased by anyone (including these)
+        now = time.time()
+        with self._transaction() as db:
+            self._expire(db, now)
+            self._seen(db, worker, now)
+            rows = db.execute("""SELECT ep_id, show_id, title, ep_num FROM jobs WHERE state = 'queued'
+                                 ORDER BY attempts, show_id, ep_id LIMIT ?""", (max(0, count),)).fetchall()
+            db.executemany("""UPDATE jobs SET state = 'leased', worker = ?, lease_until = ?, attempts = attempts + 1,
+                              updated_at = ? WHERE ep_id = ?""", [(worker, now + self.lease_seconds, now, row[0]) for row in rows])
+            outstanding = db.execute("SELECT COUNT(*) FROM jobs WHERE state IN ('queued', 'leased')").fetchone()[0]
+        return [[show_id, title, ep_num, ep_id] for ep_id, show_id, title, ep_num in rows], outstanding
+
+    def renew(self, worker, ep_ids):
+        # Extends the worker's leases; returns how many it still holds
+        now = time.time()
+        with self._transaction() as db:
+            self._seen(db, worker, now)
+            before = db.total_changes
+            db.executemany("UPDATE jobs SET lease_until = ? WHERE ep_id = ? AND worker = ? AND state = 'leased'",
+                           [(now + self.lease_seconds, int(ep_id), worker) for ep_id in ep_ids])
+            return db.total_changes - before
+
+    def complete(self, worker, ep_id, ok, size=0, error=None):
+        # A success is kept even when the lease had already run out; a failure is only
+        # counted while the worker still holds the lease, and re-queues the job until
+        # max_attempts is reached
+        now = time.time()
+        with self._transaction() as db:
+            if ok:
+                changed = db.execute("""UPDATE jobs SET state = 'done', worker = ?, lease_until = NULL, bytes = ?,
+                                        error = NULL, updated_at = ? WHERE ep_id = ? AND state != 'done'""",
+                                     (worker, size, now, int(ep_id))).rowcount
             else:
-                with open(raw_file, "r", encoding="utf-8") as f, open(final_file, "w", encoding="utf-8") as out:
-                    for line in f:
-                        if is_encrypted(line):
-                            out.write(decrypt_line(line, ext) + "\n")
-                        else:
-                            out.write(line)
-                os.remove(raw_file)
-        except Exception as e:
-            print(f"[WARN] Failed to process {label}: {url}")
+                changed = db.execute("""UPDATE jobs SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'queued' END,
+                                        worker = NULL, lease_until = NULL, error = ?, updated_at = ?
+                                        WHERE ep_id = ? AND worker = ? AND state = 'leased'""",
+                                     (self.max_attempts, error, now, int(ep_id), worker)).rowcount
+            self._seen(db, worker, now, int(ok and changed > 0), int(not ok and changed > 0), size if ok and changed else 0)
+        return changed > 0
+
+    def release(self, worker, ep_ids):
+        # Hands leased jobs back without counting the attempt (worker shutting down)
+        now = time.time()
+        with self._transaction() as db:
+            db.executemany("""UPDATE jobs SET state = 'queued', worker = NULL, lease_until = NULL, attempts = MAX(attempts - 1, 0),
+                              updated_at = ? WHERE ep_id = ? AND worker = ? AND state = 'leased'""",
+                           [(now, int(ep_id), worker) for ep_id in ep_ids])
+
+    def status(self, window=300):
+        # Aggregated progress of all workers, as plain data (served as JSON by the coordinator)
+        now = time.time()
+        with self._lock:
+            states = dict(self._db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state"))
+            recent = self._db.execute("SELECT COUNT(*) FROM jobs WHERE state = 'done' AND updated_at >= ?", (now - window,)).fetchone()[0]
+            leased = dict(self._db.execute("SELECT worker, COUNT(*) FROM jobs WHERE state = 'leased' GROUP BY worker"))
+            workers = self._db.execute("SELECT worker, last_seen, done, failed, bytes FROM workers ORDER BY worker").fetchall()
+            started = self._db.execute("SELECT MIN(first_seen) FROM workers").fetchone()[0]
+            errors = self._db.execute("""SELECT error, COUNT(*) FROM jobs WHERE error IS NOT NULL AND state != 'done'
+                                         GROUP BY error ORDER BY COUNT(*) DESC LIMIT 5""").fetchall()
+        return {
+            "queue": self.path, "jobs": sum(states.values()), "states": states, "lease_seconds": self.lease_seconds,
+            # Over the last `window` seconds, or since the first worker showed up if that is shorter
+            "done_per_min": round(recent / (max(min(window, now - started), 1) / 60), 2) if started else 0,
+            "workers": [{"worker": worker, "leased": leased.get(worker, 0), "done": done, "failed": failed,
+                         "bytes": size, "last_seen_s": round(now - last_seen, 1)}
+                        for worker, last_seen, done, failed, size in workers],
+            "errors": [{"error": error, "jobs": count} for error, count in errors],
+        }
+
+    def report(self):
+        return queue_report(self.status())
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+def queue_report(status):
+    states = status["states"]
+    left = states.get("queued", 0) + states.get("leased", 0)
+    finished = states.get("done", 0) + states.get("failed", 0)
+    rate = status["done_per_min"]
+    eta = f", ETA {left / rate:.0f} min" if rate and left else ""
+    lines = [f"[INFO] Queue {status['queue']}: {status['jobs']} job(s), "
+             + ", ".join(f"{state} {states.get(state, 0)}" for state in ("queued", "leased", "done", "failed"))
+             + f" ({finished / status['jobs'] * 100 if status['jobs'] else 0:.1f}% finished), {rate:g} episodes/min{eta}"]
+    for worker in status["workers"]:
+        lines.append(f"  {worker['worker']:<28} leased {worker['leased']:>4}  done {worker['done']:>6}  failed {worker['failed']:>4}  "
+                     f"{worker['bytes'] / 1024:>9.1f} KiB  last seen {worker['last_seen_s']:.0f}s ago")
+    for error in status["errors"]:
+        lines.append(f"  {error['jobs']:>6} x {error['error']}")
+    return "\n".join(lines)
+
+class QueueClient:
+    # The JobQueue interface over the coordinator's HTTP endpoint, for workers on other machines
+    def __init__(self, url, token=None, retries=5):
+        import requests
+        self.url = url.rstrip("/")
+        self.path = self.url
+        self.retries = retries
+        self.session = requests.Session()
+        if token:
+            self.session.headers["X-Queue-Token"] = token
+
+    def _call(self, method, path, payload=None):
+        import requests
+        for attempt in range(self.retries + 1):
+            try:
+                r = self.session.request(method, self.url + path, json=payload, timeout=30)
+                if r.status_code < 500:
+                    if not r.ok:
+                        raise ConnectionError(f"coordinator {self.url} refused {path} (HTTP {r.status_code}): {r.text[:200]}")
+                    return r.json()
+                error = f"HTTP {r.status_code}"
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = failure_cause(e)
+            if attempt == self.retries:
+                raise ConnectionError(f"coordinator {self.url} unreachable ({error})")
+            time.sleep(min(2 ** attempt, 30))
+
+    def lease(self, worker, count):
+        answer = self._call("POST", "/lease", {"worker": worker, "count": count})
+        self.lease_seconds = answer["lease_seconds"]
+        return answer["jobs"], answer["outstanding"]
+
+    def renew(self, worker, ep_ids):
+        return self._call("POST", "/renew", {"worker": worker, "ep_ids": list(ep_ids)})["held"]
+
+    def complete(self, worker, ep_id, ok, size=0, error=None):
+        return self._call("POST", "/complete", {"worker": worker, "ep_id": ep_id, "ok": ok, "size": size, "error": error})["accepted"]
+
+    def release(self, worker, ep_ids):
+        self._call("POST", "/release", {"worker": worker, "ep_ids": list(ep_ids)})
+
+    def status(self):
+        status = self._call("GET", "/status")
+        self.lease_seconds = status["lease_seconds"]
+        return status
+
+    def report(self):
+        return queue_report(self.status())
+
+    def close(self):
+        self.session.close()
+
+def open_queue(spec, token=None):
+    # A coordinator URL (http://host:port) or the path of a queue file on this machine
+    return QueueClient(spec, token) if re.match(r"https?://", spec) else JobQueue(spec)
+
+def serve_queue(jobs, host, port, token=None):
+    # JSON endpoint in front of a JobQueue on a daemon thread: POST /lease, /renew, /complete,
+    # /release; GET /status (JSON) and GET / (text report). Returns the server.
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    class QueueHandler(BaseHTTPRequestHandler):
+        server_version = "kisskh-queue/1.0"
+
+        def log_message(self, format, *args):
+            pass
+
+        def send(self, status, body, content_type="application/json"):
+            data = (json.dumps(body) if content_type == "application/json" else body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def authorized(self):
+            if token and not hmac.compare_digest(self.headers.get("X-Queue-Token", "").encode(), token.encode()):
+                self.send(403, {"error": "bad token"})
+                return False
+            return True
+
+        def do_GET(self):
+            if not self.authorized():
+                return
+            if self.path == "/status":
+                self.send(200, jobs.status())
+            elif self.path == "/":
+                self.send(200, jobs.report() + "\n", "text/plain; charset=utf-8")
+            else:
+                self.send(404, {"error": "not found"})
+
+        def do_POST(self):
+            if not self.authorized():
+                return
+            try:
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                worker = str(body["worker"])
+                if self.path == "/lease":
+                    leased, outstanding = jobs.lease(worker, int(body.get("count", 1)))
+                    self.send(200, {"jobs": leased, "outstanding": outstanding, "lease_seconds": jobs.lease_seconds})
+                elif self.path == "/renew":
+                    self.send(200, {"held": jobs.renew(worker, body["ep_ids"])})
+                elif self.path == "/complete":
+                    accepted = jobs.complete(worker, body["ep_id"], bool(body["ok"]), int(body.get("size") or 0), body.get("error"))
+                    self.send(200, {"accepted": accepted})
+                elif self.path == "/release":
+                    jobs.release(worker, body["ep_ids"])
+                    self.send(200, {})
+                else:
+                    self.send(404, {"error": "not found"})
+            except (KeyError, ValueError, TypeError) as e:
+                self.send(400, {"error": f"bad request: {e}"})
+
+    server = ThreadingHTTPServer((host, port), QueueHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def host_port(value, default_port=8790):
+    host, _, port = value.rpartition(":")
+    return host or "127.0.0.1", int(port or default_port)
+
+def is_loopback(host):
+    import ipaddress
+    if host.lower() == "localhost":
+        return True
+    try:
+        return ipaddress.ip_address(host.strip("[]")).is_loopback
+    except ValueError:
+        return False
+
+def coordinator_main(argv):
+    global BASE_URL
+    parser = argparse.ArgumentParser(prog="cli_v8.py coordinator",
+                                     description="Expand drama IDs into episode jobs on a shared queue and serve it to workers")
+    parser.add_argument("start_id", nargs="?", type=int)
+    parser.add_argument("-E", "--end-id", type=int)
+    parser.add_argument("-e", "--ep", type=str, help="Comma-separated episodes to queue")
+    parser.add_argument("--queue", type=str, default=QUEUE_DB, help="Queue file (or a coordinator URL with --status)")
+    parser.add_argument("--serve", nargs="?", const="127.0.0.1:8790",
+                        help="Serve the queue to workers on [host]:port (default 127.0.0.1:8790) until it is drained; other hosts need --token")
+    parser.add_argument("--token", type=str, help="Shared secret workers must send (required to serve beyond loopback)")
+    parser.add_argument("--lease", type=float, default=300, help="Seconds a worker holds a job without renewing it")
+    parser.add_argument("--max-attempts", type=int, default=3, help="Leases per job before it is marked failed")
+    parser.add_argument("--interval", type=float, default=10, help="Seconds between progress reports while serving")
+    parser.add_argument("--linger", type=float, default=15, help="Seconds to keep serving after the queue is drained, so idle workers see it")
+    parser.add_argument("--status", action="store_true", help="Print the aggregated progress of the queue and exit")
+    parser.add_argument("--meta-workers", type=int, default=8)
+    parser.add_argument("--rate", type=float, default=10)
+    parser.add_argument("--max-missing", type=int, default=100)
+    parser.add_argument("--base-url", type=str, default=BASE_URL)
+    parser.add_argument("--cache", type=str, default=CACHE_DB)
+    parser.add_argument("--no-cache", action="store_true")
+    args = parser.parse_args(argv)
+    if args.serve is not None and not args.token and not is_loopback(host_port(args.serve)[0]):
+        parser.error(f"--serve {args.serve} accepts workers from other machines; set --token")
+    BASE_URL = args.base_url.rstrip("/")
+    if args.status:
+        jobs = open_queue(args.queue, args.token)
+        try:
+            print(jobs.report())
+        except ConnectionError as e:
+            print(f"[WARN] {e}")
+            sys.exit(1)
+        finally:
+            jobs.close()
+        return
+
+    jobs = JobQueue(args.queue, args.lease, args.max_attempts)
+    if args.start_id is not None:
+        selected_eps = {episode_number(ep) for ep in re.split(r"[,\s]+", args.ep.strip()) if ep} if args.ep else None
+        cache = None if args.no_cache else MetaCache(args.cache)
+        queued = total = 0
+        for drama in iter_drama_data(args.start_id, args.end_id or args.start_id, args.meta_workers, args.rate, args.max_missing, cache):
+            batch = [(drama["Show ID"], drama["Title"], ep["number"], ep["id"], ep["sub"])
+                     for ep in drama["Episodes"] if not selected_eps or ep["number"] in selected_eps]
+            total += len(batch)
+            queued += jobs.enqueue(batch)
+        if cache:
+            cache.close()
+        print(f"[INFO] Coordinator: {queued} of {total} episode job(s) queued; the rest are already done or in progress")
+    print(jobs.report())
+    if not args.serve:
+        jobs.close()
+        return
+
+    host, port = host_port(args.serve)
+    server = serve_queue(jobs, host, port, args.token)
+    print(f"[INFO] Coordinator serving {args.queue} on http://{host}:{port} (workers: cli_v8.py worker --queue http://<this host>:{port})")
+    last = None
+    try:
+        while True:
+            time.sleep(args.interval)
+            status = jobs.status()
+            progress = (status["states"], [(worker["worker"], worker["leased"]) for worker in status["workers"]])
+            if progress != last:
+                print(queue_report(status))
+                last = progress
+            if not status["states"].get("queued") and not status["states"].get("leased"):
+                print(f"[INFO] Queue drained; stopping in {args.linger:g}s")
+                time.sleep(args.linger)
+                break
+    except KeyboardInterrupt:
+        print("[INFO] Coordinator stopped by user; leased jobs return to the queue when their lease runs out")
+    finally:
+        server.shutdown()
+        print(jobs.report())
+        jobs.close()
+
+def worker_main(argv):
+    global BASE_URL
+    import socket
+    parser = argparse.ArgumentParser(prog="cli_v8.py worker",
+                                     description="Lease episode jobs from a coordinator, capture kkeys, download and decrypt")
+    parser.add_argument("--queue", type=str, default=QUEUE_DB, help="Coordinator URL (http://host:8790) or a queue file on this machine")
+    parser.add_argument("--token", type=str, help="Shared secret of the coordinator")
+    parser.add_argument("--id", type=str, default=f"{socket.gethostname()}:{os.getpid()}", help="Worker name shown in the progress view")
+    parser.add_argument("--batch", type=int, help="Jobs leased ahead of capture (default: --threads)")
+    parser.add_argument("--poll", type=float, default=5, help="Seconds between lease attempts while the queue is empty")
+    add_capture_arguments(parser, "Browsers in this worker's kkey capture pool")
+    add_download_arguments(parser)
+    add_post_arguments(parser)
+    args = parser.parse_args(argv)
+    BASE_URL = args.base_url.rstrip("/")
+    langs = parse_langs(args.langs)
+    batch = max(1, args.batch or args.threads)
+
+    jobs = open_queue(args.queue, args.token)
+    try:
+        print(jobs.report())
+    except ConnectionError as e:
+        print(f"[WARN] {e}")
+        sys.exit(1)
+    # Resuming: a job that comes back to this machine skips the tracks it already finished
+    manifest = RunManifest(args.manifest, resume=True)
+    store = SubtitleStore(args.store) if args.store else None
+    index = SubtitleIndex(args.index) if args.index else None
+    post = post_processor(args, parser)
+    providers = build_kkey_providers(args.kkey, args.threads, args.recycle, args.kkey_endpoint)
+    # ep_id -> job for every lease this worker holds; `waiting` of them are not captured yet
+    held = {}
+    waiting = 0
+    lock = threading.Lock()
+    stop = threading.Event()
+
+    def report(ep_id, ok, size=0, error=None):
+        with lock:
+            held.pop(ep_id, None)
+        try:
+            jobs.complete(args.id, ep_id, ok, size, error)
+        except ConnectionError as e:
+            print(f"[WARN] Could not report episode {ep_id}: {e}")
+
+    def leased_jobs():
+        nonlocal waiting
+        while not stop.is_set():
+            with lock:
+                room = batch - waiting
+            if room <= 0:
+                stop.wait(0.2)
+                continue
+            try:
+                leased, outstanding = jobs.lease(args.id, room)
+            except ConnectionError as e:
+                print(f"[WARN] {e}")
+                return
+            with lock:
+                for job in leased:
+                    held[job[3]] = job
+                waiting += len(leased)
+                mine = len(held)
+            for job in leased:
+                yield tuple(job)
+            if not leased:
+                if outstanding <= mine:
+                    # Nothing queued and nothing leased elsewhere that could still come back
+                    return
+                stop.wait(args.poll)
+
+    def heartbeat():
+        while not stop.wait(jobs.lease_seconds / 3):
+            with lock:
+                ep_ids = list(held)
+            if ep_ids:
+                try:
+                    jobs.renew(args.id, ep_ids)
+                except ConnectionError as e:
+                    print(f"[WARN] Lease renewal failed: {e}")
+
+    threading.Thread(target=heartbeat, daemon=True).start()
+    print(f"[INFO] Worker {args.id}: leasing from {jobs.path}, {args.threads} capture thread(s), batch {batch}")
+    with RecordWriter(DRAMA_SUBTITLES_CSV, TRACK_FIELDS, append=True) as writer, \
+            Downloader(langs, args.dl_workers, args.dl_rate, args.dl_inflight, manifest=manifest, skip_unchanged=args.skip_unchanged,
+                       store=store, post=post, index=index,
+                       on_episode=lambda ep_id, failed, size: report(ep_id, not failed, size, "download failed" if failed else None)) as downloader:
+        try:
+            captured = CapturePool(args.threads, providers).map(leased_jobs())
+            with contextlib.closing(captured):
+                for job, result, latency in captured:
+                    with lock:
+                        waiting -= 1
+                    manifest.record_episode(job, "failed" if result is None else "kkey-captured", result)
+                    if result is None:
+                        report(job[3], False, error="kkey capture failed")
+                        continue
+                    writer.write_rows(track_rows(*job, result))
+                    downloader.submit(job, result)
+        except KeyboardInterrupt:
+            downloader.cancel()
+    stop.set()
+    with lock:
+        unfinished = list(held)
+    if unfinished:
+        # Cancelled or cut off: hand the rest back instead of waiting for the leases to run out
+        print(f"[INFO] Worker {args.id}: returning {len(unfinished)} unfinished job(s) to the queue")
+        with contextlib.suppress(ConnectionError):
+            jobs.release(args.id, unfinished)
+    for provider in providers:
+        print(f"[INFO] kkey provider {provider.name}: {provider.hits} hit(s), {provider.misses} miss(es)")
+    print(RESPONSES.summary())
+    print(METRICS.summary())
+    print(manifest.report())
+    with contextlib.suppress(ConnectionError):
+        print(jobs.report())
+    for closeable in (manifest, store, index, jobs):
+        if closeable:
+            closeable.close()
 
 def main():
+    global BASE_URL, EVENTS
+    if len(sys.argv) > 1 and sys.argv[1] == "reprocess":
+        return reprocess_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "watch":
+        return watch_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "index":
+        return index_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "search":
+        return search_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "coordinator":
+        return coordinator_main(sys.argv[2:])
+    if len(sys.argv) > 1 and sys.argv[1] == "worker":
+        return worker_main(sys.argv[2:])
     parser = argparse.ArgumentParser(description="KissKH Subtitle Downloader CLI")
     parser.add_argument("start_id", nargs="?", type=int)
     parser.add_argument("-E", "--end-id", type=int)
     parser.add_argument("-e", "--ep", type=str, help="Comma-separated episodes to download")
-    parser.add_argument("-t", "--threads", type=int, default=6)
-    parser.add_argument("-l", "--langs", type=str, help="Comma-separated language codes to keep (en,hi,etc)")
+    add_capture_arguments(parser, "Number of browsers in the kkey capture pool (with --adaptive: the most allowed)")
+    parser.add_argument("--adaptive", action="store_true", help="Grow/shrink concurrent kkey captures with latency, 429s/timeouts, memory and CPU")
+    parser.add_argument("--min-threads", type=int, default=1, help="Fewest concurrent captures --adaptive may go down to")
+    parser.add_argument("--min-free-mb", type=float, default=512, help="--adaptive shrinks below this much available memory")
+    add_download_arguments(parser)
     parser.add_argument("-c", "--csv", choices=["keep", "delete"], default="keep")
     parser.add_argument("-m", "--meta-skip", action="store_true")
+    parser.add_argument("-w", "--meta-workers", type=int, default=8, help="Concurrent requests for Step 1 drama metadata")
+    parser.add_argument("--rate", type=float, default=10, help="Max Step 1 requests per second (0 = unlimited)")
+    parser.add_argument("--max-missing", type=int, default=100, help="Stop Step 1 after this many consecutive missing IDs (0 = never)")
+    parser.add_argument("--cache", type=str, default=CACHE_DB, help="Metadata cache file")
+    parser.add_argument("--no-cache", action="store_true", help="Do not read or write the metadata cache")
+    parser.add_argument("--cache-max-mb", type=float, default=256, help="Evict least-recently-used cache entries above this size")
+    parser.add_argument("--airing-ttl", type=float, default=6, help="Hours before cached metadata of an airing drama is refetched")
+    parser.add_argument("--finished-ttl", type=float, default=720, help="Hours before cached metadata of a finished drama is refetched")
+    parser.add_argument("--cache-stats", action="store_true", help="Print cache statistics (alone: print and exit)")
+    parser.add_argument("--resume", action="store_true", help="Skip episodes and tracks the manifest records as complete; retry failures")
+    parser.add_argument("--metrics-json", type=str, help="Write a JSON run report with per-stage timings, failures and bytes")
+    parser.add_argument("--prometheus", type=str, help="Write the run metrics as a Prometheus text file (node_exporter textfile format)")
+    parser.add_argument("--engine", choices=["thread", "async"], default="thread", help="Run Steps 1-2 on browser threads or on one asyncio event loop")
+    parser.add_argument("--capture-limit", type=int, default=64, help="With --engine async: episodes in kkey capture at once")
+    parser.add_argument("--sub-limit", type=int, default=16, help="With --engine async: concurrent /api/Sub requests")
+    parser.add_argument("--events", action="store_true", help="Report progress as JSON lines on stdout instead of progress bars (used by the GUI)")
+    add_post_arguments(parser)
     args = parser.parse_args()
+    BASE_URL = args.base_url.rstrip("/")
+    METRICS.per_episode = bool(args.metrics_json)
+    if args.events:
+        EVENTS = EventStream()
+        if hasattr(signal, "SIGBREAK"):
+            # The GUI cancels with CTRL_BREAK_EVENT on Windows; handle it like Ctrl+C
+            signal.signal(signal.SIGBREAK, signal.default_int_handler)
 
     
     # Normalize and sort episode list
     if args.ep:
-        selected_eps = sorted(set(map(int, re.split(r"[,\s]+", args.ep.strip()))))
+        selected_eps = {episode_number(ep) for ep in re.split(r"[,\s]+", args.ep.strip()) if ep}
     else:
         selected_eps = None
 
-    # Normalize and sanitize language codes (en.hi → en,hi → {"en", "hi"})
-    if args.langs:
-        langs = set(re.split(r"[,.\s]+", args.langs.strip()))
-    else:
-        langs = None
+    langs = parse_langs(args.langs)
     start_id = args.start_id
     end_id = args.end_id if args.end_id else start_id
 
-    if not args.meta_skip:
-        drama_data = fetch_drama_data(start_id, end_id)
-    else:
-        print("[INFO] Using Existing CSV meta files by user")
-        drama_data = pd.read_csv(DRAMA_DETAILS_CSV).to_dict("records")
-
-    subtitle_data = []
-    futures = {}
-    with ThreadPoolExecutor(max_workers=args.threads) as executor:
-        for drama in drama_data:
-            show_id = drama["Show ID"]
-            title = drama["Title"]
-            episodes = parse_episode_details(drama["Episode Details"])
-            for ep in episodes:
-                if selected_eps and ep["number"] not in selected_eps:
-                    continue
-                future = executor.submit(fetch_kkey_and_subs_task, show_id, title, ep["number"], ep["id"])
-                futures[future] = (title, ep["number"])
-
-        for future in tqdm(as_completed(futures), total=len(futures), desc="Step 2: Subtitle Metadata"):
-            result = future.result()
-            title, ep_num = futures[future]
-            if result:
-                subtitle_data.append((title, ep_num, result))
+    cache = None
+    if not args.no_cache:
+        cache = MetaCache(args.cache, int(args.cache_max_mb * 1024 * 1024), args.airing_ttl * 3600, args.finished_ttl * 3600)
+    if start_id is None and not args.meta_skip:
+        if cache and args.cache_stats:
+            print(cache.report())
+            return
+        parser.error("start_id is required")
 
+    drama_data = None
+    known_tracks = None
+    if args.meta_skip:
+        print("[INFO] Using Existing CSV meta files by user")
+        shows = range(start_id, end_id + 1) if start_id is not None else None
+        drama_data = load_dramas(DRAMA_DETAILS_CSV, shows, selected_eps)
+        known_tracks = {}
+        if os.path.exists(DRAMA_SUBTITLES_CSV):
+            try:
+                known_tracks = load_known_tracks(DRAMA_SUBTITLES_CSV, drama_data, shows, selected_eps)
+            except ValueError as e:
+                print(f"[WARN] {e}")
+                sys.exit(1)
 
-    pd.DataFrame([{"Title": t, "Episode Number": ep, "Subtitle Data": json.dumps(subs)} for t, ep, subs in subtitle_data]).to_csv(DRAMA_SUBTITLES_CSV, index=False, encoding="utf-8-sig")
-    #print(f"Step 2: Subtitle Metadata: 100%|{'█'*24} {len(subtitle_data)}/{len(subtitle_data)} [00:00<00:00]")
+    manifest = RunManifest(args.manifest, args.resume)
+    store = SubtitleStore(args.store) if args.store else None
+    post = post_processor(args, parser)
+    index = SubtitleIndex(args.index) if args.index else None
+    providers = build_kkey_providers(args.kkey, args.threads, args.recycle, args.kkey_endpoint)
+    controller = None
+    if args.adaptive:
+        if args.engine == "async":
+            print("[WARN] --adaptive applies to the thread engine; the async engine keeps its fixed page pool")
+        else:
+            controller = ConcurrencyController(args.min_threads, args.threads, min_free_mb=args.min_free_mb)
+    with RecordWriter(DRAMA_SUBTITLES_CSV, TRACK_FIELDS) as writer, \
+            Downloader(langs, args.dl_workers, args.dl_rate, args.dl_inflight, manifest=manifest, skip_unchanged=args.skip_unchanged, store=store, cache=cache, post=post, index=index) as downloader:
+        try:
+            if args.engine == "async":
+                import asyncio
+                asyncio.run(run_async_engine(
+                    start_id, end_id, selected_eps, providers, writer, downloader, drama_data, cache, known_tracks, manifest,
+                    args.meta_workers, args.capture_limit, args.sub_limit, args.rate, args.max_missing))
+            else:
+                if drama_data is None:
+                    drama_data = iter_drama_data(start_id, end_id, args.meta_workers, args.rate, args.max_missing, cache)
+                run_pipeline(drama_data, selected_eps, args.threads, providers, writer, downloader, cache, known_tracks, manifest, controller)
+        except KeyboardInterrupt:
+            # Ctrl+C or the GUI's Cancel button: finished tracks are kept, queued ones dropped
+            downloader.cancel()
+    cancelled = downloader.cancelled.is_set()
+    if cancelled:
+        print("\n[INFO] Cancelled by user; finished tracks are kept, --resume continues from here")
+    capture = METRICS.stage_stats().get("episode_capture")
+    if capture and not cancelled:
+        print(f"[INFO] kkey capture latency per episode: avg {capture['avg_s']:.2f}s, "
+              f"p50 {capture['p50_s']:.2f}s, p95 {capture['p95_s']:.2f}s, max {capture['max_s']:.2f}s")
+    for provider in providers:
+        print(f"[INFO] kkey provider {provider.name}: {provider.hits} hit(s), {provider.misses} miss(es)")
+    if controller:
+        print(controller.summary())
+    print(RESPONSES.summary())
+    print(METRICS.summary())
+    if args.metrics_json:
+        METRICS.write_json(args.metrics_json)
+        print(f"[INFO] Run report written to {args.metrics_json}")
+    if args.prometheus:
+        METRICS.write_prometheus(args.prometheus)
+        print(f"[INFO] Prometheus metrics written to {args.prometheus}")
     print(f"[INFO] Saved subtitle metadata to {DRAMA_SUBTITLES_CSV} [Time : {current_time()}]")
-
-    for title, ep, subs in tqdm(sorted(subtitle_data, key=lambda x: (sanitize_filename(x[0]), x[1])), desc="Step 3: Download + Decrypt"):
-        download_and_decrypt_subs(title, ep, subs, langs)
+    print(manifest.report())
+    manifest.close()
+    if store:
+        print(store.report())
+        store.close()
+    if index:
+        print(index.report())
+        index.close()
 
     if args.csv == "delete":
         try:
@@ -207,6 +3558,15 @@ def main():
     else:
         print(f"[INFO] CSV meta files keep by user")
 
+    if cache:
+        if args.cache_stats:
+            print(cache.report())
+        cache.close()
+
+    if EVENTS:
+        EVENTS.emit("done", cancelled=cancelled, **downloader.stats)
+    if cancelled:
+        sys.exit(130)
     print(f"[INFO] All Subtitles Download Completed [Time : {current_time()}]")
 
 if __name__ == "__main__":
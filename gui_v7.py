@@ -2,24 +2,70 @@ import tkinter as tk
 from tkinter import messagebox, ttk, filedialog
 import subprocess
 import threading
-import datetime
+import logging
+import logging.handlers
+import queue
+import json
 import os
+import sys
+import signal
 import platform
 
 LOG_FILE = "kisskh_gui_log.txt"
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUPS = 3
 DEFAULT_SCRIPT = "cli_v8.py"
+POLL_MS = 100
+MAX_EVENTS_PER_POLL = 2000
+MAX_OUTPUT_LINES = 5000
+CANCEL_GRACE_MS = 5000
+STAGES = [("metadata", "Step 1: Drama metadata"), ("capture", "Step 2: Subtitle metadata"), ("download", "Step 3: Download + Decrypt")]
+# A frozen .exe is not a Python interpreter
+PYTHON = "python" if getattr(sys, "frozen", False) else sys.executable
 
 script_path = DEFAULT_SCRIPT
 if not os.path.exists(script_path):
     script_path = filedialog.askopenfilename(title="Select Python Script", filetypes=[("Python files", "*.py")])
 
-def log(message):
-    timestamp = datetime.datetime.now().strftime("[%Y-%m-%d %H:%M:%S]")
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"{timestamp} {message}\n")
+# Rotating log file behind a memory buffer: records are written in batches (errors at once)
+# instead of reopening the file for every output line
+file_handler = logging.handlers.RotatingFileHandler(LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUPS, encoding="utf-8", delay=True)
+file_handler.setFormatter(logging.Formatter("[%(asctime)s] %(message)s", "%Y-%m-%d %H:%M:%S"))
+log_buffer = logging.handlers.MemoryHandler(200, flushLevel=logging.ERROR, target=file_handler)
+logger = logging.getLogger("kisskh_gui")
+logger.setLevel(logging.INFO)
+logger.addHandler(log_buffer)
+
+# Filled by the reader thread, drained on the Tk main loop by poll_events
+events = queue.Queue()
+process = None
+cancel_requested = False
+run_result = {}
+
+def log(message, level=logging.INFO):
+    logger.log(level, message)
+
+def read_output(proc):
+    # Background thread: parses the downloader's output but never touches a Tk widget
+    for line in proc.stdout:
+        line = line.rstrip("\n")
+        event = None
+        if line.startswith("{"):
+            try:
+                event = json.loads(line)
+            except ValueError:
+                pass
+        if isinstance(event, dict) and "event" in event:
+            events.put(("event", event))
+        else:
+            events.put(("line", line))
+    events.put(("exit", proc.wait()))
 
 def run_downloader():
-    args = ["python", script_path]
+    global process, cancel_requested
+    if process is not None and process.poll() is None:
+        return
+    args = [PYTHON, script_path, "--events"]
 
     if start_id.get():
         args.append(start_id.get())
@@ -39,37 +85,128 @@ def run_downloader():
 
     log("Running: " + " ".join(args))
 
-    
-    def target():
+    startupinfo = None
+    creationflags = 0
+    if platform.system() == "Windows":
+        startupinfo = subprocess.STARTUPINFO()
+        startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
+        # Own process group, so Cancel can send CTRL_BREAK_EVENT to the downloader alone
+        creationflags = subprocess.CREATE_NEW_PROCESS_GROUP
+    try:
+        process = subprocess.Popen(
+            args,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+            bufsize=1,
+            env=dict(os.environ, PYTHONUNBUFFERED="1", PYTHONIOENCODING="utf-8"),
+            startupinfo=startupinfo,
+            creationflags=creationflags,
+        )
+    except OSError as e:
+        log(f"Error: {e}", logging.ERROR)
+        messagebox.showerror("Error", str(e))
+        return
+    cancel_requested = False
+    run_result.clear()
+    reset_progress()
+    run_btn.config(state="disabled")
+    cancel_btn.config(state="normal")
+    threading.Thread(target=read_output, args=(process,), daemon=True).start()
+
+def cancel_run():
+    global cancel_requested
+    if process is None or process.poll() is not None:
+        return
+    cancel_requested = True
+    cancel_btn.config(state="disabled")
+    append_output(["[INFO] Cancelling..."])
+    log("[INFO] Cancel requested")
+    # Graceful first: the downloader drops queued work and closes its browsers
+    try:
+        if platform.system() == "Windows":
+            process.send_signal(signal.CTRL_BREAK_EVENT)
+        else:
+            process.send_signal(signal.SIGINT)
+    except (OSError, ValueError):
+        process.kill()
+    root.after(CANCEL_GRACE_MS, force_stop, process)
+
+def force_stop(proc):
+    if proc.poll() is None:
+        log("[WARN] Downloader did not stop in time; killing it", logging.WARNING)
+        proc.kill()
+
+def poll_events():
+    # Everything queued since the last tick is applied in one batch: output lines in a
+    # single insert, and only the latest progress event of each stage
+    lines = []
+    progress = {}
+    exit_code = None
+    for _ in range(MAX_EVENTS_PER_POLL):
         try:
-            startupinfo = None
-            if platform.system() == "Windows":
-                startupinfo = subprocess.STARTUPINFO()
-                startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
-
-            process = subprocess.Popen(
-                args,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                startupinfo=startupinfo
-            )
-            completed = False
-            for line in process.stdout:
+            kind, payload = events.get_nowait()
+        except queue.Empty:
+            break
+        if kind == "line":
+            lines.append(payload)
+        elif kind == "exit":
+            exit_code = payload
+        elif payload["event"] == "progress":
+            progress[payload.get("stage")] = payload
+        elif payload["event"] == "done":
+            run_result.update(payload)
+    if lines:
+        append_output(lines)
+        for line in lines:
+            if line.strip():
                 log(line.strip())
-                output_text.insert(tk.END, line)
-                output_text.see(tk.END)
-                if "All Subtitles Download Completed" in line:
-                    completed = True
-            process.wait()
-            log("Download completed.")
-            if completed:
-                messagebox.showinfo("Success", "All subtitles downloaded and saved successfully!")
-        except Exception as e:
-            log(f"Error: {e}")
-            messagebox.showerror("Error", str(e))
-
-    threading.Thread(target=target).start()
+    for stage, payload in progress.items():
+        update_stage(stage, payload)
+    if exit_code is not None:
+        run_finished(exit_code)
+    root.after(POLL_MS, poll_events)
+
+def append_output(lines):
+    output_text.insert(tk.END, "\n".join(lines) + "\n")
+    count = int(output_text.index("end-1c").split(".")[0])
+    if count > MAX_OUTPUT_LINES:
+        output_text.delete("1.0", f"{count - MAX_OUTPUT_LINES}.0")
+    output_text.see(tk.END)
+
+def update_stage(stage, payload):
+    if stage not in stage_widgets:
+        return
+    bar, count = stage_widgets[stage]
+    done, total = payload.get("done", 0), payload.get("total", 0)
+    bar.config(maximum=max(total, 1), value=min(done, max(total, 1)))
+    text = f"{done}/{total}" if total else str(done)
+    if payload.get("postfix"):
+        text += f"  ({payload['postfix']})"
+    count.config(text=text)
+
+def reset_progress():
+    for bar, count in stage_widgets.values():
+        bar.config(value=0, maximum=1)
+        count.config(text="")
+
+def run_finished(code):
+    global process
+    process = None
+    run_btn.config(state="normal")
+    cancel_btn.config(state="disabled")
+    log(f"Downloader exited with code {code}.")
+    log_buffer.flush()
+    if cancel_requested or run_result.get("cancelled"):
+        append_output(["[INFO] Download cancelled."])
+    elif code == 0 and run_result:
+        messagebox.showinfo("Success", f"All subtitles downloaded and saved successfully!\n\n"
+                                       f"{run_result.get('tracks', 0)} saved, {run_result.get('unchanged', 0)} unchanged, "
+                                       f"{run_result.get('failed', 0)} failed")
+    else:
+        messagebox.showerror("Error", f"The downloader stopped with exit code {code}. See the output log for details.")
 
 def new_script():
     global script_path
@@ -81,20 +218,32 @@ def new_script():
     csv_option.set("keep")
     meta_skip.set(False)
     output_text.delete("1.0", tk.END)
+    reset_progress()
 
     script_path = DEFAULT_SCRIPT if os.path.exists(DEFAULT_SCRIPT) else filedialog.askopenfilename(title="Select Python Script", filetypes=[("Python files", "*.py")])
     script_label.config(text=f"Using Script: {os.path.basename(script_path)}")
     log("[INFO] New script session started")
 
 def clear_log_file():
+    log_buffer.flush()
+    file_handler.close()
     if os.path.exists(LOG_FILE):
         open(LOG_FILE, 'w').close()
         output_text.insert(tk.END, "[INFO] Log file cleared.\n")
 
+def on_close():
+    if process is not None and process.poll() is None:
+        if not messagebox.askyesno("Quit", "A download is still running. Stop it and quit?"):
+            return
+        process.kill()
+    logging.shutdown()
+    root.destroy()
+
 root = tk.Tk()
 root.title("KissKH Subtitle Downloader GUI")
-root.geometry("860x720")
+root.geometry("860x820")
 root.configure(bg="#f7f7f7")
+root.protocol("WM_DELETE_WINDOW", on_close)
 
 start_id = tk.StringVar()
 end_id = tk.StringVar()
@@ -128,11 +277,27 @@ csv_menu.grid(row=7, column=1, sticky="w")
 run_btn = tk.Button(frame, text="Run Downloader", command=run_downloader, bg="#007bff", fg="white", font=("Segoe UI", 10, "bold"))
 run_btn.grid(row=8, column=0, pady=10, sticky="w")
 
+cancel_btn = tk.Button(frame, text="Cancel", command=cancel_run, state="disabled", bg="#fd7e14", fg="white", font=("Segoe UI", 10, "bold"))
+cancel_btn.grid(row=8, column=1, pady=10, sticky="w")
+
 reset_btn = tk.Button(frame, text="New Script", command=new_script, bg="#6c757d", fg="white", font=("Segoe UI", 10, "bold"))
-reset_btn.grid(row=8, column=1, pady=10, sticky="w")
+reset_btn.grid(row=8, column=2, pady=10, sticky="w")
 
 clear_log_btn = tk.Button(frame, text="Clear Log File", command=clear_log_file, bg="#dc3545", fg="white", font=("Segoe UI", 10, "bold"))
-clear_log_btn.grid(row=8, column=2, pady=10, sticky="w")
+clear_log_btn.grid(row=8, column=3, pady=10, sticky="w")
+
+progress_frame = tk.LabelFrame(root, text="Progress", bg="#f7f7f7", padx=10, pady=5)
+progress_frame.pack(padx=15, pady=5, fill="x")
+progress_frame.columnconfigure(1, weight=1)
+
+stage_widgets = {}
+for row, (stage, text) in enumerate(STAGES):
+    tk.Label(progress_frame, text=text, bg="#f7f7f7").grid(row=row, column=0, sticky="w", pady=2)
+    stage_bar = ttk.Progressbar(progress_frame, mode="determinate", maximum=1)
+    stage_bar.grid(row=row, column=1, sticky="ew", padx=10, pady=2)
+    stage_count = tk.Label(progress_frame, text="", bg="#f7f7f7", width=32, anchor="w")
+    stage_count.grid(row=row, column=2, sticky="w")
+    stage_widgets[stage] = (stage_bar, stage_count)
 
 output_frame = tk.LabelFrame(root, text="Output Log", bg="#f7f7f7")
 output_frame.pack(padx=15, pady=5, fill="both", expand=True)
@@ -140,4 +305,5 @@ output_frame.pack(padx=15, pady=5, fill="both", expand=True)
 output_text = tk.Text(output_frame, wrap="word", bg="white", fg="black")
 output_text.pack(padx=5, pady=5, fill="both", expand=True)
 
+root.after(POLL_MS, poll_events)
 root.mainloop()
@@ -0,0 +1,55 @@
+# The async engine must finish, not hang, when every kkey capture fails
+import asyncio
+
+import playwright.async_api
+
+import cli_v8
+
+
+class FailingPlaywright:
+    async def start(self):
+        raise RuntimeError("Executable doesn't exist")
+
+
+class RecordingDownloader:
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, job, subs):
+        self.submitted.append(job)
+
+
+def test_browser_launch_failure_does_not_hang(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(playwright.async_api, "async_playwright", FailingPlaywright)
+    failures = dict(cli_v8.METRICS.failures)
+    # More episodes than the episode queue holds with one capture worker
+    drama = {"Show ID": 1, "Title": "Show", "Episodes": [{"number": n, "id": 1000 + n, "sub": 1} for n in range(1, 11)]}
+    provider = cli_v8.BrowserKkeyProvider(pages=2)
+    downloader = RecordingDownloader()
+    with cli_v8.RecordWriter(cli_v8.DRAMA_SUBTITLES_CSV, cli_v8.TRACK_FIELDS) as writer:
+        asyncio.run(asyncio.wait_for(cli_v8.run_async_engine(
+            1, 1, None, [provider], writer, downloader, drama_data=[drama], capture_limit=1), timeout=30))
+    assert downloader.submitted == []
+    assert provider.misses == 10
+    launch_failures = sum(count for (stage, _), count in cli_v8.METRICS.failures.items() if stage == "browser_launch")
+    assert launch_failures - sum(count for (stage, _), count in failures.items() if stage == "browser_launch") == 1
+
+
+class RaisingProvider(cli_v8.KkeyProvider):
+    name = "raising"
+
+    async def get_kkey_async(self, session, show_id, ep_num, ep_id):
+        raise ValueError("provider bug")
+
+
+def test_capture_error_is_recorded_per_episode(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    drama = {"Show ID": 1, "Title": "Show", "Episodes": [{"number": n, "id": 2000 + n, "sub": 1} for n in range(1, 11)]}
+    manifest = cli_v8.RunManifest(str(tmp_path / "manifest.db"))
+    with cli_v8.RecordWriter(cli_v8.DRAMA_SUBTITLES_CSV, cli_v8.TRACK_FIELDS) as writer:
+        asyncio.run(asyncio.wait_for(cli_v8.run_async_engine(
+            1, 1, None, [RaisingProvider()], writer, RecordingDownloader(), drama_data=[drama], manifest=manifest,
+            capture_limit=1), timeout=30))
+    assert {manifest.episode_state(2000 + n) for n in range(1, 11)} == {"failed"}
+    manifest.close()
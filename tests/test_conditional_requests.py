@@ -0,0 +1,90 @@
+# Step 1 and Step 3 revalidate against tools/stub_server.py, which answers matching
+# If-None-Match / If-Modified-Since with 304
+import threading
+
+import pytest
+
+import cli_v8
+from tools import stub_server
+
+SHOW_ID = stub_server.SYNTHETIC_START + 1
+
+
+class RecordingSession(cli_v8.PooledSession):
+    # Remembers the request headers sent per URL
+    def __init__(self, extra_headers=None):
+        super().__init__()
+        self.extra_headers = extra_headers or {}
+        self.sent = []
+
+    def get(self, url, **kwargs):
+        headers = {**(kwargs.pop("headers", None) or {}), **self.extra_headers}
+        self.sent.append((url, headers))
+        return super().get(url, headers=headers, **kwargs)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    server = stub_server.make_server(port=0, dramas=2, episodes=1)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(cli_v8, "BASE_URL", f"http://127.0.0.1:{server.server_address[1]}")
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def responses_304(kind):
+    return cli_v8.RESPONSES.counts.get(kind, {}).get("304", 0)
+
+
+def test_drama_json_is_revalidated(stub, tmp_path):
+    cache = cli_v8.MetaCache(str(tmp_path / "cache.db"))
+    session = RecordingSession()
+    status, first = cli_v8.fetch_drama(session, SHOW_ID, cache=cache)
+    assert status == "ok"
+    assert "If-None-Match" not in session.sent[-1][1]
+    before = responses_304("drama")
+
+    status, second = cli_v8.fetch_drama(session, SHOW_ID, cache=cache, revalidate=True)
+    headers = session.sent[-1][1]
+    assert status == "ok" and second == first
+    assert "If-None-Match" in headers and "If-Modified-Since" in headers
+    assert stub.state.hits.get("drama_304") == 1
+    assert responses_304("drama") == before + 1
+    cache.close()
+
+
+def test_subtitles_are_revalidated(stub, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    cache = cli_v8.MetaCache(str(tmp_path / "cache.db"))
+    ep_id = SHOW_ID * 1000 + 1
+    job = (SHOW_ID, f"Synthetic Drama {SHOW_ID}", "1", ep_id)
+    subs = cli_v8.fetch_subs(SHOW_ID, "1", ep_id, stub_server.kkey_for(ep_id))
+    assert len(subs) == len(stub_server.LANGUAGES)
+
+    with cli_v8.Downloader(None, workers=2, rate=0, cache=cache) as first:
+        first.submit(job, subs)
+    assert first.stats["tracks"] == len(subs) and first.stats["not_modified"] == 0
+    before = responses_304("subtitle")
+
+    with cli_v8.Downloader(None, workers=2, rate=0, cache=cache) as second:
+        second.session = RecordingSession()
+        second.submit(job, subs)
+    assert second.stats["not_modified"] == len(subs) and second.stats["tracks"] == 0
+    assert all("If-None-Match" in headers and "If-Modified-Since" in headers for _, headers in second.session.sent)
+    assert stub.state.hits.get("subtitle_304") == len(subs)
+    assert responses_304("subtitle") == before + len(subs)
+    cache.close()
+
+
+def test_unexpected_304_without_cache_is_an_error(stub):
+    # A proxy answering 304 to a request that carried no validators
+    session = RecordingSession({"If-None-Match": "*"})
+    assert cli_v8.fetch_drama(session, SHOW_ID) == ("error", None)
+
+
+def test_malformed_episode_number_fails_only_that_id(stub):
+    stub.state.dramas[SHOW_ID]["episodes"][0]["number"] = "special"
+    session = RecordingSession()
+    assert cli_v8.fetch_drama(session, SHOW_ID) == ("error", None)
+    assert cli_v8.fetch_drama(session, SHOW_ID - 1)[0] == "ok"
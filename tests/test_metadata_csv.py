@@ -0,0 +1,51 @@
+# --meta-skip reads drama_subtitles.csv in the current and the old layout
+import csv
+import json
+
+import pytest
+
+import cli_v8
+
+SUBS = [{"src": "https://cdn.example/10583/7/a.en.srt?v=1", "label": "English", "land": "en", "default": True},
+        {"src": "https://cdn.example/10583/7/a.ar.srt?v=1", "label": "Arabic", "land": "ar", "default": False}]
+
+
+def write_csv(path, fields, rows):
+    with open(path, "w", newline="", encoding="utf-8-sig") as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def dramas(tmp_path):
+    path = tmp_path / "drama_details.csv"
+    write_csv(path, cli_v8.EPISODE_FIELDS, [
+        {"Show ID": 10583, "Title": "Zhan Zhao Adventures", "Episode Number": "7", "Episode ID": 213537, "Subtitles": 2},
+        {"Show ID": 10583, "Title": "Zhan Zhao Adventures", "Episode Number": "8", "Episode ID": 213538, "Subtitles": 0},
+        {"Show ID": 10584, "Title": "Other Show", "Episode Number": "1", "Episode ID": 300001, "Subtitles": 2}])
+    return cli_v8.load_dramas(str(path), range(10583, 10584))
+
+
+def test_current_layout(tmp_path, dramas):
+    path = tmp_path / "drama_subtitles.csv"
+    with cli_v8.RecordWriter(str(path), cli_v8.TRACK_FIELDS) as writer:
+        writer.write_rows(cli_v8.track_rows(10583, "Zhan Zhao Adventures", "7", 213537, SUBS))
+        writer.write_rows(cli_v8.track_rows(10584, "Other Show", "1", 300001, SUBS))
+    assert cli_v8.load_known_tracks(str(path), dramas, range(10583, 10584)) == {213537: SUBS}
+
+
+def test_old_layout_is_converted(tmp_path, dramas):
+    path = tmp_path / "drama_subtitles.csv"
+    write_csv(path, ["Title", "Episode Number", "Subtitle Data"], [
+        {"Title": "Zhan Zhao Adventures", "Episode Number": 7, "Subtitle Data": json.dumps(SUBS)},
+        {"Title": "Other Show", "Episode Number": 1, "Subtitle Data": json.dumps(SUBS)},
+        {"Title": "Zhan Zhao Adventures", "Episode Number": 8, "Subtitle Data": "not json"}])
+    assert cli_v8.load_known_tracks(str(path), dramas, range(10583, 10584)) == {213537: SUBS}
+
+
+def test_unknown_layout_fails(tmp_path, dramas):
+    path = tmp_path / "drama_subtitles.csv"
+    write_csv(path, ["Name", "Value"], [{"Name": "a", "Value": "b"}])
+    with pytest.raises(ValueError, match="not a subtitle metadata file"):
+        cli_v8.load_known_tracks(str(path), dramas)
@@ -0,0 +1,29 @@
+# reprocess finds and decrypts every raw extension Step 3 can download
+import base64
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+import cli_v8
+
+TEXT = "1\n00:00:01,000 --> 00:00:02,000\nHello there\n"
+
+
+def encrypted(ext):
+    key, iv = cli_v8.KEYS_BY_EXT[ext]
+    line = base64.b64encode(AES.new(key, AES.MODE_CBC, iv).encrypt(pad(b"Hello there", AES.block_size))).decode()
+    return TEXT.replace("Hello there", line).encode("utf-8")
+
+
+def test_every_raw_extension_is_reprocessed(tmp_path):
+    folder = tmp_path / "Show" / "Episode_1"
+    folder.mkdir(parents=True)
+    for n, ext in enumerate(cli_v8.KEYS_BY_EXT):
+        (folder / f"Track{n}{ext}").write_bytes(encrypted(ext))
+    found = sorted(cli_v8.iter_raw_subtitles(str(tmp_path)))
+    assert [path.rsplit(".", 1)[1] for path in found] == [ext[1:] for ext in cli_v8.KEYS_BY_EXT]
+
+    _, files, unchanged, failed, _, _ = cli_v8.reprocess_chunk(found)
+    assert (files, unchanged, failed) == (len(cli_v8.KEYS_BY_EXT), 0, 0)
+    for n, _ in enumerate(cli_v8.KEYS_BY_EXT):
+        assert "Hello there" in (folder / f"Track{n}.srt").read_text(encoding="utf-8")
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# Decryption throughput: the per-line decrypt_line loop Step 3 used to run versus
+# SubtitleDecryptor, on a synthetic encrypted .txt1 subtitle file.
+#
+#   python tools/bench_decrypt.py --cues 20000 --repeat 3
+import os
+import sys
+import time
+import base64
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+import cli_v8
+
+B64_CHARS = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/="
+
+def legacy_is_encrypted(line):
+    return len(line) > 10 and all(c in B64_CHARS for c in line.strip())
+
+def legacy_decrypt(data, ext):
+    out = []
+    for line in data.decode("utf-8").splitlines(keepends=True):
+        if legacy_is_encrypted(line):
+            out.append(cli_v8.decrypt_line(line, ext) + "\n")
+        else:
+            out.append(line)
+    return "".join(out).encode("utf-8")
+
+def synthetic_file(cues, ext=".txt1"):
+    key, iv = cli_v8.KEYS_BY_EXT[ext]
+    lines = []
+    for i in range(1, cues + 1):
+        start = i * 2000
+        text = f"Line {i}: the quick brown fox jumps over the lazy dog ({i % 97})"
+        encrypted = base64.b64encode(AES.new(key, AES.MODE_CBC, iv).encrypt(pad(text.encode("utf-8"), AES.block_size))).decode()
+        lines.append(f"{i}\n{start // 3600000:02d}:{start // 60000 % 60:02d}:{start // 1000 % 60:02d},{start % 1000:03d} --> "
+                     f"{(start + 1500) // 3600000:02d}:{(start + 1500) // 60000 % 60:02d}:{(start + 1500) // 1000 % 60:02d},{(start + 1500) % 1000:03d}\n"
+                     f"{encrypted}\n\n")
+    return "".join(lines).encode("utf-8")
+
+def best_of(repeat, fn, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark subtitle decryption")
+    parser.add_argument("--cues", type=int, default=20000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--ext", choices=sorted(cli_v8.KEYS_BY_EXT), default=".txt1")
+    args = parser.parse_args()
+
+    data = synthetic_file(args.cues, args.ext)
+    lines = args.cues
+    legacy_time, legacy_out = best_of(args.repeat, legacy_decrypt, data, args.ext)
+    engine_time, engine_out = best_of(args.repeat, cli_v8.decrypt_subtitle, data, args.ext)
+    if legacy_out != engine_out:
+        print("[WARN] Outputs differ between decrypt_line and SubtitleDecryptor")
+    print(f"[INFO] {lines} encrypted lines, {len(data) / 1024:.0f} KiB ({args.ext})")
+    print(f"  decrypt_line loop    {legacy_time:.3f}s  {lines / legacy_time:>12,.0f} lines/s")
+    print(f"  SubtitleDecryptor    {engine_time:.3f}s  {lines / engine_time:>12,.0f} lines/s  ({legacy_time / engine_time:.1f}x)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# Offline benchmarks of cli_v8.py against tools/stub_server.py:
+#
+#   python tools/bench_pipeline.py --dramas 40 --episodes 12 --latency 30 --output bench.json
+#   python tools/bench_pipeline.py --scenario step3 --sub-format txt1 --baseline bench.json
+#
+# The stub runs in this process with synthetic dramas and the requested latency/error
+# injection. Each scenario runs in a child process, so the peak RSS it reports is its own:
+#   step1  fetch_drama_data over the synthetic ID range              (latency per drama request)
+#   step2  fetch_kkey_and_subs_task for every episode with subtitles  (latency per episode)
+#   step3  download_and_decrypt_subs for every episode               (latency per subtitle request)
+#   e2e    cli_v8.main() for the whole range                         (latency per HTTP request)
+# Results are one JSON object per scenario: throughput, p50/p95 latency in ms, errors and
+# peak RSS. With --baseline, a throughput drop beyond --tolerance is reported and exits 1.
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import subprocess
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(TOOLS))
+sys.path.insert(0, TOOLS)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import cli_v8
+import stub_server
+
+SCENARIOS = ["step1", "step2", "step3", "e2e"]
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return round(peak / 1024 / (1024 if sys.platform == "darwin" else 1), 1)
+
+def timed(fn, latencies):
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            latencies.append(time.perf_counter() - start)
+    return wrapper
+
+def episode_jobs(config):
+    # (show_id, title, ep_num, ep_id) of every synthetic episode with subtitles, untimed
+    session = cli_v8.make_session(config["workers"])
+    jobs = []
+    for show_id in range(config["start_id"], config["end_id"] + 1):
+        status, drama = cli_v8.fetch_drama(session, show_id)
+        if status == "ok":
+            jobs += [(show_id, drama["Title"], ep["number"], ep["id"]) for ep in drama["Episodes"] if ep["sub"]]
+    return jobs
+
+def subtitle_list(job, attempts=5):
+    # Setup for step3 only, so injected errors are retried here rather than counted
+    for _ in range(attempts):
+        subs = cli_v8.fetch_subs(job[0], job[2], job[3], stub_server.kkey_for(job[3]))
+        if subs is not None:
+            return subs
+    return None
+
+def run_step1(config, latencies):
+    cli_v8.get_with_retry = timed(cli_v8.get_with_retry, latencies)
+    dramas = cli_v8.fetch_drama_data(config["start_id"], config["end_id"], config["workers"], 0, 0)
+    expected = config["end_id"] - config["start_id"] + 1
+    return len(dramas), "dramas", expected - len(dramas)
+
+def run_step2(config, latencies):
+    jobs = episode_jobs(config)
+    providers = cli_v8.build_kkey_providers(config["kkey"], config["threads"])
+    task = timed(cli_v8.fetch_kkey_and_subs_task, latencies)
+    with ThreadPoolExecutor(max_workers=config["threads"]) as executor:
+        results = list(executor.map(lambda job: task(providers, *job), jobs))
+    for provider in providers:
+        provider.release()
+    return len(jobs), "episodes", sum(result is None for result in results)
+
+def run_step3(config, latencies):
+    jobs = episode_jobs(config)
+    work = [(job, subtitle_list(job)) for job in jobs]
+    expected = sum(len(subs or []) for _, subs in work)
+    cli_v8.get_with_retry = timed(cli_v8.get_with_retry, latencies)
+    session = cli_v8.make_session(config["dl_workers"])
+    with ThreadPoolExecutor(max_workers=config["dl_workers"]) as executor:
+        list(executor.map(lambda item: cli_v8.download_and_decrypt_subs(item[0][1], item[0][2], item[1] or [], None, session), work))
+    saved = sum(name.endswith(".srt") for _, _, files in os.walk(cli_v8.OUTPUT_DIR) for name in files)
+    return saved, "tracks", expected - saved
+
+def run_e2e(config, latencies):
+    cli_v8.get_with_retry = timed(cli_v8.get_with_retry, latencies)
+    sys.argv = ["cli_v8.py", str(config["start_id"]), "-E", str(config["end_id"]), "--base-url", config["base_url"],
+                "-k", config["kkey"], "-t", str(config["threads"]), "-w", str(config["workers"]), "--rate", "0",
+                "--max-missing", "0", "--dl-workers", str(config["dl_workers"]), "--dl-rate", "0",
+                "--dl-inflight", str(config["dl_workers"]), "--no-cache", "--manifest", "bench_manifest.db"]
+    with contextlib.redirect_stdout(sys.stderr):
+        cli_v8.main()
+    saved = sum(name.endswith(".srt") for _, _, files in os.walk(cli_v8.OUTPUT_DIR) for name in files)
+    return saved, "tracks", config["expected_tracks"] - saved
+
+def run_child(name, config):
+    # Runs one scenario in a scratch directory and prints its result as one JSON line
+    cli_v8.BASE_URL = config["base_url"]
+    latencies = []
+    with tempfile.TemporaryDirectory(prefix=f"bench-{name}-") as scratch:
+        os.chdir(scratch)
+        start = time.perf_counter()
+        items, unit, errors = globals()[f"run_{name}"](config, latencies)
+        elapsed = time.perf_counter() - start
+        os.chdir(TOOLS)
+    print(json.dumps({
+        "scenario": name,
+        "items": items,
+        "unit": unit,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(items / elapsed, 2) if elapsed else None,
+        "p50_ms": round(cli_v8.percentile(latencies, 50) * 1000, 1),
+        "p95_ms": round(cli_v8.percentile(latencies, 95) * 1000, 1),
+        "requests": len(latencies),
+        "peak_rss_mb": peak_rss_mb(),
+    }))
+
+def run_scenario(name, config):
+    proc = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", name, "--config", json.dumps(config)],
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE if not config["verbose"] else None, text=True)
+    lines = proc.stdout.strip().splitlines()
+    if proc.returncode != 0 or not lines:
+        print(f"[WARN] Scenario {name} failed (exit {proc.returncode})")
+        if proc.stderr:
+            print(proc.stderr[-2000:])
+        return {"scenario": name, "failed": True}
+    return json.loads(lines[-1])
+
+def compare(results, baseline_path, tolerance):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = {result["scenario"]: result for result in json.load(f)["results"]}
+    regressions = 0
+    for result in results:
+        old = baseline.get(result["scenario"])
+        if not old or not old.get("throughput") or not result.get("throughput"):
+            continue
+        change = result["throughput"] / old["throughput"] - 1
+        flag = change < -tolerance
+        regressions += flag
+        print(f"{'[WARN]' if flag else '[INFO]'} {result['scenario']}: {old['throughput']} -> {result['throughput']} "
+              f"{result['unit']}/s ({change:+.0%}){' regression' if flag else ''}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cli_v8.py against the local stub server")
+    parser.add_argument("--scenario", choices=SCENARIOS + ["all"], default="all")
+    parser.add_argument("--dramas", type=int, default=20, help="Synthetic dramas served by the stub")
+    parser.add_argument("--episodes", type=int, default=8, help="Episodes per synthetic drama")
+    parser.add_argument("--sub-format", choices=stub_server.SUB_FORMATS + ["mixed"], default="mixed")
+    parser.add_argument("--cues", type=int, default=300, help="Cues per subtitle file")
+    parser.add_argument("--latency", type=float, default=20, help="Added latency per response in ms")
+    parser.add_argument("--jitter", type=float, default=5, help="Random +/- ms on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered 503")
+    parser.add_argument("-k", "--kkey", choices=["auto", "http", "browser"], default="http")
+    parser.add_argument("-t", "--threads", type=int, default=6)
+    parser.add_argument("-w", "--workers", type=int, default=8, help="Step 1 metadata workers")
+    parser.add_argument("--dl-workers", type=int, default=8)
+    parser.add_argument("-o", "--output", type=str, help="Write the results to this JSON file")
+    parser.add_argument("--baseline", type=str, help="Earlier --output file to compare throughput against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="Allowed throughput drop against the baseline")
+    parser.add_argument("-v", "--verbose", action="store_true", help="Show the scenarios' own output")
+    parser.add_argument("--child", choices=SCENARIOS, help=argparse.SUPPRESS)
+    parser.add_argument("--config", type=str, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_child(args.child, json.loads(args.config))
+
+    server = stub_server.make_server(dramas=args.dramas, episodes=args.episodes, sub_format=args.sub_format, cues=args.cues,
+                                     latency=args.latency / 1000, jitter=args.jitter / 1000, error_rate=args.error_rate)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    # Encrypt every subtitle file up front so the first scenario does not pay for it
+    for drama in server.state.dramas.values():
+        for ep in drama["episodes"]:
+            for _, code in stub_server.LANGUAGES[:ep["sub"]]:
+                stub_server.subtitle_body(str(drama["id"]), f"{ep['number']:g}", code, server.state.format_for(ep), args.cues)
+    config = {
+        "base_url": f"http://127.0.0.1:{server.server_address[1]}",
+        "start_id": stub_server.SYNTHETIC_START,
+        "end_id": stub_server.SYNTHETIC_START + args.dramas - 1,
+        "expected_tracks": sum(ep["sub"] for drama in server.state.dramas.values() if drama["id"] >= stub_server.SYNTHETIC_START
+                               for ep in drama["episodes"]),
+        "kkey": args.kkey, "threads": args.threads, "workers": args.workers, "dl_workers": args.dl_workers,
+        "verbose": args.verbose,
+    }
+    scenarios = SCENARIOS if args.scenario == "all" else [args.scenario]
+    results = []
+    for name in scenarios:
+        result = run_scenario(name, config)
+        results.append(result)
+        if not result.get("failed"):
+            print(f"[INFO] {name:<6} {result['items']:>6} {result['unit']:<8} {result['elapsed_s']:>7.2f}s "
+                  f"{result['throughput']:>9.1f}/s  p50 {result['p50_ms']:>7.1f}ms  p95 {result['p95_ms']:>7.1f}ms  "
+                  f"errors {result['errors']}  peak RSS {result['peak_rss_mb']} MiB")
+    server.shutdown()
+
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stub": {"dramas": args.dramas, "episodes": args.episodes, "sub_format": args.sub_format, "cues": args.cues,
+                 "latency_ms": args.latency, "jitter_ms": args.jitter, "error_rate": args.error_rate},
+        "settings": {"kkey": args.kkey, "threads": args.threads, "workers": args.workers, "dl_workers": args.dl_workers},
+        "requests_served": server.state.hits,
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"[INFO] Results written to {args.output}")
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# Cue post-processing throughput (the Step 3 --formats/--clean/--dual stage) on a synthetic
+# decrypted .srt with a BOM, CRLF line ends, repeated cues, empty cues and missing blank lines.
+#
+#   python tools/bench_postprocess.py --cues 50000 --repeat 3
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cli_v8
+
+def timestamp(ms):
+    return f"{ms // 3600000:02d}:{ms // 60000 % 60:02d}:{ms // 1000 % 60:02d},{ms % 1000:03d}"
+
+def synthetic_srt(cues, lang="en"):
+    lines = ["\ufeff"]
+    for i in range(1, cues + 1):
+        start = i * 2000
+        text = f"[{lang}] Line {i}:  the quick brown fox <i>jumps</i> over the lazy dog ({i % 97})"
+        if i % 50 == 0:
+            text = ""
+        lines.append(f"{i}\r\n{timestamp(start)} --> {timestamp(start + 1500)}\r\n{text}\r\n")
+        if i % 25 == 0:
+            # The same line again right after it, as split uploads often have
+            lines.append(f"\r\n{i}\r\n{timestamp(start + 1500)} --> {timestamp(start + 1900)}\r\n{text}\r\n")
+        if i % 10:
+            lines.append("\r\n")
+    return "".join(lines).encode("utf-8")
+
+def best_of(repeat, fn, *args):
+    best, result = None, None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def parse_only(data):
+    return sum(1 for _ in cli_v8.iter_cues(data.decode("utf-8-sig").splitlines()))
+
+def parse_clean(data, merge_gap):
+    return sum(1 for _ in cli_v8.clean_cues(cli_v8.iter_cues(data.decode("utf-8-sig").splitlines()), merge_gap))
+
+def render(post, data, final_file):
+    return post.render(data, final_file)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark subtitle cue post-processing")
+    parser.add_argument("--cues", type=int, default=50000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--merge-gap", type=int, default=200)
+    args = parser.parse_args()
+
+    data = synthetic_srt(args.cues)
+    print(f"[INFO] {args.cues} cues, {len(data) / 1024:.0f} KiB of decrypted text")
+    parse_time, parsed = best_of(args.repeat, parse_only, data)
+    clean_time, cleaned = best_of(args.repeat, parse_clean, data, args.merge_gap)
+    print(f"  parse                {parse_time:.3f}s  {parsed / parse_time:>12,.0f} cues/s  ({parsed} cues)")
+    print(f"  parse + clean        {clean_time:.3f}s  {parsed / clean_time:>12,.0f} cues/s  ({cleaned} cues kept)")
+    with tempfile.TemporaryDirectory(prefix="postprocess-") as scratch:
+        final_file = os.path.join(scratch, "English.srt")
+        for formats in (["srt"], ["srt", "vtt"], ["srt", "vtt", "ass"]):
+            post = cli_v8.SubtitlePostProcessor(formats, True, args.merge_gap)
+            elapsed, _ = best_of(args.repeat, render, post, data, final_file)
+            print(f"  render {','.join(formats):<13} {elapsed:.3f}s  {parsed / elapsed:>12,.0f} cues/s")
+    primary = list(cli_v8.iter_cues(data.decode("utf-8-sig").splitlines()))
+    secondary = list(cli_v8.iter_cues(synthetic_srt(args.cues, "id").decode("utf-8-sig").splitlines()))
+    merge_time, merged = best_of(args.repeat, cli_v8.merge_dual, primary, secondary)
+    print(f"  merge_dual           {merge_time:.3f}s  {len(primary) / merge_time:>12,.0f} cues/s  ({len(merged)} cues)")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Startup cost of cli_v8.py, measured with `python -X importtime`:
+#
+#   python tools/bench_startup.py --repeat 7 --max-ms 500
+#
+# Scenarios, each run in a scratch directory:
+#   help         cli_v8.py --help
+#   cache-stats  cli_v8.py --cache-stats on an empty metadata cache
+#   noop         --meta-skip --resume where the CSVs, the manifest and the .srt are already complete
+# Wall time is the best and median of --repeat plain runs; one more run under -X importtime
+# gives the slowest top-level imports and which heavy dependencies got loaded at all.
+# With --max-ms, a scenario whose median is slower exits 1.
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+TOOLS = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(TOOLS)
+CLI = os.path.join(ROOT, "cli_v8.py")
+sys.path.insert(0, ROOT)
+
+import cli_v8
+
+HEAVY = ["requests", "tqdm", "playwright", "Crypto", "aiohttp", "asyncio", "pandas"]
+SCENARIOS = {
+    "help": ["--help"],
+    "cache-stats": ["--cache-stats", "--cache", "bench_cache.db"],
+    "noop": ["90000", "--meta-skip", "--resume", "--no-cache", "--manifest", "bench_manifest.db", "--langs", "en"],
+}
+
+def prepare_noop(scratch):
+    # One drama with one finished English track, recorded as decrypted in the manifest
+    show_id, title, ep_num, ep_id = 90000, "Startup Bench", "1", 990001
+    entry = {"src": "http://127.0.0.1:9/subs/90000-1.en.srt", "label": "English", "land": "en", "default": True}
+    with cli_v8.RecordWriter(os.path.join(scratch, cli_v8.DRAMA_DETAILS_CSV), cli_v8.EPISODE_FIELDS) as writer:
+        writer.write_rows([{"Show ID": show_id, "Title": title, "Episode Number": ep_num, "Episode ID": ep_id, "Subtitles": 1}])
+    with cli_v8.RecordWriter(os.path.join(scratch, cli_v8.DRAMA_SUBTITLES_CSV), cli_v8.TRACK_FIELDS) as writer:
+        writer.write_rows(cli_v8.track_rows(show_id, title, ep_num, ep_id, [entry]))
+    folder = cli_v8.episode_folder(title, ep_num)
+    os.makedirs(os.path.join(scratch, folder))
+    data = b"1\n00:00:01,000 --> 00:00:02,000\nHello\n"
+    with open(os.path.join(scratch, folder, "English.srt"), "wb") as f:
+        f.write(data)
+    cwd = os.getcwd()
+    os.chdir(scratch)
+    try:
+        manifest = cli_v8.RunManifest("bench_manifest.db")
+        manifest.record_episode((show_id, title, ep_num, ep_id), "done", [entry], 1)
+        manifest.record_track(ep_id, entry, os.path.join(folder, "English.srt"), "decrypted", len(data), cli_v8.file_digest(os.path.join(folder, "English.srt")))
+        manifest.close()
+    finally:
+        os.chdir(cwd)
+
+def run_once(args, scratch, importtime=False):
+    command = [sys.executable] + (["-X", "importtime"] if importtime else []) + [CLI] + args
+    start = time.perf_counter()
+    proc = subprocess.run(command, cwd=scratch, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
+    return time.perf_counter() - start, proc
+
+def bare_interpreter():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", "pass"])
+    return time.perf_counter() - start
+
+def parse_importtime(stderr):
+    # [(module, self us, cumulative us, depth)] from the "import time:" lines
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative, name = line[len("import time:"):].split("|", 2)
+        depth = (len(name) - len(name.lstrip(" ")) - 1) // 2
+        imports.append((name.strip(), int(self_us), int(cumulative), depth))
+    return imports
+
+def bench(name, args, repeat, top):
+    with tempfile.TemporaryDirectory(prefix=f"startup-{name}-") as scratch:
+        if name == "noop":
+            prepare_noop(scratch)
+        times = []
+        for _ in range(repeat):
+            elapsed, proc = run_once(args, scratch)
+            if proc.returncode != 0:
+                print(f"[WARN] {name} exited with {proc.returncode}:\n{proc.stderr[-2000:]}")
+                return {"scenario": name, "failed": True}
+            times.append(elapsed)
+        _, proc = run_once(args, scratch, importtime=True)
+    imports = parse_importtime(proc.stderr)
+    loaded = {module for module, _, _, _ in imports}
+    toplevel = sorted((item for item in imports if item[3] == 0), key=lambda item: -item[2])
+    return {
+        "scenario": name,
+        "best_ms": round(min(times) * 1000, 1),
+        "median_ms": round(statistics.median(times) * 1000, 1),
+        "imports_ms": round(sum(item[2] for item in imports if item[3] == 0) / 1000, 1),
+        "heavy_loaded": [module for module in HEAVY if module in loaded],
+        "slowest_imports": [{"module": module, "cumulative_ms": round(cumulative / 1000, 1)} for module, _, cumulative, _ in toplevel[:top]],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure cli_v8.py startup time with -X importtime")
+    parser.add_argument("--scenario", choices=list(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per scenario")
+    parser.add_argument("--top", type=int, default=8, help="Slowest top-level imports to list")
+    parser.add_argument("--max-ms", type=float, help="Exit 1 when a scenario's median wall time is above this")
+    parser.add_argument("-o", "--output", type=str, help="Write the results to this JSON file")
+    args = parser.parse_args()
+
+    interpreter = min(bare_interpreter() for _ in range(max(1, args.repeat)))
+    print(f"[INFO] bare interpreter: {interpreter * 1000:.1f}ms")
+    names = list(SCENARIOS) if args.scenario == "all" else [args.scenario]
+    results = []
+    slow = 0
+    for name in names:
+        result = bench(name, SCENARIOS[name], max(1, args.repeat), args.top)
+        results.append(result)
+        if result.get("failed"):
+            slow += 1
+            continue
+        flag = args.max_ms is not None and result["median_ms"] > args.max_ms
+        slow += flag
+        print(f"{'[WARN]' if flag else '[INFO]'} {name:<12} best {result['best_ms']:>7.1f}ms  median {result['median_ms']:>7.1f}ms  "
+              f"imports {result['imports_ms']:>6.1f}ms  heavy: {', '.join(result['heavy_loaded']) or 'none'}")
+        for item in result["slowest_imports"]:
+            print(f"    {item['module']:<28} {item['cumulative_ms']:>7.1f}ms")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": sys.version.split()[0],
+                       "interpreter_ms": round(interpreter * 1000, 1), "results": results}, f, indent=2)
+        print(f"[INFO] Results written to {args.output}")
+    if slow:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+# Local stand-in for kisskh.ovh and its subtitle CDN, for running cli_v8.py offline:
+#
+#   python tools/stub_server.py --port 8765
+#   python cli_v8.py 10583 --base-url http://127.0.0.1:8765 --kkey http
+#
+# Serves the sample drama JSON in tools/fixtures, a hand-written episode page (which
+# requests /api/Sub/{ep_id}?kkey=... the way the real player does) and an /api/Sub endpoint
+# that only answers for the kkey the page would have sent. Drama JSON and subtitle files
+# carry ETag/Last-Modified and are answered 304 for matching conditional requests.
+#
+# For benchmarks it can also generate synthetic dramas, serve subtitles encrypted like the
+# CDN's .txt/.txt1/.txt2 files, and add latency or random errors to every response:
+#
+#   python tools/stub_server.py --dramas 200 --episodes 16 --sub-format mixed --latency 40 --error-rate 0.01
+import os
+import re
+import sys
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from functools import lru_cache
+from urllib.parse import urlparse, parse_qs
+
+from Crypto.Cipher import AES
+from Crypto.Util.Padding import pad
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cli_v8 import KEYS_BY_EXT
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+LANGUAGES = [("English", "en"), ("Arabic", "ar"), ("Khmer", "km"), ("Indonesia", "id"), ("Malay", "ms")]
+SUB_FORMATS = ["srt", "txt", "txt1", "txt2"]
+SYNTHETIC_START = 90000
+
+def load_dramas():
+    dramas = {}
+    for name in os.listdir(FIXTURES):
+        match = re.fullmatch(r"drama_(\d+)\.json", name)
+        if match:
+            with open(os.path.join(FIXTURES, name), encoding="utf-8") as f:
+                dramas[int(match.group(1))] = json.load(f)
+    return dramas
+
+def synthetic_dramas(count, episodes):
+    # IDs from SYNTHETIC_START; the last episode of every other drama has no subtitles yet
+    dramas = {}
+    for show_id in range(SYNTHETIC_START, SYNTHETIC_START + count):
+        eps = [{"id": show_id * 1000 + n, "number": float(n), "sub": len(LANGUAGES)} for n in range(episodes, 0, -1)]
+        airing = show_id % 2 == 0
+        if airing and eps:
+            eps[0]["sub"] = 0
+        dramas[show_id] = {"id": show_id, "title": f"Synthetic Drama {show_id}", "status": "Ongoing" if airing else "Completed",
+                           "episodesCount": episodes, "episodes": eps}
+    return dramas
+
+def kkey_for(ep_id):
+    return hashlib.sha256(f"kkey:{ep_id}".encode()).hexdigest().upper()
+
+def subtitle_text(show_id, ep_num, lang, cues=20):
+    return "".join(f"{i}\n{i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d},000 --> {i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d},900\n"
+                   f"[{lang}] {show_id} episode {ep_num} line {i}\n\n" for i in range(1, cues + 1))
+
+@lru_cache(maxsize=None)
+def subtitle_body(show_id, ep_num, lang, fmt, cues=20):
+    # The CDN's .txt* files are SRTs whose text lines are each AES-CBC encrypted and base64'd
+    text = subtitle_text(show_id, ep_num, lang, cues)
+    if fmt == "srt":
+        return text.encode("utf-8")
+    key, iv = KEYS_BY_EXT[f".{fmt}"]
+    lines = []
+    for line in text.split("\n"):
+        if line.startswith("["):
+            line = base64.b64encode(AES.new(key, AES.MODE_CBC, iv).encrypt(pad(line.encode("utf-8"), AES.block_size))).decode()
+        lines.append(line)
+    return "\n".join(lines).encode("utf-8")
+
+class StubState:
+    def __init__(self, kkey_mode="inline", dramas=0, episodes=16, sub_format="srt", cues=20,
+                 latency=0.0, jitter=0.0, error_rate=0.0, error_status=503):
+        self.dramas = load_dramas()
+        self.dramas.update(synthetic_dramas(dramas, episodes))
+        self.sub_format = sub_format
+        self.cues = cues
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.random = random.Random(0)
+        self.episodes = {ep["id"]: (drama, ep) for drama in self.dramas.values() for ep in drama["episodes"]}
+        self.kkey_mode = kkey_mode
+        with open(os.path.join(FIXTURES, "episode_page.html"), encoding="utf-8") as f:
+            self.page_template = f.read()
+        self.hits = {}
+        self.started = int(time.time())
+        self._lock = threading.Lock()
+
+    def count(self, route):
+        with self._lock:
+            self.hits[route] = self.hits.get(route, 0) + 1
+
+    def episode_page(self, drama, ep):
+        kkey = kkey_for(ep["id"])
+        if self.kkey_mode == "inline":
+            kkey_expr = json.dumps(kkey)
+        else:
+            # Assembled at runtime, so only a browser can see the final value
+            kkey_expr = f"[{json.dumps(kkey[:32])}, {json.dumps(kkey[32:])}].join(\"\")"
+        page = self.page_template
+        for name, value in (("title", drama["title"]), ("ep_num", f"{ep['number']:g}"), ("show_id", drama["id"]), ("ep_id", ep["id"]), ("kkey_expr", kkey_expr)):
+            page = page.replace("{" + name + "}", str(value))
+        return page
+
+    def delay(self):
+        # Seconds to hold the response, and whether to fail it instead
+        with self._lock:
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter)) if self.latency or self.jitter else 0.0
+            fail = self.error_rate > 0 and self.random.random() < self.error_rate
+        return delay, fail
+
+    def format_for(self, ep):
+        if self.sub_format == "mixed":
+            return SUB_FORMATS[ep["id"] % len(SUB_FORMATS)]
+        return self.sub_format
+
+    def subtitle_list(self, base, drama, ep):
+        digest = hashlib.md5(f"{drama['id']}:{ep['id']}".encode()).hexdigest()
+        number = f"{ep['number']:g}"
+        fmt = self.format_for(ep)
+        return [{
+            "src": f"{base}/auto-upload/{drama['id']}/{number}/{digest}.{code}.{fmt}?v={ep['id']}",
+            "label": label,
+            "land": code,
+            "default": code == "en",
+        } for label, code in LANGUAGES[:ep["sub"]]]
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "kisskh-stub/1.0"
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+    def send(self, status, body=b"", content_type="application/json", headers=None):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_cacheable(self, route, body, content_type):
+        # 200 with ETag/Last-Modified, or an empty 304 when the client's validators match
+        state = self.server.state
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        validators = {"ETag": f'"{hashlib.md5(body).hexdigest()}"', "Last-Modified": formatdate(state.started, usegmt=True)}
+        if_none_match = self.headers.get("If-None-Match")
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_none_match is not None:
+            fresh = validators["ETag"] in [tag.strip() for tag in if_none_match.split(",")] or if_none_match.strip() == "*"
+        elif if_modified_since is not None:
+            try:
+                fresh = parsedate_to_datetime(if_modified_since).timestamp() >= state.started
+            except (TypeError, ValueError):
+                fresh = False
+        else:
+            fresh = False
+        if fresh:
+            state.count(f"{route}_304")
+            return self.send(304, b"", content_type, validators)
+        state.count(route)
+        return self.send(200, body, content_type, validators)
+
+    def do_GET(self):
+        state = self.server.state
+        delay, fail = state.delay()
+        if delay:
+            time.sleep(delay)
+        if fail:
+            state.count("injected_error")
+            return self.send(state.error_status, '{"message": "injected error"}')
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        base = f"http://{self.headers.get('Host', '%s:%d' % self.server.server_address[:2])}"
+
+        match = re.fullmatch(r"/api/DramaList/Drama/(\d+)", url.path)
+        if match:
+            drama = state.dramas.get(int(match.group(1)))
+            if not drama:
+                state.count("drama")
+                return self.send(404, "{}")
+            return self.send_cacheable("drama", json.dumps(drama), "application/json")
+
+        match = re.fullmatch(r"/Drama/[^/]+/Episode-[\d.]+", url.path)
+        if match:
+            state.count("page")
+            found = state.episodes.get(int(query.get("ep", ["0"])[0]))
+            return self.send(200, state.episode_page(*found), "text/html") if found else self.send(404, "Not Found", "text/html")
+
+        match = re.fullmatch(r"/api/Sub/(\d+)", url.path)
+        if match:
+            state.count("sub")
+            found = state.episodes.get(int(match.group(1)))
+            if not found:
+                return self.send(404, "[]")
+            if query.get("kkey", [""])[0] != kkey_for(found[1]["id"]):
+                return self.send(403, '{"message": "invalid kkey"}')
+            return self.send(200, json.dumps(state.subtitle_list(base, *found)))
+
+        if url.path == "/token":
+            state.count("token")
+            return self.send(200, kkey_for(query.get("ep", ["0"])[0]), "text/plain")
+
+        match = re.fullmatch(r"/auto-upload/(\d+)/([\d.]+)/[0-9a-f]+\.(\w+)\.(srt|txt|txt1|txt2)", url.path)
+        if match:
+            show_id, ep_num, lang, fmt = match.groups()
+            return self.send_cacheable("subtitle", subtitle_body(show_id, ep_num, lang, fmt, state.cues),
+                                       "application/x-subrip" if fmt == "srt" else "text/plain")
+
+        self.send(404, "Not Found", "text/plain")
+
+def make_server(host="127.0.0.1", port=0, kkey_mode="inline", verbose=False, **options):
+    # options: dramas, episodes, sub_format, cues, latency/jitter (seconds), error_rate, error_status
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.request_queue_size = 128
+    server.state = StubState(kkey_mode, **options)
+    server.verbose = verbose
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the kisskh API and subtitle CDN")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("-p", "--port", type=int, default=8765)
+    parser.add_argument("--kkey-mode", choices=["inline", "script"], default="inline",
+                        help="inline: kkey is readable from the page HTML; script: only a browser can recover it")
+    parser.add_argument("--dramas", type=int, default=0, help=f"Synthetic dramas to serve from ID {SYNTHETIC_START}")
+    parser.add_argument("--episodes", type=int, default=16, help="Episodes per synthetic drama")
+    parser.add_argument("--sub-format", choices=SUB_FORMATS + ["mixed"], default="srt", help="Subtitle file type served by the CDN routes")
+    parser.add_argument("--cues", type=int, default=20, help="Cues per subtitle file")
+    parser.add_argument("--latency", type=float, default=0, help="Added latency per response in ms")
+    parser.add_argument("--jitter", type=float, default=0, help="Random +/- ms on top of --latency")
+    parser.add_argument("--error-rate", type=float, default=0, help="Fraction of requests answered with --error-status")
+    parser.add_argument("--error-status", type=int, default=503)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.kkey_mode, args.verbose, dramas=args.dramas, episodes=args.episodes,
+                         sub_format=args.sub_format, cues=args.cues, latency=args.latency / 1000, jitter=args.jitter / 1000,
+                         error_rate=args.error_rate, error_status=args.error_status)
+    print(f"[INFO] Stub server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"[INFO] Requests served: {json.dumps(server.state.hits)}")
+
+if __name__ == "__main__":
+    main()